@@ -0,0 +1,137 @@
+# activity_buffer.py - ОТЛОЖЕННАЯ ЗАПИСЬ last_active ПОЛЬЗОВАТЕЛЕЙ
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Настройки буфера (можно переопределить через переменные окружения)
+FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))     # секунды
+FLUSH_BATCH_SIZE = int(os.getenv("ACTIVITY_FLUSH_BATCH", "500"))      # записей до досрочного сброса
+MAX_BUFFER_SIZE = int(os.getenv("ACTIVITY_BUFFER_MAX", "10000"))      # жесткий предел буфера
+
+
+class ActivityBuffer:
+    """
+    Буфер отложенной записи (write-behind) для users.last_active.
+
+    Обновления одного пользователя схлопываются в одну запись, а буфер
+    сбрасывается одним пакетным UPDATE раз в FLUSH_INTERVAL секунд
+    или при накоплении FLUSH_BATCH_SIZE записей. touch() вызывается из
+    event loop и в БД не ходит никогда: при переполнении буфера активность
+    новых пользователей отбрасывается (last_active - не критичные данные),
+    а уже ожидающие записи продолжают схлопываться.
+    """
+
+    def __init__(self, session_factory=None, flush_interval: float = FLUSH_INTERVAL,
+                 batch_size: int = FLUSH_BATCH_SIZE, max_size: int = MAX_BUFFER_SIZE):
+        self._session_factory = session_factory or database.SessionLocal
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_size = max_size
+
+        self._pending: Dict[int, datetime] = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def touch(self, user_id: int, when: Optional[datetime] = None):
+        """Отметить активность пользователя (без записи в БД)"""
+        when = when or datetime.utcnow()
+
+        with self._lock:
+            previous = self._pending.get(user_id)
+            if previous is None and len(self._pending) >= self.max_size:
+                # Буфер переполнен (поток не успевает) - отметку отбрасываем,
+                # синхронный сброс заблокировал бы вызывающий event loop
+                self.dropped += 1
+            elif previous is None or previous < when:
+                self._pending[user_id] = when
+            size = len(self._pending)
+
+        if size >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Записать накопленные значения одним пакетным UPDATE"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+
+            params = [{"b_user_id": user_id, "b_last_active": ts} for user_id, ts in batch.items()]
+            users = database.User.__table__
+            stmt = (
+                update(users)
+                .where(users.c.id == bindparam("b_user_id"))
+                # updated_at оставляем как есть: активность не меняет профиль (и его ETag)
+                .values(last_active=bindparam("b_last_active"), updated_at=users.c.updated_at)
+            )
+
+            session = self._session_factory()
+            try:
+                session.execute(stmt, params)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"❌ Ошибка записи last_active ({len(params)} записей): {e}")
+                # Возвращаем значения в буфер, не затирая более свежие и не превышая предел
+                with self._lock:
+                    for user_id, ts in batch.items():
+                        current = self._pending.get(user_id)
+                        if current is None and len(self._pending) >= self.max_size:
+                            continue
+                        if current is None or current < ts:
+                            self._pending[user_id] = ts
+                return 0
+            finally:
+                session.close()
+
+            return len(params)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                # Финальный сброс выполняет stop()
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка в потоке ActivityBuffer: {e}")
+
+    def start(self):
+        """Запустить фоновый поток сброса"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ActivityBufferFlusher")
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Остановить поток и сбросить остаток буфера (вызывается при остановке сервера)"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        return self.flush()
+
+
+# Общий экземпляр для API и обработчиков авторизации
+activity_buffer = ActivityBuffer()
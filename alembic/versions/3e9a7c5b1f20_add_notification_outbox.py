@@ -0,0 +1,39 @@
+"""add notification outbox
+
+Revision ID: 3e9a7c5b1f20
+Revises: 8d3b6f0a2c71
+Create Date: 2026-10-19 10:31:07.552190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e9a7c5b1f20'
+down_revision = '8d3b6f0a2c71'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'notification_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('kind', sa.String(length=30), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_notification_outbox_id', 'notification_outbox', ['id'])
+    op.create_index('ix_notification_outbox_status_next', 'notification_outbox', ['status', 'next_attempt_at'])
+
+def downgrade():
+    op.drop_index('ix_notification_outbox_status_next', table_name='notification_outbox')
+    op.drop_index('ix_notification_outbox_id', table_name='notification_outbox')
+    op.drop_table('notification_outbox')
@@ -0,0 +1,23 @@
+"""add users.updated_at for ETag
+
+Revision ID: 5c2f8a1d9e47
+Revises: 11366eaaa0d7
+Create Date: 2026-10-19 10:05:12.418233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2f8a1d9e47'
+down_revision = '11366eaaa0d7'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE users SET updated_at = COALESCE(registration_date, last_active)")
+
+def downgrade():
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,30 @@
+"""add user changes feed
+
+Revision ID: 6a1f4c8e2b93
+Revises: 3e9a7c5b1f20
+Create Date: 2026-10-19 12:14:41.208316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1f4c8e2b93'
+down_revision = '3e9a7c5b1f20'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'user_changes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('telegram_id', sa.BigInteger(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_user_changes_changed_at', 'user_changes', ['changed_at'])
+
+def downgrade():
+    op.drop_index('ix_user_changes_changed_at', table_name='user_changes')
+    op.drop_table('user_changes')
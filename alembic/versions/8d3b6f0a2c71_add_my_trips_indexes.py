@@ -0,0 +1,26 @@
+"""add indexes for paginated my trips
+
+Revision ID: 8d3b6f0a2c71
+Revises: 5c2f8a1d9e47
+Create Date: 2026-10-19 10:20:41.093512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3b6f0a2c71'
+down_revision = '5c2f8a1d9e47'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_driver_trips_driver_departure', 'driver_trips', ['driver_id', 'departure_date'])
+    op.create_index('ix_bookings_passenger_booked', 'bookings', ['passenger_id', 'booked_at'])
+    op.create_index('ix_bookings_driver_trip_id', 'bookings', ['driver_trip_id'])
+
+def downgrade():
+    op.drop_index('ix_bookings_driver_trip_id', table_name='bookings')
+    op.drop_index('ix_bookings_passenger_booked', table_name='bookings')
+    op.drop_index('ix_driver_trips_driver_departure', table_name='driver_trips')
@@ -0,0 +1,45 @@
+"""add broadcasts
+
+Revision ID: 9b7d2e4f6a15
+Revises: 6a1f4c8e2b93
+Create Date: 2026-10-19 13:02:18.734412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b7d2e4f6a15'
+down_revision = '6a1f4c8e2b93'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'broadcasts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('segment', sa.String(length=20), nullable=False, server_default='all'),
+        sa.Column('city', sa.String(length=100), nullable=True),
+        sa.Column('created_by', sa.BigInteger(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='running'),
+        sa.Column('last_user_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('enqueued', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('notification_outbox') as batch_op:
+        batch_op.add_column(sa.Column('broadcast_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            'fk_notification_outbox_broadcast_id', 'broadcasts', ['broadcast_id'], ['id'], ondelete='CASCADE'
+        )
+        batch_op.create_index('ix_notification_outbox_broadcast_id', ['broadcast_id'])
+
+def downgrade():
+    with op.batch_alter_table('notification_outbox') as batch_op:
+        batch_op.drop_index('ix_notification_outbox_broadcast_id')
+        batch_op.drop_constraint('fk_notification_outbox_broadcast_id', type_='foreignkey')
+        batch_op.drop_column('broadcast_id')
+    op.drop_table('broadcasts')
@@ -0,0 +1,39 @@
+"""reviews: one review per booking from each participant
+
+Revision ID: a8c4e1f5d237
+Revises: f1b7d3a9c6e2
+Create Date: 2026-10-19 16:02:17.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c4e1f5d237'
+down_revision = 'f1b7d3a9c6e2'
+branch_labels = None
+depends_on = None
+
+# В SQLite исходное ограничение UNIQUE (booking_id) безымянное - batch-режим
+# называет его по этому шаблону при пересоздании таблицы
+NAMING_CONVENTION = {"uq": "uq_%(table_name)s_%(column_0_name)s"}
+
+
+def _booking_unique_name():
+    for constraint in sa.inspect(op.get_bind()).get_unique_constraints('reviews'):
+        if constraint['column_names'] == ['booking_id']:
+            return constraint['name'] or 'uq_reviews_booking_id'
+    return None
+
+def upgrade():
+    name = _booking_unique_name()
+    with op.batch_alter_table('reviews', naming_convention=NAMING_CONVENTION) as batch_op:
+        if name:
+            batch_op.drop_constraint(name, type_='unique')
+        batch_op.create_unique_constraint('uq_reviews_booking_reviewer', ['booking_id', 'reviewer_user_id'])
+
+def downgrade():
+    with op.batch_alter_table('reviews', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('uq_reviews_booking_reviewer', type_='unique')
+        batch_op.create_unique_constraint('uq_reviews_booking_id', ['booking_id'])
@@ -0,0 +1,24 @@
+"""add messages indexes
+
+Revision ID: c4e8a2d6f913
+Revises: 9b7d2e4f6a15
+Create Date: 2026-10-19 13:48:52.610927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a2d6f913'
+down_revision = '9b7d2e4f6a15'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_messages_receiver_unread', 'messages', ['receiver_id', 'is_read', 'sent_at'])
+    op.create_index('ix_messages_pair_sent', 'messages', ['sender_id', 'receiver_id', 'sent_at'])
+
+def downgrade():
+    op.drop_index('ix_messages_pair_sent', table_name='messages')
+    op.drop_index('ix_messages_receiver_unread', table_name='messages')
@@ -0,0 +1,38 @@
+"""add unread message counters
+
+Revision ID: e5a9c3f7b482
+Revises: c4e8a2d6f913
+Create Date: 2026-10-19 14:37:20.164583
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a9c3f7b482'
+down_revision = 'c4e8a2d6f913'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('users', sa.Column('unread_messages', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('bookings', sa.Column('passenger_unread', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('bookings', sa.Column('driver_unread', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE users SET unread_messages = ("
+        "SELECT COUNT(*) FROM messages WHERE messages.receiver_id = users.id AND messages.is_read = false)"
+    )
+    op.execute(
+        "UPDATE bookings SET passenger_unread = ("
+        "SELECT COUNT(*) FROM messages WHERE messages.booking_id = bookings.id "
+        "AND messages.receiver_id = bookings.passenger_id AND messages.is_read = false), "
+        "driver_unread = ("
+        "SELECT COUNT(*) FROM messages WHERE messages.booking_id = bookings.id "
+        "AND messages.receiver_id <> bookings.passenger_id AND messages.is_read = false)"
+    )
+
+def downgrade():
+    op.drop_column('bookings', 'driver_unread')
+    op.drop_column('bookings', 'passenger_unread')
+    op.drop_column('users', 'unread_messages')
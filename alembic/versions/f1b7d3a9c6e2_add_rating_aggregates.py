@@ -0,0 +1,35 @@
+"""add rating aggregates to users
+
+Суммы и количества оценок заполняются из reviews командой: python ratings.py
+
+Revision ID: f1b7d3a9c6e2
+Revises: e5a9c3f7b482
+Create Date: 2026-10-19 15:12:41.873105
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b7d3a9c6e2'
+down_revision = 'e5a9c3f7b482'
+branch_labels = None
+depends_on = None
+
+COLUMNS = tuple(
+    f'{role}_{score}_{part}'
+    for role in ('driver', 'passenger')
+    for score in ('rating', 'punctuality', 'comfort', 'communication')
+    for part in ('sum', 'count')
+)
+
+def upgrade():
+    for name in COLUMNS:
+        op.add_column('users', sa.Column(name, sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_reviews_reviewed_user_id', 'reviews', ['reviewed_user_id'])
+
+def downgrade():
+    op.drop_index('ix_reviews_reviewed_user_id', table_name='reviews')
+    for name in reversed(COLUMNS):
+        op.drop_column('users', name)
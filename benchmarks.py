@@ -0,0 +1,1203 @@
+# benchmarks.py - МИКРОБЕНЧМАРКИ ГОРЯЧИХ ПУТЕЙ API
+# Запуск: python benchmarks.py <имя> (без аргументов - список бенчмарков)
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Регистрирует функцию как бенчмарк"""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def timeit(func, repeat: int) -> float:
+    """Лучшее время одного вызова (секунды) из repeat запусков"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def make_fake_trips(count: int):
+    """Транзиентные ORM-объекты поездок с водителями (без обращения к БД)"""
+    import database
+
+    drivers = [
+        database.User(
+            id=i, telegram_id=100000 + i, first_name=f"Водитель{i}", last_name="Иванов",
+            phone="+79990000000", has_car=True, car_model="Lada Vesta", car_color="белый",
+            car_plate="А001АА77", car_type=database.CarType.SEDAN, driver_rating=4.8
+        )
+        for i in range(1, 51)
+    ]
+    base = datetime(2026, 10, 20, 8, 0)
+    trips = []
+    for i in range(count):
+        departure = base + timedelta(minutes=15 * i)
+        trips.append(database.DriverTrip(
+            id=i + 1, driver=drivers[i % len(drivers)],
+            departure_date=departure, departure_time=departure.strftime("%H:%M"),
+            estimated_arrival=departure + timedelta(hours=3),
+            start_address=f"Москва, ул. Тверская, д. {i % 100}", start_city="Москва",
+            finish_address=f"Тверь, ул. Советская, д. {i % 50}", finish_city="Тверь",
+            available_seats=3, price_per_seat=500.0 + i % 7 * 50,
+            comment="Без животных, небольшой багаж", status=database.TripStatus.ACTIVE
+        ))
+    return trips
+
+
+def make_search_rows(count: int):
+    """Строки проекции queries.SEARCH_TRIP_COLUMNS, как их получает search_trips (SQLite в памяти)"""
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session
+    import database
+    import queries
+
+    engine = create_engine("sqlite://")
+    database.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add_all(make_fake_trips(count))
+        db.commit()
+        rows = db.execute(
+            select(*queries.SEARCH_TRIP_COLUMNS).join(
+                database.User, database.User.id == database.DriverTrip.driver_id
+            ).order_by(database.DriverTrip.id)
+        ).all()
+    engine.dispose()
+    return rows
+
+
+def legacy_search_payload(trips):
+    """Прежняя сборка ответа поиска (два strftime на строку)"""
+    result = []
+    for trip in trips:
+        driver = trip.driver
+        result.append({
+            "id": trip.id,
+            "driver": {
+                "id": driver.id,
+                "name": f"{driver.first_name} {driver.last_name or ''}".strip(),
+                "rating": driver.driver_rating,
+                "avatar_initials": f"{driver.first_name[0]}{driver.last_name[0] if driver.last_name else ''}"
+            },
+            "route": {
+                "from": trip.start_address,
+                "to": trip.finish_address,
+                "from_city": trip.start_city,
+                "to_city": trip.finish_city
+            },
+            "departure": {
+                "date": trip.departure_date.strftime("%Y-%m-%d"),
+                "time": trip.departure_time,
+                "datetime": trip.departure_date.strftime("%d.%m.%Y %H:%M")
+            },
+            "seats": {
+                "available": trip.available_seats,
+                "price_per_seat": trip.price_per_seat
+            },
+            "car_info": {
+                "model": driver.car_model,
+                "color": driver.car_color
+            } if driver.has_car else None,
+            "details": {
+                "comment": trip.comment
+            },
+            "status": trip.status.value,
+            "estimated_arrival": trip.estimated_arrival.isoformat() if hasattr(trip, 'estimated_arrival') and trip.estimated_arrival else None
+        })
+    return {"success": True, "count": len(result), "trips": result}
+
+
+@benchmark("serialization")
+def bench_serialization(args):
+    """Сериализация ответа поиска: прежний путь FastAPI против serializers + orjson"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from serializers import FastJSONResponse, encode_trip_search_row
+
+    trips = make_fake_trips(args.trips)
+    rows = make_search_rows(args.trips)
+
+    def legacy():
+        # Так FastAPI обрабатывал dict из эндпоинта: jsonable_encoder + JSONResponse
+        JSONResponse(jsonable_encoder(legacy_search_payload(trips)))
+
+    def fast():
+        # Путь search_trips: строки проекции -> encode_trip_search_row -> orjson
+        result = [encode_trip_search_row(row) for row in rows]
+        FastJSONResponse({"success": True, "count": len(result), "trips": result})
+
+    legacy_time = timeit(legacy, args.repeat)
+    fast_time = timeit(fast, args.repeat)
+
+    print(f"Поездок в ответе: {args.trips}, повторов: {args.repeat} ({FastJSONResponse.__name__})")
+    print(f"  прежний путь:  {legacy_time * 1e6 / args.trips:8.2f} мкс/поездка")
+    print(f"  быстрый путь:  {fast_time * 1e6 / args.trips:8.2f} мкс/поездка")
+    print(f"  ускорение:     {legacy_time / fast_time:8.2f}x")
+
+
+@benchmark("compression")
+def bench_compression(args):
+    """Сжатие ответа поиска: CPU против сэкономленных байт для gzip/brotli"""
+    from compression import brotli, compress_body
+    from serializers import FastJSONResponse, encode_trip_search_row
+
+    settings = [("gzip", level) for level in (1, 4, 6, 9)]
+    if brotli is not None:
+        settings += [("br", quality) for quality in (1, 4, 6, 9, 11)]
+    else:
+        print("⚠️  Пакет brotli не установлен - только gzip")
+
+    for count in (10, 100, args.trips):
+        result = [encode_trip_search_row(row) for row in make_search_rows(count)]
+        body = FastJSONResponse({"success": True, "count": len(result), "trips": result}).body
+
+        print(f"\nОтвет поиска: {count} поездок, {len(body)} байт")
+        print(f"  {'кодек':8s} {'ур.':>4s} {'байт':>9s} {'сжатие':>7s} {'мс CPU':>8s} {'МБ/с':>8s}")
+        for encoding, level in settings:
+            kwargs = {"gzip_level": level} if encoding == "gzip" else {"brotli_quality": level}
+            compressed = compress_body(body, encoding, **kwargs)
+            elapsed = timeit(lambda: compress_body(body, encoding, **kwargs), args.repeat)
+            print(f"  {encoding:8s} {level:4d} {len(compressed):9d} {len(body) / len(compressed):6.1f}x "
+                  f"{elapsed * 1000:8.3f} {len(body) / elapsed / 1e6:8.1f}")
+
+
+@benchmark("sqlite")
+def bench_sqlite(args):
+    """SQLite: параллельные чтение/запись с настройками по умолчанию и с тюнингом из database.py"""
+    import sqlite3
+    import tempfile
+    import threading
+    from sqlalchemy import create_engine
+    import database
+
+    duration = args.duration
+    readers, writers = args.readers, args.writers
+
+    def prepare(path):
+        engine = create_engine(f"sqlite:///{path}")
+        database.Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO users (id, telegram_id, first_name) VALUES (1, 1, 'Водитель')")
+        base = datetime(2026, 10, 20, 8, 0)
+        conn.executemany(
+            "INSERT INTO driver_trips (driver_id, departure_date, start_address, finish_address, "
+            "start_city, finish_city, available_seats, price_per_seat, status) "
+            "VALUES (1, ?, 'Москва, ул. Тверская', 'Тверь, ул. Советская', 'Москва', 'Тверь', 3, 500, 'ACTIVE')",
+            [((base + timedelta(minutes=i)).isoformat(" "),) for i in range(5000)]
+        )
+        conn.commit()
+        conn.close()
+
+    def run(path, pragmas):
+        counters = {"reads": 0, "writes": 0, "locked": 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def connect():
+            # Как в приложении: стандартный таймаут драйвера, поверх него - PRAGMA из database.py
+            conn = sqlite3.connect(path, check_same_thread=False)
+            if pragmas:
+                database.apply_sqlite_pragmas(conn, pragmas)
+            return conn
+
+        def reader():
+            conn = connect()
+            while not stop.is_set():
+                try:
+                    conn.execute(
+                        "SELECT id, departure_date, price_per_seat FROM driver_trips "
+                        "WHERE status = 'ACTIVE' AND start_city = 'Москва' AND available_seats >= 1 "
+                        "ORDER BY departure_date LIMIT 50"
+                    ).fetchall()
+                    key = "reads"
+                except sqlite3.OperationalError:
+                    key = "locked"
+                with lock:
+                    counters[key] += 1
+            conn.close()
+
+        def writer():
+            conn = connect()
+            while not stop.is_set():
+                try:
+                    conn.execute("UPDATE driver_trips SET available_seats = 3 - available_seats % 3 "
+                                 "WHERE id = abs(random()) % 5000 + 1")
+                    conn.execute("INSERT INTO bookings (driver_trip_id, passenger_id, booked_seats, status) "
+                                 "VALUES (abs(random()) % 5000 + 1, 1, 1, 'ACTIVE')")
+                    conn.commit()
+                    key = "writes"
+                except sqlite3.OperationalError:
+                    conn.rollback()
+                    key = "locked"
+                with lock:
+                    counters[key] += 1
+            conn.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        threads += [threading.Thread(target=writer) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return counters
+
+    print(f"Читателей: {readers}, писателей: {writers}, {duration} сек на прогон")
+    print(f"PRAGMA после тюнинга: {database.SQLITE_PRAGMAS}")
+    print(f"  {'режим':12s} {'чтений/с':>10s} {'записей/с':>10s} {'locked':>8s}")
+    for label, pragmas in (("по умолчанию", None), ("тюнинг", database.SQLITE_PRAGMAS)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            prepare(path)
+            counters = run(path, pragmas)
+        print(f"  {label:12s} {counters['reads'] / duration:10.0f} {counters['writes'] / duration:10.0f} "
+              f"{counters['locked']:8d}")
+
+
+@benchmark("statements")
+def bench_statements(args):
+    """Горячие запросы: сборка ORM-запроса на каждый вызов против готовых запросов из queries.py"""
+    import tempfile
+    from sqlalchemy import create_engine, or_, select
+    from sqlalchemy.orm import Session
+    import database
+    import queries
+
+    User, DriverTrip, TripStatus = database.User, database.DriverTrip, database.TripStatus
+    day = datetime(2026, 10, 20)
+    calls = args.repeat * 50
+
+    def legacy_user(db):
+        return db.query(User).filter(User.telegram_id == 100001).first()
+
+    def fast_user(db):
+        return db.execute(queries.USER_BY_TELEGRAM_ID, {"telegram_id": 100001}).scalars().first()
+
+    def legacy_etag(db):
+        return db.query(
+            DriverTrip.updated_at, DriverTrip.status, DriverTrip.available_seats, User.updated_at
+        ).join(User, User.id == DriverTrip.driver_id).filter(DriverTrip.id == 1).first()
+
+    def fast_etag(db):
+        return db.execute(queries.TRIP_ETAG_ROW, {"trip_id": 1}).first()
+
+    def legacy_search(db):
+        # Та же проекция, что в queries.search_trips_statement, но собранная на каждый вызов
+        query = select(*queries.SEARCH_TRIP_COLUMNS).join(User, User.id == DriverTrip.driver_id).where(
+            DriverTrip.status == TripStatus.ACTIVE,
+            DriverTrip.available_seats >= 1,
+            DriverTrip.departure_date >= day,
+            DriverTrip.departure_date < day + timedelta(days=1)
+        )
+        query = query.where(or_(DriverTrip.start_city.ilike("%Москва%"), DriverTrip.start_address.ilike("%Москва%")))
+        query = query.where(or_(DriverTrip.finish_city.ilike("%Тверь%"), DriverTrip.finish_address.ilike("%Тверь%")))
+        query = query.where(DriverTrip.price_per_seat <= 1000)
+        query = query.order_by(DriverTrip.departure_date.asc(), DriverTrip.price_per_seat.asc())
+        return db.execute(query).all()
+
+    def fast_search(db):
+        statement, params = queries.search_trips_params(
+            "Москва", "Тверь", 1000, 1, day, day + timedelta(days=1)
+        )
+        return db.execute(statement, params).all()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            # 5 поездок на выбранный день - чтобы время выборки не заслоняло сборку запроса
+            db.add_all(make_fake_trips(5))
+            db.commit()
+
+        print(f"Вызовов на замер: {calls} (лучший из {args.repeat // 4 or 1} прогонов)")
+        print(f"  {'запрос':16s} {'прежний, мкс':>13s} {'готовый, мкс':>13s} {'экономия, мкс':>14s}")
+        for label, legacy, fast in (("user по tg_id", legacy_user, fast_user),
+                                    ("etag поездки", legacy_etag, fast_etag),
+                                    ("поиск", legacy_search, fast_search)):
+            with Session(engine) as db:
+                assert legacy(db) and fast(db)
+
+                def run(func):
+                    for _ in range(calls):
+                        func(db)
+                        db.expunge_all()
+
+                legacy_time = timeit(lambda: run(legacy), args.repeat // 4 or 1) / calls * 1e6
+                fast_time = timeit(lambda: run(fast), args.repeat // 4 or 1) / calls * 1e6
+            print(f"  {label:16s} {legacy_time:13.1f} {fast_time:13.1f} {legacy_time - fast_time:14.1f}")
+        engine.dispose()
+
+
+@benchmark("projection")
+def bench_projection(args):
+    """Память и время выборки поиска: ORM-объекты DriverTrip+User против проекции колонок"""
+    import gc
+    import tempfile
+    import tracemalloc
+    from sqlalchemy import create_engine, or_, select
+    from sqlalchemy.orm import Session, joinedload
+    import database
+    import queries
+    from serializers import encode_trip_search_row
+
+    DriverTrip, TripStatus = database.DriverTrip, database.TripStatus
+    count = args.rows
+    day = datetime(2026, 10, 20)
+    statement_args = ("Москва", "Тверь", None, 1, day, day + timedelta(days=365))
+    # Прежний поиск: ORM-объекты поездок с водителем, те же фильтры и порядок
+    orm_statement = select(DriverTrip).options(joinedload(DriverTrip.driver)).where(
+        DriverTrip.status == TripStatus.ACTIVE,
+        DriverTrip.available_seats >= 1,
+        DriverTrip.departure_date >= day,
+        DriverTrip.departure_date < day + timedelta(days=365),
+        or_(DriverTrip.start_city.ilike("%Москва%"), DriverTrip.start_address.ilike("%Москва%")),
+        or_(DriverTrip.finish_city.ilike("%Тверь%"), DriverTrip.finish_address.ilike("%Тверь%"))
+    ).order_by(DriverTrip.departure_date.asc(), DriverTrip.price_per_seat.asc())
+    # Реалистичные тяжелые поля: точки маршрута и закодированная линия для карты
+    route_points = [{"lat": 55.75 + i / 1000, "lng": 37.62 + i / 1000} for i in range(50)]
+    polyline = "o}~tIqbfcF" * 100
+
+    def load(db, rows):
+        if not rows:
+            return db.execute(orm_statement).scalars().all()
+        statement, params = queries.search_trips_params(*statement_args)
+        return db.execute(statement, params).all()
+
+    def measure(rows):
+        # Время - отдельным прогоном: tracemalloc сильно замедляет выделение памяти
+        with Session(engine) as db:
+            started = time.perf_counter()
+            load(db, rows)
+            elapsed = time.perf_counter() - started
+        with Session(engine) as db:
+            gc.collect()
+            tracemalloc.start()
+            loaded = load(db, rows)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            # Проекцию кодирует тот же encode_trip_search_row, что и search_trips
+            ids = [item["id"] for item in map(encode_trip_search_row, loaded)] if rows else \
+                [trip.id for trip in loaded]
+        return len(loaded), elapsed, current, peak, ids
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            trips = make_fake_trips(count)
+            for trip in trips:
+                trip.route_points = route_points
+                trip.polyline = polyline
+                trip.route_polyline = polyline
+            db.add_all(trips)
+            db.commit()
+
+        load_rows = measure(False)
+        load_projection = measure(True)
+        engine.dispose()
+
+    assert load_rows[4] == load_projection[4], "выборки ORM и проекции различаются"
+    print(f"Строк в выборке: {load_rows[0]}")
+    print(f"  {'вариант':12s} {'мс':>8s} {'держит, МБ':>11s} {'пик, МБ':>9s} {'байт/строка':>12s}")
+    for label, (rows, elapsed, current, peak, _) in (("ORM", load_rows), ("проекция", load_projection)):
+        print(f"  {label:12s} {elapsed * 1000:8.1f} {current / 2**20:11.2f} {peak / 2**20:9.2f} {current / rows:12.0f}")
+
+
+@benchmark("export")
+def bench_export(args):
+    """Потоковая выгрузка: пиковая память не зависит от числа строк (exports.py)"""
+    import sqlite3
+    import tempfile
+    import tracemalloc
+    from sqlalchemy import create_engine
+    import database
+    import exports
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        database.Base.metadata.create_all(bind=engine)
+        # Подменяем движок выгрузки на временную базу
+        primary, replica = database.engine, database.replica_engine
+        database.engine, database.replica_engine = engine, None
+        try:
+            total = 0
+            print(f"  {'строк':>9s} {'формат':7s} {'МБ отдано':>10s} {'пик памяти, МБ':>15s} {'сек':>6s}")
+            for rows in (args.rows, args.rows * 10):
+                conn = sqlite3.connect(path)
+                conn.executemany(
+                    "INSERT INTO users (telegram_id, first_name, last_name, phone, registration_date) "
+                    "VALUES (?, 'Пользователь', 'Иванов', '+79990000000', '2026-10-01 12:00:00')",
+                    [(total + i,) for i in range(rows - total)]
+                )
+                conn.commit()
+                conn.close()
+                total = rows
+                for fmt in ("ndjson", "csv"):
+                    tracemalloc.start()
+                    started = time.perf_counter()
+                    sent = sum(len(chunk) for chunk in exports.FORMATS[fmt]("users"))
+                    elapsed = time.perf_counter() - started
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    print(f"  {rows:9d} {fmt:7s} {sent / 2**20:10.1f} {peak / 2**20:15.2f} {elapsed:6.1f}")
+        finally:
+            database.engine, database.replica_engine = primary, replica
+            engine.dispose()
+
+
+@benchmark("bot_concurrency")
+def bench_bot_concurrency(args):
+    """Бот: задержка event loop при запросах к БД прямо в обработчике и через пул bot_db"""
+    import asyncio
+    import tempfile
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import Session, sessionmaker
+    import database
+    import bot_db
+
+    latency = 0.05  # Имитация сетевой задержки до удаленной БД на каждый запрос
+    commands = args.repeat
+
+    async def run(offload: bool):
+        lag = 0.0
+        stop = asyncio.Event()
+
+        async def heartbeat():
+            # Насколько позже срока просыпается задача - столько ждут остальные чаты
+            nonlocal lag
+            while not stop.is_set():
+                expected = time.perf_counter() + 0.01
+                await asyncio.sleep(0.01)
+                lag = max(lag, time.perf_counter() - expected)
+
+        async def stats_handler():
+            if offload:
+                return await bot_db.run_db(bot_db.fetch_stats)
+            return bot_db.fetch_stats()
+
+        beat = asyncio.create_task(heartbeat())
+        await asyncio.sleep(0.02)
+        started = time.perf_counter()
+        await asyncio.gather(*(stats_handler() for _ in range(commands)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await beat
+        return elapsed, lag
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            db.add_all(make_fake_trips(50))
+            db.commit()
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def slow_network(conn, cursor, statement, parameters, context, executemany):
+            time.sleep(latency)
+
+        session_factory = database.SessionLocal
+        database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        try:
+            print(f"Команд /stats одновременно: {commands}, задержка запроса {latency * 1000:.0f} мс, "
+                  f"потоков в пуле: {bot_db.BOT_DB_WORKERS}")
+            print(f"  {'вариант':22s} {'всего, сек':>11s} {'макс. задержка loop, мс':>24s}")
+            for label, offload in (("прямо в обработчике", False), ("через bot_db.run_db", True)):
+                elapsed, lag = asyncio.run(run(offload))
+                print(f"  {label:22s} {elapsed:11.2f} {lag * 1000:24.1f}")
+        finally:
+            database.SessionLocal = session_factory
+            bot_db.shutdown()
+            engine.dispose()
+
+
+@benchmark("notifications")
+def bench_notifications(args):
+    """Диспетчер уведомлений против заглушки Bot API: лимиты 30/сек и 1/сек на чат, 429, повторы"""
+    import asyncio
+    import socket
+    import tempfile
+    import threading
+    from collections import defaultdict
+    import uvicorn
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session, sessionmaker
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+    import database
+    import notifications
+
+    chats, per_chat = 40, 3
+    blocked_chat, flooded_chat = 1000, 1001
+    deliveries = defaultdict(list)
+    flood_answered = []
+
+    async def send_message(request):
+        data = await request.json()
+        chat_id = int(data["chat_id"])
+        if chat_id == blocked_chat:
+            return JSONResponse({"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}, 403)
+        if chat_id == flooded_chat and not flood_answered:
+            flood_answered.append(time.perf_counter())
+            return JSONResponse({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 2",
+                                 "parameters": {"retry_after": 2}}, 429)
+        deliveries[chat_id].append(time.perf_counter())
+        return JSONResponse({"ok": True, "result": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}}})
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        Starlette(routes=[Route("/bot{token}/sendMessage", send_message, methods=["POST"])]),
+        host="127.0.0.1", port=port, log_level="warning"
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        session_factory = database.SessionLocal
+        database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        backoff_base = notifications.NOTIFY_BACKOFF_BASE
+        notifications.NOTIFY_BACKOFF_BASE = 0.1
+        try:
+            with Session(engine) as db:
+                rows = [
+                    database.NotificationOutbox(chat_id=chat_id, kind="bench", text=f"#{n} в чат {chat_id}")
+                    for n in range(per_chat) for chat_id in range(1, chats + 1)
+                ]
+                rows += [database.NotificationOutbox(chat_id=chat_id, kind="bench", text="x")
+                         for chat_id in (blocked_chat, flooded_chat, flooded_chat)]
+                db.add_all(rows)
+                db.commit()
+            total = len(rows)
+
+            async def run():
+                dispatcher = notifications.NotificationDispatcher(
+                    token="bench", api_base=f"http://127.0.0.1:{port}", poll_interval=0.05
+                )
+                await dispatcher.start()
+                started = time.perf_counter()
+                while True:
+                    counts = await asyncio.to_thread(notifications.outbox_counts)
+                    if not counts.get(notifications.PENDING):
+                        break
+                    await asyncio.sleep(0.05)
+                elapsed = time.perf_counter() - started
+                await dispatcher.stop()
+                return elapsed, counts, dispatcher.counters
+
+            elapsed, counts, counters = asyncio.run(run())
+        finally:
+            database.SessionLocal = session_factory
+            notifications.NOTIFY_BACKOFF_BASE = backoff_base
+            server.should_exit = True
+            engine.dispose()
+
+    stamps = sorted(stamp for chat in deliveries.values() for stamp in chat)
+    # Максимум доставок в любом окне в 1 секунду
+    busiest = max(sum(1 for other in stamps[i:] if other - stamp < 1.0) for i, stamp in enumerate(stamps))
+    chat_gaps = [b - a for chat in deliveries.values() for a, b in zip(chat, chat[1:])]
+    flood_wait = deliveries[flooded_chat][0] - flood_answered[0] if flood_answered else 0.0
+
+    print(f"Уведомлений: {total} ({chats} чатов x {per_chat}, + заблокированный чат и чат с 429)")
+    print(f"  итог outbox:                {counts}")
+    print(f"  счетчики диспетчера:        {dict(counters)}")
+    print(f"  время до пустой очереди:    {elapsed:.2f} сек")
+    print(f"  макс. доставок за 1 сек:    {busiest} (лимит {notifications.NOTIFY_GLOBAL_RATE:g})")
+    print(f"  мин. интервал в одном чате: {min(chat_gaps):.3f} сек (лимит {1 / notifications.NOTIFY_CHAT_RATE:g})")
+    print(f"  повтор после 429:           через {flood_wait:.2f} сек (retry_after 2)")
+
+
+@benchmark("broadcast")
+def bench_broadcast(args):
+    """Рассылка против заглушки Bot API с лимитом 30/сек: скорость, 429, продолжение после падения"""
+    import asyncio
+    import contextlib
+    import socket
+    import tempfile
+    import threading
+    from collections import Counter, deque
+    import uvicorn
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session, sessionmaker
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+    import database
+    import notifications
+    import broadcasts
+
+    users = args.repeat * 15
+    limit = 30  # Лимит Telegram на бота
+    deliveries = Counter()
+    stamps = []
+    window = deque()
+    rejected = []
+
+    async def send_message(request):
+        # Как Telegram: больше limit сообщений за скользящую секунду - 429
+        data = await request.json()
+        now = time.perf_counter()
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        if len(window) >= limit:
+            rejected.append(now)
+            return JSONResponse({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                 "parameters": {"retry_after": 1}}, 429)
+        window.append(now)
+        stamps.append(now)
+        deliveries[int(data["chat_id"])] += 1
+        return JSONResponse({"ok": True, "result": {"message_id": 1, "date": 0, "chat": {"id": 0, "type": "private"}}})
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        Starlette(routes=[Route("/bot{token}/sendMessage", send_message, methods=["POST"])]),
+        host="127.0.0.1", port=port, log_level="warning"
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    async def start_workers():
+        dispatcher = notifications.NotificationDispatcher(
+            token="bench", api_base=f"http://127.0.0.1:{port}", poll_interval=0.05
+        )
+        broadcaster = broadcasts.Broadcaster(batch_size=100, max_pending=200, poll_interval=0.05)
+        await dispatcher.start()
+        await broadcaster.start()
+        return dispatcher, broadcaster
+
+    async def crash(dispatcher, broadcaster):
+        # Без stop(): как при падении процесса, взятые пачки остаются арендованными
+        for task in (dispatcher._task, broadcaster._task):
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        await dispatcher._client.aclose()
+
+    async def run(broadcast_id):
+        dispatcher, broadcaster = await start_workers()
+        started = time.perf_counter()
+        await asyncio.sleep(users / limit / 3)
+        await crash(dispatcher, broadcaster)
+        crashed_at = sum(deliveries.values())
+        dispatcher, broadcaster = await start_workers()
+        while True:
+            progress = await asyncio.to_thread(broadcasts.broadcast_progress, broadcast_id)
+            if progress["status"] != broadcasts.RUNNING and not progress["messages"].get(notifications.PENDING):
+                break
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        await broadcaster.stop()
+        await dispatcher.stop()
+        return elapsed, crashed_at, progress
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            db.add_all(
+                database.User(telegram_id=10 ** 6 + i, first_name=f"U{i}", has_car=i % 3 == 0)
+                for i in range(users)
+            )
+            db.commit()
+        session_factory = database.SessionLocal
+        database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        lease = notifications.NOTIFY_LEASE_SECONDS
+        notifications.NOTIFY_LEASE_SECONDS = 1
+        try:
+            broadcast_id, recipients = broadcasts.create_broadcast("Бенчмарк рассылки", "all")
+            elapsed, crashed_at, progress = asyncio.run(run(broadcast_id))
+        finally:
+            database.SessionLocal = session_factory
+            notifications.NOTIFY_LEASE_SECONDS = lease
+            server.should_exit = True
+            engine.dispose()
+
+    busiest = max(sum(1 for other in stamps[i:] if other - stamp < 1.0) for i, stamp in enumerate(stamps))
+    # Скорость без паузы на аренду после "падения": от первой до последней доставки за вычетом простоя
+    gaps = sorted(b - a for a, b in zip(stamps, stamps[1:]))
+    steady = (stamps[-1] - stamps[0] - gaps[-1]) / (len(stamps) - 2) if len(stamps) > 2 else 0.0
+
+    print(f"Получателей: {recipients}, лимит заглушки: {limit:g} сообщ. за скользящую секунду")
+    print(f"  итог рассылки:              {progress['status']}, в очереди {progress['enqueued']}, {progress['messages']}")
+    print(f"  время (с падением):         {elapsed:.2f} сек, до падения доставлено {crashed_at}")
+    print(f"  доставлено чатам:           {len(deliveries)} из {recipients}, "
+          f"повторно: {sum(count - 1 for count in deliveries.values())}")
+    print(f"  ответов 429:                {len(rejected)}")
+    print(f"  макс. доставок за 1 сек:    {busiest}")
+    print(f"  скорость без простоя:       {1 / steady if steady else 0:.1f} сообщ./сек "
+          f"(NOTIFY_GLOBAL_RATE={notifications.NOTIFY_GLOBAL_RATE:g})")
+
+
+@benchmark("messages_wait")
+def bench_messages_wait(args):
+    """Ожидание сообщений: опрос БД раз в секунду против long-poll через message_hub"""
+    import asyncio
+    import random
+    import tempfile
+    from sqlalchemy import event, insert
+    from sqlalchemy.ext.asyncio import create_async_engine
+    import database
+    import queries
+    from message_hub import MessageHub
+    from serializers import encode_message
+
+    clients = 500
+    messages = 50
+    duration = args.duration
+    poll_interval = 1.0
+
+    async def run(engine, long_poll: bool):
+        hub = MessageHub()
+        seen = {}
+        stop = asyncio.Event()
+
+        async def unread(user_id, after_id):
+            async with engine.connect() as conn:
+                result = await conn.execute(queries.UNREAD_AFTER, {"user_id": user_id, "after_id": after_id, "limit": 100})
+                return result.all()
+
+        async def client(user_id):
+            after_id = 0
+            while not stop.is_set():
+                if long_poll:
+                    with hub.subscribe(user_id) as inbox:
+                        rows = await unread(user_id, after_id)
+                        if not rows:
+                            try:
+                                rows = [await asyncio.wait_for(inbox.get(), duration)]
+                            except asyncio.TimeoutError:
+                                rows = []
+                else:
+                    rows = await unread(user_id, after_id)
+                    if not rows:
+                        try:
+                            await asyncio.wait_for(stop.wait(), poll_interval)
+                        except asyncio.TimeoutError:
+                            pass
+                now = time.perf_counter()
+                for row in rows:
+                    message_id = row["id"] if long_poll else row.id
+                    seen.setdefault(message_id, now)
+                    after_id = max(after_id, message_id)
+
+        async def sender():
+            sent = {}
+            rng = random.Random(1)
+            for _ in range(messages):
+                await asyncio.sleep(rng.uniform(0, 2 * duration / messages))
+                async with engine.begin() as conn:
+                    result = await conn.execute(insert(database.Message).returning(*queries.MESSAGE_COLUMNS), {
+                        "sender_id": 0, "receiver_id": rng.randrange(1, clients + 1), "content": "x",
+                        "is_read": False, "sent_at": datetime.utcnow()
+                    })
+                    row = result.one()
+                sent[row.id] = time.perf_counter()
+                hub.publish(row.receiver_id, encode_message(row))
+            return sent
+
+        tasks = [asyncio.create_task(client(user_id)) for user_id in range(1, clients + 1)]
+        await asyncio.sleep(0.5)
+        counter["statements"] = 0
+        sent = await sender()
+        await asyncio.sleep(poll_interval + 0.1)
+        statements = counter["statements"]
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        latencies = sorted(seen[message_id] - sent[message_id] for message_id in sent if message_id in seen)
+        return statements, len(latencies), latencies
+
+    counter = {"statements": 0}
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Клиентов ждут сообщений: {clients}, сообщений: {messages} за ~{duration:g} сек")
+        print(f"  {'вариант':26s} {'SQL-запросов':>13s} {'доставлено':>11s} {'p50, мс':>8s} {'max, мс':>8s}")
+        for label, long_poll in ((f"опрос БД раз в {poll_interval:g} сек", False), ("long-poll (message_hub)", True)):
+            engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, f'bench{long_poll}.db')}")
+
+            @event.listens_for(engine.sync_engine, "before_cursor_execute")
+            def count(conn, cursor, statement, parameters, context, executemany):
+                counter["statements"] += 1
+
+            async def prepare():
+                async with engine.begin() as conn:
+                    await conn.run_sync(database.Base.metadata.create_all)
+            asyncio.run(prepare())
+            statements, delivered, latencies = asyncio.run(run(engine, long_poll))
+            asyncio.run(engine.dispose())
+            print(f"  {label:26s} {statements:13d} {delivered:6d}/{messages:<4d} "
+                  f"{latencies[len(latencies) // 2] * 1000:8.1f} {latencies[-1] * 1000:8.1f}")
+
+
+@benchmark("unread_badges")
+def bench_unread_badges(args):
+    """Бейджи непрочитанных: COUNT(*) по messages против денормализованных счетчиков"""
+    import random
+    import tempfile
+    from sqlalchemy import bindparam, create_engine, func, insert, select
+    from sqlalchemy.orm import sessionmaker
+    import database
+    import queries
+    from database import Message
+    from unread_counters import reconcile_bookings, reconcile_users
+
+    users = 1000
+    messages = args.rows * 20
+    busy_user = 1
+    rng = random.Random(1)
+
+    user_count = select(func.count(Message.id)).where(
+        Message.receiver_id == bindparam("user_id"), Message.is_read == False
+    )
+    booking_count = user_count.where(Message.booking_id == bindparam("booking_id"))
+
+    def badges_by_count(conn, user_id, booking_id):
+        conn.execute(user_count, {"user_id": user_id}).scalar()
+        conn.execute(booking_count, {"user_id": user_id, "booking_id": booking_id}).scalar()
+
+    def badges_by_counters(conn, user_id, booking_id):
+        conn.execute(queries.USER_UNREAD, {"user_id": user_id}).scalar()
+        conn.execute(queries.BOOKING_UNREAD, {"booking_id": booking_id}).first()
+
+    def send(counters: bool):
+        receiver = rng.randrange(2, users + 1)
+        with engine.begin() as conn:
+            conn.execute(insert(Message), {"booking_id": 1, "sender_id": busy_user, "receiver_id": receiver,
+                                           "content": "x", "is_read": False, "sent_at": datetime.utcnow()})
+            if counters:
+                conn.execute(queries.USER_UNREAD_ADD, {"user_id": receiver, "delta": 1})
+                conn.execute(queries.BOOKING_UNREAD_ADD, {"booking_id": 1, "user_id": receiver, "delta": 1})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(insert(database.User), [
+                {"id": user_id, "telegram_id": user_id, "first_name": f"user{user_id}"}
+                for user_id in range(1, users + 1)
+            ])
+            conn.execute(insert(database.DriverTrip), [{
+                "id": 1, "driver_id": busy_user, "departure_date": datetime(2026, 10, 20),
+                "start_address": "Москва", "finish_address": "Тверь", "available_seats": 3, "price_per_seat": 500
+            }])
+            conn.execute(insert(database.Booking), [
+                {"id": booking_id, "driver_trip_id": 1, "passenger_id": booking_id + 1} for booking_id in range(1, 101)
+            ])
+            # Каждое десятое сообщение - самому активному пользователю, половина не прочитана
+            base = datetime(2026, 10, 1)
+            rows = []
+            for i in range(messages):
+                receiver = busy_user if i % 10 == 0 else rng.randrange(2, users + 1)
+                rows.append({
+                    "booking_id": receiver - 1 if 1 < receiver <= 101 else None,
+                    "sender_id": 2 if receiver == busy_user else busy_user, "receiver_id": receiver,
+                    "content": "x", "is_read": rng.random() < 0.5, "sent_at": base + timedelta(seconds=i)
+                })
+            conn.execute(insert(Message), rows)
+
+        session_factory = sessionmaker(bind=engine)
+        started = time.perf_counter()
+        fixed = reconcile_users(session_factory) + reconcile_bookings(session_factory)
+        reconcile = time.perf_counter() - started
+
+        print(f"Пользователей: {users}, сообщений: {messages}, {args.repeat} повторов")
+        print(f"  {'пользователь':28s} {'COUNT(*), мс':>13s} {'счетчики, мс':>13s}")
+        with engine.connect() as conn:
+            for label, user_id, booking_id in (("обычный", 50, 49), ("активный", busy_user, 1)):
+                unread = conn.execute(user_count, {"user_id": user_id}).scalar()
+                assert unread == conn.execute(queries.USER_UNREAD, {"user_id": user_id}).scalar()
+                by_count = timeit(lambda: badges_by_count(conn, user_id, booking_id), args.repeat)
+                by_counters = timeit(lambda: badges_by_counters(conn, user_id, booking_id), args.repeat)
+                print(f"  {f'{label} ({unread} непрочит.)':28s} {by_count * 1000:13.3f} {by_counters * 1000:13.3f}")
+
+        sends = 200
+        print(f"  отправка сообщения, мс: без счетчиков {timeit(lambda: send(False), sends) * 1000:.3f}, "
+              f"со счетчиками {timeit(lambda: send(True), sends) * 1000:.3f}")
+        print(f"  пересчет всех счетчиков: {reconcile:.2f} сек ({fixed} строк заполнено)")
+        engine.dispose()
+
+
+@benchmark("ratings")
+def bench_ratings(args):
+    """Рейтинг пользователя: AVG по reviews против хранимых сумм; стоимость отзыва и полного пересчета"""
+    import random
+    import tempfile
+    from sqlalchemy import bindparam, create_engine, func, insert, select
+    from sqlalchemy.orm import sessionmaker
+    import database
+    import queries
+    from database import Review
+    from ratings import rebuild_ratings
+
+    users = 1000
+    reviews = args.rows * 10
+    busy_user = 1
+    rng = random.Random(1)
+
+    # Так рейтинг пришлось бы считать без хранимых сумм: агрегат по всем отзывам
+    by_reviews = select(
+        func.avg(Review.rating), func.count(Review.id),
+        *(func.avg(getattr(Review, name)) for name in queries.SUB_SCORES)
+    ).where(Review.reviewed_user_id == bindparam("user_id"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(insert(database.User), [
+                {"id": user_id, "telegram_id": user_id, "first_name": f"user{user_id}"}
+                for user_id in range(1, users + 1)
+            ])
+            conn.execute(insert(database.DriverTrip), [{
+                "id": 1, "driver_id": busy_user, "departure_date": datetime(2026, 10, 20),
+                "start_address": "Москва", "finish_address": "Тверь", "available_seats": 3, "price_per_seat": 500
+            }])
+            # Каждый отзыв - на свое бронирование; каждый десятый - о самом активном водителе
+            conn.execute(insert(database.Booking), [
+                {"id": booking_id, "driver_trip_id": 1, "passenger_id": rng.randrange(2, users + 1)}
+                for booking_id in range(1, reviews + 2)
+            ])
+            score = lambda: rng.choice((None, 3, 4, 5, 5))
+            conn.execute(insert(Review), [{
+                "booking_id": booking_id, "reviewer_user_id": 2, "reviewed_user_id":
+                    busy_user if booking_id % 10 == 0 else rng.randrange(2, users + 1),
+                "rating": rng.randint(1, 5), "punctuality": score(), "comfort": score(), "communication": score()
+            } for booking_id in range(1, reviews + 1)])
+
+        session_factory = sessionmaker(bind=engine)
+        started = time.perf_counter()
+        fixed = rebuild_ratings(session_factory)
+        rebuild = time.perf_counter() - started
+
+        print(f"Пользователей: {users}, отзывов: {reviews}, {args.repeat} повторов")
+        print(f"  {'пользователь':28s} {'AVG(reviews), мс':>17s} {'суммы, мс':>10s}")
+        with engine.connect() as conn:
+            for label, user_id in (("обычный", 50), ("активный", busy_user)):
+                count = conn.execute(by_reviews, {"user_id": user_id}).all()[0][1]
+                by_avg = timeit(lambda: conn.execute(by_reviews, {"user_id": user_id}).all(), args.repeat)
+                by_sums = timeit(lambda: conn.execute(queries.USER_RATINGS, {"user_id": user_id}).all(), args.repeat)
+                print(f"  {f'{label} ({count} отзывов)':28s} {by_avg * 1000:17.3f} {by_sums * 1000:10.3f}")
+
+        def submit():
+            with session_factory() as db:
+                db.add(Review(booking_id=reviews + 1, reviewer_user_id=2, reviewed_user_id=busy_user,
+                              rating=5, punctuality=5))
+                db.flush()
+                db.execute(queries.apply_review_statement(True), {
+                    "user_id": busy_user, "rating": 5, "punctuality": 5, "comfort": None, "communication": None
+                })
+                db.rollback()
+
+        print(f"  отзыв с обновлением сумм: {timeit(submit, args.repeat) * 1000:.3f} мс")
+        print(f"  полный пересчет из reviews: {rebuild:.2f} сек ({fixed} пользователей заполнено)")
+        engine.dispose()
+
+
+@benchmark("logging")
+def bench_logging(args):
+    """Логирование: цена вызова logger.info с синхронным файлом и через очередь, ротация, прореживание"""
+    import logging
+    import logging.handlers
+    import queue
+    import tempfile
+    import logging_config
+
+    records = args.repeat * 100
+    disk_latency = 0.0005  # Имитация медленного диска: 0.5 мс на запись
+
+    class SlowDisk(logging_config.SizeAndTimeRotatingFileHandler):
+        def emit(self, record):
+            time.sleep(disk_latency)
+            super().emit(record)
+
+    def per_call(logger) -> float:
+        started = time.perf_counter()
+        for i in range(records):
+            logger.info("Бронирование %d создано", i)
+        return (time.perf_counter() - started) / records * 1e6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Записей: {records}, задержка диска {disk_latency * 1000:.1f} мс")
+
+        logger = logging.getLogger("bench.sync")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = SlowDisk(os.path.join(tmp, "sync.log"), 10 * 2**20, 3, 0)
+        logger.addHandler(handler)
+        sync_us = per_call(logger)
+        handler.close()
+
+        logger = logging.getLogger("bench.queued")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = SlowDisk(os.path.join(tmp, "queued.log"), 10 * 2**20, 3, 0)
+        queue_handler = logging_config.DroppingQueueHandler(queue.Queue(maxsize=records * 2))
+        listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+        listener.start()
+        logger.addHandler(queue_handler)
+        queued_us = per_call(logger)
+        started = time.perf_counter()
+        listener.stop()
+        drain = time.perf_counter() - started
+        handler.close()
+        print(f"  logger.info, синхронный файл: {sync_us:9.1f} мкс")
+        print(f"  logger.info, через очередь:   {queued_us:9.1f} мкс (поток записи дописал за {drain:.2f} сек)")
+
+        # Ротация по размеру и по времени
+        path = os.path.join(tmp, "rotate.log")
+        handler = logging_config.SizeAndTimeRotatingFileHandler(path, 64 * 1024, 3, 3600)
+        logger = logging.getLogger("bench.rotate")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        for i in range(5000):
+            logger.info("строка %05d %s", i, "x" * 40)
+        by_size = sorted(name for name in os.listdir(tmp) if name.startswith("rotate.log"))
+        handler.rollover_at = time.time() - 1
+        logger.info("после истечения интервала")
+        handler.close()
+        with open(path, encoding="utf-8") as current:
+            after_time = sum(1 for _ in current)
+        print(f"  ротация по размеру (64 КБ, 3 архива): {by_size}")
+        print(f"  ротация по времени: в новом файле {after_time} строк")
+
+        # Прореживание шумного логгера
+        sampled = logging.getLogger("bench.httpx")
+        sampled.setLevel(logging.INFO)
+        sampled.propagate = False
+        sampled.addFilter(logging_config.SamplingFilter(0.01))
+        counter = logging.handlers.BufferingHandler(10 ** 6)
+        sampled.addHandler(counter)
+        for i in range(records):
+            sampled.info("HTTP Request: POST getUpdates")
+        sampled.warning("HTTP Request: 502")
+        print(f"  прореживание 0.01: из {records} INFO прошло "
+              f"{sum(1 for r in counter.buffer if r.levelno == logging.INFO)}, WARNING - "
+              f"{sum(1 for r in counter.buffer if r.levelno == logging.WARNING)} из 1")
+
+
+@benchmark("bot_user_cache")
+def bench_bot_user_cache(args):
+    """Бот: запросы к БД на /start и /profile с кэшем профилей и сброс кэша по ленте изменений"""
+    import random
+    import tempfile
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import Session, sessionmaker
+    import database
+    import bot_db
+    from change_feed import UserChangeFeed, record_user_change
+
+    users = 200
+    commands = args.repeat * 100
+    rng = random.Random(7)
+
+    def start_and_profile(telegram_id: int, cached: bool):
+        # Та же последовательность, что в обработчиках start и profile_command
+        name = f"User{telegram_id}"
+        profile = bot_db.cached_profile(telegram_id) if cached else None
+        if profile is None or not bot_db.profile_is_current(profile, None, name, None):
+            bot_db.register_user(telegram_id, None, name, None, "ru", False)
+        profile = (bot_db.cached_profile(telegram_id) if cached else None) or bot_db.fetch_profile(telegram_id)
+        return profile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            db.add_all(
+                database.User(telegram_id=1000 + i, first_name=f"User{1000 + i}",
+                              role=database.UserRole.PASSENGER)
+                for i in range(users)
+            )
+            db.commit()
+
+        statements = 0
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count(conn, cursor, statement, parameters, context, executemany):
+            nonlocal statements
+            statements += 1
+
+        session_factory = database.SessionLocal
+        database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        try:
+            telegram_ids = [1000 + rng.randrange(users) for _ in range(commands)]
+            print(f"Пар /start + /profile: {commands}, пользователей: {users}")
+            print(f"  {'вариант':14s} {'SQL-запросов':>13s} {'на пару':>8s} {'мкс на пару':>12s}")
+            for label, cached in (("без кэша", False), ("с кэшем", True)):
+                bot_db.profile_cache.clear()
+                statements = 0
+                started = time.perf_counter()
+                for telegram_id in telegram_ids:
+                    start_and_profile(telegram_id, cached)
+                elapsed = time.perf_counter() - started
+                print(f"  {label:14s} {statements:13d} {statements / commands:8.2f} "
+                      f"{elapsed / commands * 1e6:12.0f}")
+
+            # Изменение профиля через API: запись в ленту в той же транзакции
+            feed = UserChangeFeed(bot_db.invalidate_profiles, interval=0.05)
+            feed.start()
+            target = telegram_ids[0]
+            start_and_profile(target, True)
+            with database.SessionLocal() as db:
+                user = db.query(database.User).filter(database.User.telegram_id == target).one()
+                user.phone = "+70000000000"
+                record_user_change(db, target)
+                db.commit()
+            changed = time.perf_counter()
+            while bot_db.cached_profile(target) is not None and time.perf_counter() - changed < 5:
+                time.sleep(0.001)
+            invalidated = time.perf_counter() - changed
+            feed.stop()
+            phone = start_and_profile(target, True).phone
+            print(f"  сброс по ленте (опрос {feed.interval * 1000:.0f} мс): {invalidated * 1000:.0f} мс, "
+                  f"/profile после сброса: телефон {phone}")
+        finally:
+            database.SessionLocal = session_factory
+            bot_db.shutdown()
+            engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки Travel Companion API")
+    parser.add_argument("name", nargs="?", choices=sorted(BENCHMARKS), help="Имя бенчмарка")
+    parser.add_argument("--trips", type=int, default=1000, help="Количество поездок в ответе")
+    parser.add_argument("--repeat", type=int, default=20, help="Количество повторов")
+    parser.add_argument("--duration", type=float, default=5.0, help="Длительность нагрузочного прогона, сек")
+    parser.add_argument("--readers", type=int, default=4, help="Потоков-читателей")
+    parser.add_argument("--writers", type=int, default=2, help="Потоков-писателей")
+    parser.add_argument("--rows", type=int, default=10000, help="Строк в выборке (projection)")
+    args = parser.parse_args()
+
+    if not args.name:
+        for name, func in sorted(BENCHMARKS.items()):
+            print(f"{name:20s} {func.__doc__}")
+        return
+
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == "__main__":
+    main()
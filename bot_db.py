@@ -0,0 +1,182 @@
+# bot_db.py - ДОСТУП К БД ДЛЯ ОБРАБОТЧИКОВ БОТА БЕЗ БЛОКИРОВКИ EVENT LOOP
+#
+# Обработчики python-telegram-bot работают в одном event loop: синхронный
+# запрос к БД прямо в async-обработчике останавливает ответы всем чатам.
+# Здесь запросы выполняются в ограниченном пуле потоков (BOT_DB_WORKERS),
+# а наружу возвращаются готовые данные (Row / dict) - без ленивых загрузок
+# после закрытия сессии. Размер пула потоков не должен превышать
+# DB_POOL_SIZE + DB_MAX_OVERFLOW, иначе потоки будут ждать соединение.
+#
+# Профили /start и /profile кэшируются в процессе бота (BOT_USER_CACHE_*).
+# Изменения, сделанные через API, приходят по ленте user_changes
+# (change_feed.py) и сбрасывают запись в течение CHANGE_FEED_INTERVAL секунд.
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select
+
+import database
+import queries
+from pagination import decode_cursor, page_of
+from change_feed import UserChangeFeed, record_user_change
+from user_cache import TTLCache
+from database import Booking, DriverTrip, TripStatus, User
+
+BOT_DB_WORKERS = int(os.getenv("BOT_DB_WORKERS", "4"))
+BOT_USER_CACHE_MAX_SIZE = int(os.getenv("BOT_USER_CACHE_MAX_SIZE", "10000"))
+# Ограничивает и устаревание last_active в /profile (он пишется пакетами в обход ленты)
+BOT_USER_CACHE_TTL = float(os.getenv("BOT_USER_CACHE_TTL", "300"))  # секунды
+
+_executor = ThreadPoolExecutor(max_workers=BOT_DB_WORKERS, thread_name_prefix="bot-db")
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполнить синхронную функцию работы с БД в пуле, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Дождаться начатых запросов и остановить пул"""
+    _executor.shutdown(wait=True)
+
+
+# --- Запросы (выполняются в потоках пула) ---
+
+# Все счетчики /stats одним запросом
+STATS = select(
+    select(func.count(User.id)).scalar_subquery().label("users"),
+    select(func.count(User.id)).where(User.has_car == True).scalar_subquery().label("drivers"),
+    select(func.count(User.id)).where(User.has_car == False).scalar_subquery().label("passengers"),
+    select(func.count(DriverTrip.id)).scalar_subquery().label("trips"),
+    select(func.count(DriverTrip.id)).where(
+        DriverTrip.status == TripStatus.ACTIVE
+    ).scalar_subquery().label("active_trips"),
+    select(func.count(Booking.id)).scalar_subquery().label("bookings"),
+    select(func.count(Booking.id)).where(
+        Booking.status == TripStatus.ACTIVE
+    ).scalar_subquery().label("active_bookings"),
+)
+
+RECENT_USERS = select(User.first_name, User.registration_date).order_by(
+    User.registration_date.desc()
+).limit(5)
+
+PROFILE = select(
+    User.id, User.first_name, User.last_name, User.username, User.phone, User.role,
+    User.has_car, User.car_model, User.car_color, User.car_plate, User.car_type, User.car_seats,
+    User.total_driver_trips, User.total_passenger_trips, User.driver_rating, User.passenger_rating,
+    User.registration_date, User.last_active
+).where(User.telegram_id == bindparam("telegram_id"))
+
+USER_ID = select(User.id).where(User.telegram_id == bindparam("telegram_id"))
+
+
+def fetch_stats() -> Tuple[dict, list]:
+    """Счетчики системы и последние зарегистрированные пользователи"""
+    with database.SessionLocal() as db:
+        counts = db.execute(STATS).one()._asdict()
+        recent_users = db.execute(RECENT_USERS).all()
+    return counts, recent_users
+
+
+def fetch_profile(telegram_id: int):
+    """Профиль пользователя (Row) или None, если он не зарегистрирован; найденный кэшируется"""
+    with database.SessionLocal() as db:
+        profile = db.execute(PROFILE, {"telegram_id": telegram_id}).first()
+    if profile is not None:
+        profile_cache.set(telegram_id, profile)
+    return profile
+
+
+# --- Кэш профилей (без пула: обращение к памяти) ---
+
+profile_cache = TTLCache(max_size=BOT_USER_CACHE_MAX_SIZE, ttl=BOT_USER_CACHE_TTL)
+
+
+def cached_profile(telegram_id: int):
+    """Профиль из кэша или None (тогда нужен fetch_profile)"""
+    return profile_cache.get(telegram_id)
+
+
+def profile_is_current(profile, username: Optional[str], first_name: Optional[str],
+                       last_name: Optional[str]) -> bool:
+    """register_user ничего не изменит: пустые значения из Telegram имя не затирают"""
+    return (
+        (first_name or profile.first_name) == profile.first_name
+        and (last_name or profile.last_name) == profile.last_name
+        and (username or profile.username) == profile.username
+    )
+
+
+def invalidate_profiles(telegram_ids: Iterable[int]):
+    for telegram_id in telegram_ids:
+        profile_cache.delete(telegram_id)
+
+
+# Запускается в main() бота; API читает ленту своим потоком (main.user_change_feed)
+user_change_feed = UserChangeFeed(invalidate_profiles)
+
+
+# Раздел /my_trips -> (запрос страницы, ключ курсора)
+MY_TRIPS_SECTIONS = {
+    "driver": (queries.my_driver_trips_statement, lambda row: (row.departure_date, row.id)),
+    "passenger": (queries.my_bookings_statement, lambda row: (row.booked_at, row.id)),
+}
+
+
+def fetch_my_trips_page(telegram_id: int, role: str, cursor: Optional[str] = None, limit: int = 5,
+                        user_id: Optional[int] = None) -> Optional[Tuple[int, list, Optional[str]]]:
+    """
+    Одна страница /my_trips (keyset): (user_id, строки, курсор следующей страницы).
+    None - пользователь не найден. Известный user_id экономит запрос.
+    """
+    statement_factory, key = MY_TRIPS_SECTIONS[role]
+    with database.SessionLocal() as db:
+        if user_id is None:
+            user_id = db.execute(USER_ID, {"telegram_id": telegram_id}).scalar()
+            if user_id is None:
+                return None
+        params = {"user_id": user_id, "limit": limit + 1}
+        if cursor:
+            params["cursor_value"], params["cursor_id"] = decode_cursor(cursor)
+        rows = db.execute(statement_factory("all", bool(cursor)), params).all()
+    rows, next_cursor = page_of(rows, limit, key)
+    return user_id, rows, next_cursor
+
+
+def register_user(telegram_id: int, username: Optional[str], first_name: Optional[str],
+                  last_name: Optional[str], language_code: Optional[str], is_bot: bool) -> Tuple[int, bool]:
+    """Создать пользователя или обновить имя; вернуть (id, создан ли новый)"""
+    with database.SessionLocal() as db:
+        user = db.execute(queries.USER_BY_TELEGRAM_ID, {"telegram_id": telegram_id}).scalars().first()
+        if user is None:
+            now = datetime.utcnow()
+            user = User(
+                telegram_id=telegram_id,
+                username=username,
+                first_name=first_name or "",
+                last_name=last_name or "",
+                language_code=language_code or "ru",
+                is_bot=is_bot or False,
+                registration_date=now,
+                last_active=now,
+                role=database.UserRole.PASSENGER
+            )
+            db.add(user)
+            db.commit()
+            return user.id, True
+
+        user.first_name = first_name or user.first_name
+        user.last_name = last_name or user.last_name
+        user.username = username or user.username
+        # Кэш пользователей в API сбросится по ленте изменений
+        if db.is_modified(user):
+            record_user_change(db, telegram_id)
+        db.commit()
+        profile_cache.delete(telegram_id)
+        return user.id, False
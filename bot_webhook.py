@@ -0,0 +1,144 @@
+# bot_webhook.py - ПРИЕМ ОБНОВЛЕНИЙ TELEGRAM ЧЕРЕЗ WEBHOOK
+#
+# Вместо постоянных getUpdates (run_polling) Telegram сам присылает POST с
+# обновлением. ASGI-приложение проверяет секрет из заголовка
+# X-Telegram-Bot-Api-Secret-Token, кладет Update в application.update_queue
+# и сразу отвечает 200 - обработка идет в фоне тем же Application, что и при
+# polling. Обработчик подключается маршрутом в FastAPI (BOT_WEBHOOK_IN_API=true)
+# или работает отдельным сервером (python minimal_bot.py при BOT_MODE=webhook).
+import hashlib
+import hmac
+import json
+import logging
+import os
+from typing import Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Публичный адрес, на который Telegram шлет обновления (https://host/telegram/webhook)
+BOT_WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL", "")
+BOT_WEBHOOK_PATH = os.getenv("BOT_WEBHOOK_PATH", "/telegram/webhook")
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (1-256 символов A-Z a-z 0-9 _ -).
+# Если не задан - выводится из токена бота, одинаково во всех процессах
+BOT_WEBHOOK_SECRET = os.getenv("BOT_WEBHOOK_SECRET", "")
+# Принимать обновления в API (main.py) вместо отдельного воркера бота
+BOT_WEBHOOK_IN_API = os.getenv("BOT_WEBHOOK_IN_API", "false").lower() in ("1", "true", "yes")
+# Адрес для отдельного запуска (без FastAPI)
+BOT_WEBHOOK_HOST = os.getenv("BOT_WEBHOOK_HOST", "0.0.0.0")
+BOT_WEBHOOK_PORT = int(os.getenv("BOT_WEBHOOK_PORT", os.getenv("PORT", "8443")))
+BOT_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("BOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+# Обновление Telegram - несколько килобайт; больше - не от Telegram
+BOT_WEBHOOK_MAX_BODY = int(os.getenv("BOT_WEBHOOK_MAX_BODY", str(1024 * 1024)))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret(bot_token: str) -> str:
+    """Секрет webhook: BOT_WEBHOOK_SECRET или HMAC от токена бота"""
+    if BOT_WEBHOOK_SECRET:
+        return BOT_WEBHOOK_SECRET
+    return hmac.new(b"telegram-webhook", bot_token.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def webhook_url() -> str:
+    """Полный адрес webhook: BOT_WEBHOOK_URL, при необходимости дополненный BOT_WEBHOOK_PATH"""
+    url = BOT_WEBHOOK_URL.rstrip("/")
+    if url and not url.endswith(BOT_WEBHOOK_PATH.rstrip("/")):
+        url += BOT_WEBHOOK_PATH
+    return url
+
+
+async def start_webhook(application: Application, drop_pending_updates: bool = False):
+    """Запустить обработку очереди обновлений и зарегистрировать webhook в Telegram"""
+    await application.initialize()
+    await application.start()
+
+    url = webhook_url()
+    if not url:
+        logger.warning("⚠️  BOT_WEBHOOK_URL не задан - webhook в Telegram не зарегистрирован")
+        return
+    await application.bot.set_webhook(
+        url=url,
+        secret_token=webhook_secret(application.bot.token),
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=BOT_WEBHOOK_MAX_CONNECTIONS,
+        drop_pending_updates=drop_pending_updates
+    )
+    logger.info(f"✅ Webhook зарегистрирован: {url}")
+
+
+async def stop_webhook(application: Application):
+    """Дообработать очередь и остановить Application (webhook в Telegram остается)"""
+    if application.running:
+        await application.stop()
+    await application.shutdown()
+
+
+def webhook_endpoint(application: Application):
+    """Обработчик POST с обновлением: для app.add_route в FastAPI или маршрута Starlette"""
+    secret = webhook_secret(application.bot.token).encode("utf-8")
+
+    async def receive_update(request: Request) -> Response:
+        token = request.headers.get(SECRET_HEADER, "").encode("utf-8")
+        if not hmac.compare_digest(token, secret):
+            logger.warning(f"⚠️  Webhook: неверный секрет от {request.client.host if request.client else '?'}")
+            return Response(status_code=403)
+
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > BOT_WEBHOOK_MAX_BODY:
+            return Response(status_code=413)
+        body = await request.body()
+        if len(body) > BOT_WEBHOOK_MAX_BODY:
+            return Response(status_code=413)
+
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except Exception as e:
+            # 400 - Telegram не будет бесконечно повторять битое обновление
+            logger.error(f"❌ Webhook: не удалось разобрать обновление: {e}")
+            return Response(status_code=400)
+        if update is None:
+            return Response(status_code=400)
+
+        await application.update_queue.put(update)
+        return Response(status_code=200)
+
+    return receive_update
+
+
+def create_webhook_app(application: Application, path: str = BOT_WEBHOOK_PATH, lifespan: bool = False) -> Starlette:
+    """
+    Отдельное ASGI-приложение приема обновлений на path.
+    lifespan=True - приложение само запускает и останавливает Application;
+    внутри FastAPI это делает основное приложение (start_webhook / stop_webhook).
+    """
+    async def startup():
+        await start_webhook(application)
+
+    async def shutdown():
+        await stop_webhook(application)
+
+    on_startup, on_shutdown = ([startup], [shutdown]) if lifespan else (None, None)
+
+    return Starlette(
+        routes=[Route(path, webhook_endpoint(application), methods=["POST"])],
+        on_startup=on_startup,
+        on_shutdown=on_shutdown
+    )
+
+
+def run_standalone(application: Application, host: Optional[str] = None, port: Optional[int] = None):
+    """Отдельный webhook-сервер бота (вместо run_polling)"""
+    import uvicorn
+
+    app = create_webhook_app(application, lifespan=True)
+    uvicorn.run(app, host=host or BOT_WEBHOOK_HOST, port=port or BOT_WEBHOOK_PORT, log_level="warning")
@@ -0,0 +1,233 @@
+# broadcasts.py - РАССЫЛКИ АДМИНИСТРАТОРА ЧЕРЕЗ OUTBOX УВЕДОМЛЕНИЙ
+#
+# /broadcast в боте только создает строку в broadcasts. Фоновая задача
+# Broadcaster проходит получателей по users.id (keyset, пачками по
+# BROADCAST_BATCH_SIZE) и ставит сообщения в notification_outbox; отправляет
+# их диспетчер уведомлений со своими лимитами (29/сек на бота, 1/сек в
+# чат), повторами и обработкой 429. Пачка сообщений и новый курсор
+# last_user_id фиксируются одной транзакцией - после падения процесса
+# рассылка продолжается с места остановки без пропусков и повторной постановки.
+# В outbox одновременно лежит не больше BROADCAST_MAX_PENDING сообщений
+# рассылки, а обычные уведомления диспетчер забирает раньше них.
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import exists, func, insert, or_, select, update
+
+import database
+from database import Booking, Broadcast, DriverTrip, NotificationOutbox, User
+from notifications import FAILED, PENDING
+
+logger = logging.getLogger(__name__)
+
+# Telegram ID администраторов через запятую
+ADMIN_TELEGRAM_IDS = {
+    int(value) for value in os.getenv("ADMIN_TELEGRAM_IDS", "").replace(" ", "").split(",") if value
+}
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+BROADCAST_MAX_PENDING = int(os.getenv("BROADCAST_MAX_PENDING", "1000"))
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "1"))
+
+SEGMENTS = ("all", "drivers", "passengers")
+RUNNING, DONE, CANCELLED = "running", "done", "cancelled"
+
+
+def is_admin(telegram_id: int) -> bool:
+    return telegram_id in ADMIN_TELEGRAM_IDS
+
+
+def recipients_filter(segment: str, city: Optional[str] = None) -> list:
+    """Условия WHERE на users для сегмента рассылки"""
+    conditions = [User.is_active.isnot(False), User.is_bot.isnot(True)]
+    if segment == "drivers":
+        conditions.append(User.has_car == True)
+    elif segment == "passengers":
+        conditions.append(User.has_car == False)
+
+    if city:
+        # lower() в SQLite не трогает кириллицу - дополнительно сравниваем с типичными написаниями
+        spellings = {city, city.capitalize(), city.title()}
+        in_city = or_(
+            func.lower(DriverTrip.start_city) == city.lower(), DriverTrip.start_city.in_(spellings),
+            func.lower(DriverTrip.finish_city) == city.lower(), DriverTrip.finish_city.in_(spellings)
+        )
+        # Водил поездки из/в город или бронировал такие поездки
+        conditions.append(or_(
+            exists().where(DriverTrip.driver_id == User.id, in_city),
+            exists().where(
+                Booking.passenger_id == User.id, Booking.driver_trip_id == DriverTrip.id, in_city
+            )
+        ))
+    return conditions
+
+
+# =============== РАБОТА С БД (синхронно, в потоке) ===============
+def create_broadcast(text: str, segment: str = "all", city: Optional[str] = None,
+                     created_by: Optional[int] = None) -> Tuple[int, int]:
+    """Создать рассылку; вернуть (id, число получателей на момент создания)"""
+    if segment not in SEGMENTS:
+        raise ValueError(f"Неизвестный сегмент: {segment}")
+    with database.SessionLocal() as db:
+        recipients = db.execute(
+            select(func.count(User.id)).where(*recipients_filter(segment, city))
+        ).scalar()
+        broadcast = Broadcast(text=text, segment=segment, city=city or None, created_by=created_by)
+        db.add(broadcast)
+        db.commit()
+        return broadcast.id, recipients
+
+
+def next_running_broadcast() -> Optional[int]:
+    """Самая старая незавершенная рассылка: рассылки идут по очереди"""
+    with database.SessionLocal() as db:
+        return db.execute(
+            select(Broadcast.id).where(Broadcast.status == RUNNING).order_by(Broadcast.id).limit(1)
+        ).scalar()
+
+
+def pending_messages(broadcast_id: int) -> int:
+    with database.SessionLocal() as db:
+        return db.execute(
+            select(func.count(NotificationOutbox.id)).where(
+                NotificationOutbox.broadcast_id == broadcast_id,
+                NotificationOutbox.status == PENDING
+            )
+        ).scalar()
+
+
+def enqueue_batch(broadcast_id: int, limit: int = BROADCAST_BATCH_SIZE) -> int:
+    """Поставить в outbox следующую пачку получателей и сдвинуть курсор; вернуть размер пачки"""
+    with database.SessionLocal() as db:
+        broadcast = db.execute(
+            select(Broadcast).where(Broadcast.id == broadcast_id).with_for_update()
+        ).scalar_one_or_none()
+        if broadcast is None or broadcast.status != RUNNING:
+            db.rollback()
+            return 0
+
+        rows = db.execute(
+            select(User.id, User.telegram_id).where(
+                User.id > broadcast.last_user_id, *recipients_filter(broadcast.segment, broadcast.city)
+            ).order_by(User.id).limit(limit)
+        ).all()
+        if rows:
+            db.execute(insert(NotificationOutbox), [
+                {"chat_id": row.telegram_id, "kind": "broadcast", "text": broadcast.text,
+                 "broadcast_id": broadcast.id}
+                for row in rows
+            ])
+            broadcast.last_user_id = rows[-1].id
+            broadcast.enqueued += len(rows)
+        if len(rows) < limit:
+            broadcast.status = DONE
+            broadcast.finished_at = datetime.utcnow()
+        db.commit()
+        return len(rows)
+
+
+def cancel_broadcast(broadcast_id: int) -> bool:
+    """Остановить рассылку; неотправленные сообщения снимаются с очереди"""
+    with database.SessionLocal() as db:
+        result = db.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.status == RUNNING).values(
+                status=CANCELLED, finished_at=datetime.utcnow()
+            ),
+            execution_options={"synchronize_session": False}
+        )
+        db.execute(
+            update(NotificationOutbox).where(
+                NotificationOutbox.broadcast_id == broadcast_id,
+                NotificationOutbox.status == PENDING
+            ).values(status=FAILED, last_error="Рассылка отменена"),
+            execution_options={"synchronize_session": False}
+        )
+        db.commit()
+        return result.rowcount > 0
+
+
+def broadcast_progress(broadcast_id: int) -> Optional[dict]:
+    """Состояние рассылки и счетчики ее сообщений в outbox по статусам"""
+    with database.SessionLocal() as db:
+        broadcast = db.execute(
+            select(Broadcast.id, Broadcast.segment, Broadcast.city, Broadcast.status,
+                   Broadcast.enqueued, Broadcast.created_at, Broadcast.finished_at)
+            .where(Broadcast.id == broadcast_id)
+        ).first()
+        if broadcast is None:
+            return None
+        counts = db.execute(
+            select(NotificationOutbox.status, func.count(NotificationOutbox.id))
+            .where(NotificationOutbox.broadcast_id == broadcast_id)
+            .group_by(NotificationOutbox.status)
+        ).all()
+    progress = broadcast._asdict()
+    progress["messages"] = {status: count for status, count in counts}
+    return progress
+
+
+# =============== ФОНОВАЯ ЗАДАЧА ===============
+class Broadcaster:
+    """Ставит рассылки в outbox пачками, пока диспетчер успевает их отправлять"""
+
+    def __init__(self, batch_size: int = BROADCAST_BATCH_SIZE, max_pending: int = BROADCAST_MAX_PENDING,
+                 poll_interval: float = BROADCAST_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.enqueued = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                enqueued = await self.step()
+            except Exception as e:
+                logger.error(f"❌ Ошибка рассылки: {e}")
+                enqueued = 0
+            if not enqueued:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def step(self) -> int:
+        """Добавить пачку текущей рассылки, если в outbox есть место; вернуть размер пачки"""
+        broadcast_id = await asyncio.to_thread(next_running_broadcast)
+        if broadcast_id is None:
+            return 0
+        pending = await asyncio.to_thread(pending_messages, broadcast_id)
+        limit = min(self.batch_size, self.max_pending - pending)
+        if limit <= 0:
+            return 0
+        enqueued = await asyncio.to_thread(enqueue_batch, broadcast_id, limit)
+        self.enqueued += enqueued
+        if enqueued < limit:
+            logger.info(f"✅ Рассылка {broadcast_id}: все получатели поставлены в очередь")
+        return enqueued
+
+    def status(self) -> dict:
+        return {"running": self.running, "enqueued": self.enqueued, "max_pending": self.max_pending}
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,98 @@
+# change_feed.py - ЛЕНТА ИЗМЕНЕНИЙ ПОЛЬЗОВАТЕЛЕЙ ДЛЯ СБРОСА КЭША В ДРУГИХ ПРОЦЕССАХ
+#
+# API и бот при изменении профиля, автомобиля или статистики пользователя
+# добавляют строку в user_changes в той же транзакции. Каждый процесс бота и
+# каждый воркер API опрашивает таблицу раз в CHANGE_FEED_INTERVAL секунд и
+# убирает измененных пользователей из своих кэшей. Опрос идет по времени с запасом CHANGE_FEED_LOOKBACK (транзакции,
+# закоммиченные позже соседних, и расхождение часов не теряются); повторный
+# сброс одного и того же ключа безвреден.
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import delete, select
+
+import database
+from database import UserChange
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_INTERVAL = float(os.getenv("CHANGE_FEED_INTERVAL", "2"))          # секунды
+CHANGE_FEED_LOOKBACK = float(os.getenv("CHANGE_FEED_LOOKBACK", "30"))         # секунды
+CHANGE_FEED_RETENTION = float(os.getenv("CHANGE_FEED_RETENTION_HOURS", "1"))  # часы
+
+
+def record_user_change(db, telegram_id: int):
+    """Добавить запись в ленту (в текущую транзакцию, коммитит вызывающий код)"""
+    db.add(UserChange(telegram_id=telegram_id))
+
+
+class UserChangeFeed:
+    """Фоновый поток: читает user_changes и вызывает on_change(telegram_ids)"""
+
+    def __init__(self, on_change: Callable[[Iterable[int]], None], session_factory=None,
+                 interval: float = CHANGE_FEED_INTERVAL, lookback: float = CHANGE_FEED_LOOKBACK):
+        self._on_change = on_change
+        self._session_factory = session_factory
+        self.interval = interval
+        self.lookback = timedelta(seconds=lookback)
+        self.polls = 0
+        self.invalidated = 0
+
+        self._since = datetime.utcnow() - self.lookback
+        self._last_prune = datetime.min
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def poll(self) -> int:
+        """Прочитать изменения с прошлого опроса; вернуть число затронутых пользователей"""
+        started = datetime.utcnow()
+        session = (self._session_factory or database.SessionLocal)()
+        try:
+            telegram_ids = set(session.execute(
+                select(UserChange.telegram_id).where(UserChange.changed_at >= self._since)
+            ).scalars())
+
+            if started - self._last_prune > timedelta(minutes=10):
+                session.execute(
+                    delete(UserChange).where(
+                        UserChange.changed_at < started - timedelta(hours=CHANGE_FEED_RETENTION)
+                    ),
+                    execution_options={"synchronize_session": False}
+                )
+                session.commit()
+                self._last_prune = started
+        finally:
+            session.close()
+
+        self._since = started - self.lookback
+        self.polls += 1
+        if telegram_ids:
+            self._on_change(telegram_ids)
+            self.invalidated += len(telegram_ids)
+        return len(telegram_ids)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения ленты изменений: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="UserChangeFeed")
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {"polls": self.polls, "invalidated": self.invalidated, "interval": self.interval}
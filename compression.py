@@ -0,0 +1,203 @@
+# compression.py - СЖАТИЕ ОТВЕТОВ (gzip / brotli) С ПОРОГОМ ПО РАЗМЕРУ
+import os
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    # Без пакета brotli остается только gzip
+    brotli = None
+
+# Настройки сжатия (можно переопределить через переменные окружения)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))       # байт
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))      # 1-9
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))  # 0-11
+
+# Сжимаем только текстовые форматы - картинки и архивы уже сжаты
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "text/",
+)
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Accept-Encoding -> {кодировка: q}"""
+    result = {}
+    for item in header.split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[name] = q
+    return result
+
+
+def choose_encoding(header: Optional[str]) -> Optional[str]:
+    """Выбор кодировки: brotli (если установлен) предпочтительнее gzip"""
+    if not header:
+        return None
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+
+    candidates = []
+    if brotli is not None:
+        candidates.append("br")
+    candidates.append("gzip")
+
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    """Потоковый компрессор с единым интерфейсом для gzip и brotli"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def compress_body(body: bytes, encoding: str, gzip_level: int = COMPRESSION_GZIP_LEVEL,
+                  brotli_quality: int = COMPRESSION_BROTLI_QUALITY) -> bytes:
+    """Сжать тело целиком"""
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    compressor = _Compressor(encoding, gzip_level, brotli_quality)
+    return compressor.compress(body) + compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    ASGI-middleware сжатия ответов.
+
+    Кодировка выбирается по Accept-Encoding, ответы меньше minimum_size
+    и уже сжатые/бинарные ответы отдаются как есть. Потоковые ответы
+    (StreamingResponse) сжимаются по мере отправки.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE,
+                 gzip_level: int = COMPRESSION_GZIP_LEVEL,
+                 brotli_quality: int = COMPRESSION_BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Без подходящей кодировки ответ не сжимается, но Vary все равно нужен
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        responder = _CompressionResponder(send, encoding, self)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, send: Send, encoding: Optional[str], config: CompressionMiddleware):
+        self._send = send
+        self.encoding = encoding
+        self.config = config
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        if self.start_message["status"] < 200 or self.start_message["status"] in (204, 304):
+            return False
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def send(self, message: Message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # Заголовки отправим, когда увидим первый кусок тела
+            self.start_message = message
+            return
+
+        if message_type != "http.response.body":
+            await self._send(message)
+            return
+
+        if self.passthrough:
+            await self._send(message)
+            return
+
+        if self.compressor is not None:
+            await self._send_stream_chunk(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        headers = MutableHeaders(raw=self.start_message["headers"])
+
+        compressible = self._compressible(headers)
+        if compressible:
+            # Ответ зависит от Accept-Encoding, даже если этот вариант не сжат (маленький
+            # ответ, клиент без gzip/br) - иначе кэш отдаст его всем клиентам
+            headers.add_vary_header("Accept-Encoding")
+
+        if not compressible or self.encoding is None or (not more_body and len(body) < self.config.minimum_size):
+            self.passthrough = True
+            await self._send(self.start_message)
+            await self._send(message)
+            return
+
+        headers["Content-Encoding"] = self.encoding
+
+        if not more_body:
+            # Тело целиком - сжимаем за один вызов
+            compressed = compress_body(body, self.encoding, self.config.gzip_level, self.config.brotli_quality)
+            headers["Content-Length"] = str(len(compressed))
+            await self._send(self.start_message)
+            await self._send({"type": "http.response.body", "body": compressed})
+            return
+
+        # Потоковый ответ - длина заранее неизвестна
+        if "content-length" in headers:
+            del headers["content-length"]
+        self.compressor = _Compressor(self.encoding, self.config.gzip_level, self.config.brotli_quality)
+        await self._send(self.start_message)
+        await self._send_stream_chunk(message)
+
+    async def _send_stream_chunk(self, message: Message):
+        data = self.compressor.compress(message.get("body", b""))
+        more_body = message.get("more_body", False)
+        if not more_body:
+            data += self.compressor.finish()
+        if data or not more_body:
+            await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -1,8 +1,13 @@
 # database.py - ИСПРАВЛЕННАЯ ВЕРСИЯ ДЛЯ PostgreSQL НА RENDER
 import os
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Text, Enum, JSON
+from sqlalchemy import event, create_engine, Column, Integer, BigInteger, String, DateTime, Boolean, Float, ForeignKey, Text, Enum, JSON, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import logging
+from pool_metrics import pool_options, attach_pool_events
+from sql_metrics import instrument_engine
 from datetime import datetime
 import enum
 import json
@@ -21,16 +26,147 @@ elif DATABASE_URL.startswith("postgres://"):
 else:
     connect_args = {}
 
+# --- Тюнинг SQLite для локальной разработки и одноузловых установок ---
+# WAL позволяет читать параллельно с записью, synchronous=NORMAL в WAL безопасен
+# при падении процесса и убирает fsync на каждый commit, busy_timeout вместо
+# мгновенного "database is locked". Любое значение можно переопределить через SQLITE_*.
+SQLITE_PRAGMAS = {
+    # busy_timeout первым: остальные PRAGMA тоже могут ждать блокировку
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT", "5000"),         # мс
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),           # отрицательное - в КиБ (64 МБ)
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: dict = SQLITE_PRAGMAS):
+    """Применить PRAGMA к новому соединению SQLite"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def enable_sqlite_tuning(sync_engine):
+    """Подписать движок на установку PRAGMA при каждом новом соединении"""
+    if sync_engine.dialect.name != "sqlite":
+        return
+    
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection)
+
 # Создаем движок базы данных
+# Размер пула, overflow, таймаут, recycle и стратегия pre-ping задаются через DB_POOL_* (см. pool_metrics.py)
 engine = create_engine(
     DATABASE_URL,
     connect_args=connect_args,  # Ключевое исправление: добавляем connect_args
-    pool_pre_ping=True,  # Проверка соединения перед использованием
-    pool_recycle=300,    # Переподключение каждые 5 минут
+    **pool_options("primary")
 )
+attach_pool_events(engine, "primary")
+enable_sqlite_tuning(engine)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# --- Асинхронный движок (asyncpg для PostgreSQL, aiosqlite для SQLite) ---
+DB_PREPARED_STATEMENT_CACHE_SIZE = os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500")
+
+def make_async_url(url: str):
+    """Преобразовать синхронный URL в URL асинхронного драйвера и connect_args для него"""
+    async_connect_args = {}
+    
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1), async_connect_args
+    
+    if url.startswith("postgresql:") or url.startswith("postgresql+psycopg2:"):
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        params = parse_qsl(query)
+        # asyncpg не понимает sslmode в URL - передаем его через connect_args
+        sslmode = dict(params).get("sslmode")
+        if sslmode and sslmode != "disable":
+            async_connect_args["ssl"] = sslmode
+        params = [(key, value) for key, value in params if key != "sslmode"]
+        # Кэш серверных prepared statements asyncpg на соединение: горячие запросы
+        # (queries.py) парсятся и планируются сервером один раз. За PgBouncer в режиме
+        # transaction нужно выставить DB_PREPARED_STATEMENT_CACHE_SIZE=0
+        if "prepared_statement_cache_size" not in dict(params):
+            params.append(("prepared_statement_cache_size", DB_PREPARED_STATEMENT_CACHE_SIZE))
+        query = urlencode(params)
+        return urlunsplit(("postgresql+asyncpg", netloc, path, query, fragment)), async_connect_args
+    
+    return url, async_connect_args
+
+# Можно задать явно через ASYNC_DATABASE_URL, иначе выводим из DATABASE_URL
+ASYNC_DATABASE_URL, async_connect_args = make_async_url(DATABASE_URL)
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or ASYNC_DATABASE_URL
+
+try:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args=async_connect_args,
+        **pool_options("async", is_async=True)
+    )
+    attach_pool_events(async_engine.sync_engine, "async")
+    enable_sqlite_tuning(async_engine.sync_engine)
+    instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False,  # Объекты остаются доступны после commit без ленивых запросов
+    )
+except ImportError as e:
+    # Асинхронный драйвер не установлен (pip install asyncpg / aiosqlite)
+    logging.getLogger(__name__).warning(f"⚠️  Асинхронный драйвер БД недоступен: {e}")
+    async_engine = None
+    AsyncSessionLocal = None
+
+# --- Реплика только для чтения (необязательная) ---
+# Если DATABASE_REPLICA_URL не задан, чтение идет в основную базу.
+# Какие запросы отправлять на реплику, решает db_router.py
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+replica_engine = None
+ReplicaSessionLocal = None
+async_replica_engine = None
+AsyncReplicaSessionLocal = None
+
+if DATABASE_REPLICA_URL:
+    if DATABASE_REPLICA_URL.startswith("postgres://"):
+        DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+    replica_connect_args = {"check_same_thread": False} if DATABASE_REPLICA_URL.startswith("sqlite:") else {}
+
+    replica_engine = create_engine(
+        DATABASE_REPLICA_URL,
+        connect_args=replica_connect_args,
+        **pool_options("replica")
+    )
+    attach_pool_events(replica_engine, "replica")
+    enable_sqlite_tuning(replica_engine)
+    instrument_engine(replica_engine)
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
+    try:
+        ASYNC_REPLICA_URL, async_replica_connect_args = make_async_url(DATABASE_REPLICA_URL)
+        async_replica_engine = create_async_engine(
+            ASYNC_REPLICA_URL,
+            connect_args=async_replica_connect_args,
+            **pool_options("replica_async", is_async=True)
+        )
+        attach_pool_events(async_replica_engine.sync_engine, "replica_async")
+        enable_sqlite_tuning(async_replica_engine.sync_engine)
+        instrument_engine(async_replica_engine.sync_engine)
+        AsyncReplicaSessionLocal = async_sessionmaker(
+            async_replica_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    except ImportError as e:
+        logging.getLogger(__name__).warning(f"⚠️  Асинхронный драйвер для реплики недоступен: {e}")
+
 # --- Enums ---
 class UserRole(str, enum.Enum):
     DRIVER = "driver"
@@ -76,6 +212,24 @@ class User(Base):
     passenger_rating = Column(Float, default=5.0)
     total_driver_trips = Column(Integer, default=0)
     total_passenger_trips = Column(Integer, default=0)
+    # Суммы и количества оценок из reviews (см. ratings.py): рейтинг = сумма / количество.
+    # Подоценки отдельно по ролям: оценки водителя и пассажира не смешиваются
+    driver_rating_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_rating_count = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_punctuality_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_punctuality_count = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_comfort_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_comfort_count = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_communication_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_communication_count = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_rating_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_rating_count = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_punctuality_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_punctuality_count = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_comfort_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_comfort_count = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_communication_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    passenger_communication_count = Column(Integer, default=0, server_default="0", nullable=False)
     
     # Системные поля
     registration_date = Column(DateTime, default=datetime.utcnow)
@@ -83,6 +237,10 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     role = Column(Enum(UserRole), default=UserRole.PASSENGER)
     is_bot = Column(Boolean, default=False)
+    # Непрочитанные входящие сообщения (денормализовано, см. unread_counters.py)
+    unread_messages = Column(Integer, default=0, server_default="0", nullable=False)
+    # Меняется при любом изменении профиля (кроме last_active) - используется для ETag
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Связи
     driver_trips = relationship("DriverTrip", back_populates="driver", cascade="all, delete-orphan")
@@ -147,6 +305,11 @@ class DriverTrip(Base):
     # Связи
     driver = relationship("User", back_populates="driver_trips")
     bookings = relationship("Booking", back_populates="driver_trip", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # "Мои поездки" водителя: вкладки предстоящие/прошедшие и keyset-пагинация
+        Index("ix_driver_trips_driver_departure", "driver_id", "departure_date"),
+    )
 
 # --- Таблица запросов пассажиров ---
 class PassengerTrip(Base):
@@ -208,18 +371,30 @@ class Booking(Base):
     cancelled_at = Column(DateTime)
     completed_at = Column(DateTime)
     
+    # Непрочитанные сообщения по бронированию у пассажира и у водителя
+    passenger_unread = Column(Integer, default=0, server_default="0", nullable=False)
+    driver_unread = Column(Integer, default=0, server_default="0", nullable=False)
+    
     # Связи
     driver_trip = relationship("DriverTrip", back_populates="bookings")
     passenger_trip = relationship("PassengerTrip", back_populates="bookings")
     passenger = relationship("User", foreign_keys=[passenger_id], back_populates="bookings_as_passenger")
-    review = relationship("Review", uselist=False, back_populates="booking", cascade="all, delete-orphan")
+    # Пассажир и водитель оставляют по отзыву друг о друге
+    reviews = relationship("Review", back_populates="booking", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # "Мои поездки" пассажира: keyset-пагинация по времени бронирования
+        Index("ix_bookings_passenger_booked", "passenger_id", "booked_at"),
+        # Подсчет бронирований по поездкам (GROUP BY driver_trip_id)
+        Index("ix_bookings_driver_trip_id", "driver_trip_id"),
+    )
 
 # --- Таблица отзывов ---
 class Review(Base):
     __tablename__ = "reviews"
     
     id = Column(Integer, primary_key=True, index=True)
-    booking_id = Column(Integer, ForeignKey("bookings.id", ondelete="CASCADE"), unique=True)
+    booking_id = Column(Integer, ForeignKey("bookings.id", ondelete="CASCADE"))
     
     # Кто оценивает и кого
     reviewer_user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -237,9 +412,16 @@ class Review(Base):
     is_anonymous = Column(Boolean, default=False)
     
     # Связи
-    booking = relationship("Booking", back_populates="review")
+    booking = relationship("Booking", back_populates="reviews")
     reviewer = relationship("User", foreign_keys=[reviewer_user_id], back_populates="reviews_given")
     reviewed_user = relationship("User", foreign_keys=[reviewed_user_id], back_populates="reviews_received")
+    
+    __table_args__ = (
+        # Один отзыв от каждого участника бронирования
+        UniqueConstraint("booking_id", "reviewer_user_id", name="uq_reviews_booking_reviewer"),
+        # Пересчет рейтингов пользователя (GROUP BY reviewed_user_id)
+        Index("ix_reviews_reviewed_user_id", "reviewed_user_id"),
+    )
 
 # --- Таблица сообщений ---
 class Message(Base):
@@ -257,6 +439,13 @@ class Message(Base):
     # Связи
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
+    
+    __table_args__ = (
+        # Непрочитанные входящие: ожидание новых сообщений и счетчики
+        Index("ix_messages_receiver_unread", "receiver_id", "is_read", "sent_at"),
+        # Переписка двух пользователей (keyset по sent_at)
+        Index("ix_messages_pair_sent", "sender_id", "receiver_id", "sent_at"),
+    )
 
 # Модель автомобиля пользователя
 class UserCar(Base):
@@ -280,6 +469,62 @@ class UserCar(Base):
     
     user = relationship("User", back_populates="cars")
 
+# --- Очередь исходящих уведомлений Telegram (outbox) ---
+# Строка добавляется в той же транзакции, что и изменение (бронь, отмена поездки),
+# отправляет ее фоновый диспетчер (notifications.py) с учетом лимитов Telegram
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger, nullable=False)
+    kind = Column(String(30), nullable=False)
+    text = Column(Text, nullable=False)
+    # Рассылка, к которой относится сообщение (broadcasts.py); NULL - обычное уведомление
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), index=True)
+    
+    # pending -> sent | failed
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    # Когда можно отправлять: время следующей попытки или аренды отправителем
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+    
+    __table_args__ = (
+        # Выборка диспетчера: pending с наступившим next_attempt_at
+        Index("ix_notification_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+class Broadcast(Base):
+    """Рассылка администратора: получатели ставятся в outbox пачками по курсору last_user_id"""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    # all | drivers | passengers; city - только участники поездок из/в город
+    segment = Column(String(20), nullable=False, default="all")
+    city = Column(String(100))
+    created_by = Column(BigInteger)
+
+    # running -> done | cancelled
+    status = Column(String(20), nullable=False, default="running")
+    # Последний поставленный в outbox users.id: после перезапуска продолжаем с него
+    last_user_id = Column(Integer, nullable=False, default=0)
+    enqueued = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+class UserChange(Base):
+    """Лента изменений пользователей: по ней бот сбрасывает свой кэш профилей (change_feed.py)"""
+    __tablename__ = "user_changes"
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
 def get_db():
     """Получить сессию базы данных"""
     db = SessionLocal()
@@ -288,3 +533,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Получить асинхронную сессию базы данных"""
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Асинхронный драйвер БД не установлен (asyncpg / aiosqlite)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
@@ -0,0 +1,126 @@
+# db_router.py - МАРШРУТИЗАЦИЯ ЧТЕНИЯ НА РЕПЛИКУ
+#
+# GET-эндпоинты (поиск, детали поездки, профиль, статистика) читают с реплики,
+# если задан DATABASE_REPLICA_URL. Реплика отстает от основной базы, поэтому
+# пользователь, который только что что-то записал (бронирование, отмена,
+# обновление профиля), еще REPLICA_STICKY_SECONDS читает из основной базы -
+# так он сразу видит свои изменения (read-your-writes).
+#
+# Отметку о записи несет сам клиент: ответ на запрос с записью получает время
+# записи в cookie last_write и заголовке X-Last-Write, и следующий запрос читает
+# из основной базы на любом воркере и инстансе API. Память процесса
+# (_recent_writers) остается быстрым путем для клиентов, которые не вернули ни
+# cookie, ни заголовок. Подделанная отметка только уводит чтение на основную базу.
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Request, Response
+
+import database
+from user_cache import TTLCache
+
+# Сколько секунд после записи пользователь читает из основной базы.
+# Должно быть больше типичного отставания реплики
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+REPLICA_STICKY_MAX_USERS = int(os.getenv("REPLICA_STICKY_MAX_USERS", "100000"))
+
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+# telegram_id недавно писавших пользователей (в пределах процесса)
+_recent_writers = TTLCache(REPLICA_STICKY_MAX_USERS, REPLICA_STICKY_SECONDS)
+
+# Время записи в текущем HTTP-запросе (словарь создает middleware, см. start_request)
+_request_write: ContextVar[Optional[dict]] = ContextVar("request_write", default=None)
+
+
+def start_request() -> dict:
+    holder = {}
+    _request_write.set(holder)
+    return holder
+
+
+def finish_request(response: Response, holder: dict):
+    """Передать клиенту время записи, если запрос что-то записал"""
+    written_at = holder.get("written_at")
+    if written_at is None:
+        return
+    value = f"{written_at:.3f}"
+    response.headers[LAST_WRITE_HEADER] = value
+    # Mini App открыт с другого домена (GitHub Pages) - cookie должна быть SameSite=None
+    response.set_cookie(
+        LAST_WRITE_COOKIE, value, max_age=int(REPLICA_STICKY_SECONDS) + 1,
+        httponly=True, secure=True, samesite="none"
+    )
+
+
+def mark_write(telegram_id: Optional[int]):
+    """Запомнить, что пользователь только что записал данные"""
+    if telegram_id is not None:
+        _recent_writers.set(int(telegram_id), True)
+    holder = _request_write.get()
+    if holder is not None:
+        holder["written_at"] = time.time()
+
+
+def wrote_recently(telegram_id: Optional[int]) -> bool:
+    return telegram_id is not None and _recent_writers.get(int(telegram_id)) is not None
+
+
+def client_wrote_recently(request: Request) -> bool:
+    """Отметка о записи из заголовка X-Last-Write или cookie last_write"""
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        age = time.time() - float(value)
+    except (TypeError, ValueError):
+        return False
+    # Отметки из будущего (расхождение часов инстансов) учитываем в тех же пределах
+    return abs(age) < REPLICA_STICKY_SECONDS
+
+
+def request_telegram_id(request: Request) -> Optional[int]:
+    """telegram_id вызывающего: из параметра запроса или заголовка X-Telegram-User-Id"""
+    value = request.query_params.get("telegram_id")
+    if value is not None:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return getattr(request.state, "telegram_id", None)
+
+
+def use_replica(request: Request) -> bool:
+    return not client_wrote_recently(request) and not wrote_recently(request_telegram_id(request))
+
+
+def get_read_db(request: Request):
+    """Сессия только для чтения: реплика, если она есть и пользователь ничего не писал"""
+    if database.ReplicaSessionLocal is None or not use_replica(request):
+        yield from database.get_db()
+        return
+    db = database.ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    """Асинхронная сессия только для чтения (см. get_read_db)"""
+    if database.AsyncReplicaSessionLocal is None or not use_replica(request):
+        async for db in database.get_async_db():
+            yield db
+        return
+    async with database.AsyncReplicaSessionLocal() as db:
+        yield db
+
+
+def router_status() -> dict:
+    return {
+        "replica_enabled": database.replica_engine is not None,
+        "async_replica_enabled": database.async_replica_engine is not None,
+        "sticky_seconds": REPLICA_STICKY_SECONDS,
+        "sticky_users": _recent_writers.stats()
+    }
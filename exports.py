@@ -0,0 +1,144 @@
+# exports.py - ПОТОКОВАЯ ВЫГРУЗКА ТАБЛИЦ (NDJSON / CSV)
+#
+# Строки читаются серверным курсором (stream_results) пачками по
+# EXPORT_BATCH_SIZE и сразу отдаются клиенту, поэтому память воркера
+# не зависит от размера таблицы. Выгрузка идет с реплики, если она задана.
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from enum import Enum
+from typing import Iterator, NamedTuple, Optional, Sequence
+
+from sqlalchemy import select
+
+import database
+from database import Booking, DriverTrip, User
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
+class ExportSpec(NamedTuple):
+    """Что выгружать: колонки, колонка для фильтра по датам, порядок"""
+    columns: tuple
+    date_column: object
+    order_column: object
+
+
+EXPORTS = {
+    "users": ExportSpec(
+        columns=(
+            User.id, User.telegram_id, User.username, User.first_name, User.last_name,
+            User.phone, User.language_code, User.role, User.has_car, User.car_model,
+            User.car_color, User.car_plate, User.driver_rating, User.passenger_rating,
+            User.total_driver_trips, User.total_passenger_trips, User.is_active,
+            User.registration_date, User.last_active
+        ),
+        date_column=User.registration_date,
+        order_column=User.id
+    ),
+    "trips": ExportSpec(
+        columns=(
+            DriverTrip.id, DriverTrip.driver_id, DriverTrip.departure_date, DriverTrip.departure_time,
+            DriverTrip.estimated_arrival, DriverTrip.start_address, DriverTrip.start_city,
+            DriverTrip.finish_address, DriverTrip.finish_city, DriverTrip.route_distance,
+            DriverTrip.route_duration, DriverTrip.available_seats, DriverTrip.price_per_seat,
+            DriverTrip.status, DriverTrip.created_at, DriverTrip.updated_at
+        ),
+        date_column=DriverTrip.departure_date,
+        order_column=DriverTrip.id
+    ),
+    "bookings": ExportSpec(
+        columns=(
+            Booking.id, Booking.driver_trip_id, Booking.passenger_id, Booking.booked_seats,
+            Booking.price_agreed, Booking.status, Booking.booked_at, Booking.confirmed_at,
+            Booking.cancelled_at, Booking.completed_at
+        ),
+        date_column=Booking.booked_at,
+        order_column=Booking.id
+    ),
+}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def export_batches(name: str, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                   columns: Optional[Sequence] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[list]:
+    """Пачки строк выгрузки name; date_from включительно, date_to - не включая"""
+    spec = EXPORTS[name]
+    statement = select(*(columns or spec.columns)).order_by(spec.order_column)
+    if date_from is not None:
+        statement = statement.where(spec.date_column >= date_from)
+    if date_to is not None:
+        statement = statement.where(spec.date_column < date_to)
+
+    engine = database.replica_engine or database.engine
+    # Отдельное соединение на всю выгрузку: генератор живет дольше обработчика запроса
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+        for batch in result.partitions():
+            yield batch
+
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+if orjson is not None:
+    def _dumps(data: dict) -> bytes:
+        return orjson.dumps(data)
+else:
+    def _dumps(data: dict) -> bytes:
+        return json.dumps(data, ensure_ascii=False, default=_plain).encode("utf-8")
+
+
+def iter_ndjson(name: str, **filters) -> Iterator[bytes]:
+    """Одна JSON-строка на запись"""
+    for batch in export_batches(name, **filters):
+        yield b"".join(_dumps(row._asdict()) + b"\n" for row in batch)
+
+
+def iter_csv(name: str, **filters) -> Iterator[bytes]:
+    """CSV с заголовком; пачка строк - один кусок ответа"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    columns = filters.get("columns") or EXPORTS[name].columns
+    writer.writerow([column.key for column in columns])
+    for batch in export_batches(name, **filters):
+        writer.writerows([_plain(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Только заголовок - выборка пустая
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_json_document(name: str, key: str, **filters) -> Iterator[bytes]:
+    """Обычный JSON-документ {"success": true, key: [...], "count": N}, собираемый по частям"""
+    yield b'{"success":true,"' + key.encode("utf-8") + b'":['
+    count = 0
+    for batch in export_batches(name, **filters):
+        chunk = b",".join(_dumps(row._asdict()) for row in batch)
+        yield (b"," if count else b"") + chunk
+        count += len(batch)
+    yield b'],"count":' + str(count).encode("ascii") + b"}"
+
+
+FORMATS = {
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+}
@@ -0,0 +1,44 @@
+# http_cache.py - ETag И УСЛОВНЫЕ GET-ЗАПРОСЫ
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Клиент обязан перепроверять ответ каждый раз, но может получить 304 без тела
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """Слабый ETag из версионных полей (updated_at, счетчики и т.п.)"""
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    return 'W/"' + hashlib.md5(raw.encode("utf-8")).hexdigest() + '"'
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверка If-None-Match (слабое сравнение, поддерживаются списки и *)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = _strip_weak(etag)
+    return any(_strip_weak(tag) == current for tag in header.split(","))
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Вернуть 304, если у клиента актуальная версия, иначе None"""
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    """Проставить ETag в готовый ответ"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
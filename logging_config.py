@@ -0,0 +1,189 @@
+# logging_config.py - НАСТРОЙКА ЛОГИРОВАНИЯ API И БОТА
+#
+# Обработчики запросов только кладут запись в очередь (QueueHandler), а запись
+# в файл и консоль делает отдельный поток QueueListener - медленный диск не
+# задерживает ответы. Файл ротируется по размеру и по времени, уровни задаются
+# по модулям, шумные логгеры (httpx пишет строку на каждый запрос к Bot API)
+# прореживаются до заданной доли записей.
+#
+# Переменные окружения:
+#   LOG_LEVEL=INFO                         - уровень по умолчанию
+#   LOG_LEVELS=httpx=WARNING,telegram=INFO - уровни отдельных логгеров
+#   LOG_SAMPLING=httpx=0.01                - доля пропускаемых записей ниже WARNING
+#   LOG_FORMAT=text|json
+#   LOG_FILE=bot.log                       - файл (пусто - только консоль)
+#   LOG_MAX_BYTES=10485760, LOG_BACKUP_COUNT=5, LOG_ROTATE_HOURS=24
+#   LOG_QUEUE_SIZE=10000                   - при переполнении записи отбрасываются
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "httpx=0.01")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+def parse_pairs(spec: str) -> Dict[str, str]:
+    """'httpx=WARNING, telegram=INFO' -> {'httpx': 'WARNING', 'telegram': 'INFO'}"""
+    pairs = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip() and value.strip():
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Ротация по размеру (maxBytes) или по времени (каждые interval секунд) - что наступит раньше.
+    Архивы нумеруются как у RotatingFileHandler: bot.log.1 ... bot.log.N"""
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, interval: float):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.interval = interval
+        # После перезапуска отсчет идет от последней записи в файл, а не от старта процесса
+        started = os.path.getmtime(filename) if os.path.exists(filename) and os.path.getsize(filename) else time.time()
+        self.rollover_at = started + interval if interval > 0 else float("inf")
+
+    def shouldRollover(self, record) -> bool:
+        if time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval > 0:
+            self.rollover_at = time.time() + self.interval
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает каждую N-ю запись ниже WARNING (rate = 1/N); предупреждения и ошибки - всегда"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if not self.every:
+            return False
+        with self._lock:
+            self._seen += 1
+            return (self._seen - 1) % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись - для сборщиков логов"""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "service": self.service,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполненной очереди теряет запись, а не блокирует запрос"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(service: str, log_file: Optional[str] = None) -> logging.Logger:
+    """
+    Настроить корневой логгер процесса (повторные вызовы ничего не меняют).
+    log_file - файл по умолчанию, если LOG_FILE не задан.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return logging.getLogger(service)
+
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter(service)
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    log_file = os.getenv("LOG_FILE", log_file or "")
+    if log_file:
+        handlers.append(SizeAndTimeRotatingFileHandler(
+            log_file, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_HOURS * 3600
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    root = logging.getLogger()
+    # Убираем обработчики, добавленные до настройки (basicConfig и т.п.)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    for name, level in parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+    for name, rate in parse_pairs(LOG_SAMPLING).items():
+        # Фильтр на самом логгере: лишние записи отбрасываются до очереди
+        logging.getLogger(name).addFilter(SamplingFilter(float(rate)))
+
+    return logging.getLogger(service)
+
+
+def shutdown_logging():
+    """Дописать очередь и остановить поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def logging_status() -> dict:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "level": LOG_LEVEL,
+        "levels": parse_pairs(LOG_LEVELS),
+        "sampling": parse_pairs(LOG_SAMPLING),
+    }
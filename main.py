@@ -1,16 +1,45 @@
 # main.py - ОПТИМИЗИРОВАННЫЙ API ДЛЯ TELEGRAM WEB APP
+from logging_config import setup_logging
+# Логирование настраивается до импорта модулей, которые пишут в лог при загрузке
+logger = setup_logging("api")
+import asyncio
 import threading
+from collections import Counter
 import time
 from sqlalchemy import text
 from datetime import datetime
-from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Path, Header
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import desc, or_, and_, func, select, update, true
 from datetime import datetime, timedelta
 import database
+from activity_buffer import activity_buffer
+from user_cache import CachedUser, user_cache, remember_user, invalidate_user, invalidate_users
+from change_feed import UserChangeFeed, record_user_change
+import bot_db
+from serializers import FastJSONResponse, format_departure, encode_trip, encode_trip_search_row, encode_trip_details, encode_message
+from http_cache import make_etag, not_modified, with_etag
+from compression import CompressionMiddleware
+from pool_metrics import pool_stats
+from db_router import get_read_db, get_async_read_db, mark_write, router_status
+import db_router
+import sql_metrics
+from slow_queries import slow_query_log
+import queries
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, page_of
+import exports
+import notifications
+from notifications import notification_dispatcher
+from broadcasts import broadcaster
+from message_hub import MESSAGES_WAIT_MAX_TIMEOUT, MESSAGES_WAIT_TIMEOUT, HubFull, message_hub
+from unread_counters import unread_reconciler
+from ratings import rating_summary
 from typing import List, Optional, Dict, Any
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 import json
 import hashlib
@@ -21,8 +50,10 @@ import sys
 from minimal_bot import (
     handle_telegram_auth, 
     handle_simple_auth, 
-    handle_debug_check_auth
+    handle_debug_check_auth,
+    build_application
 )
+import bot_webhook
 
 def format_user_response(user: database.User) -> dict:
     """Форматирует ответ с данными пользователя"""
@@ -54,42 +85,84 @@ def format_user_response(user: database.User) -> dict:
 
 def format_trip_response(trip: database.DriverTrip) -> dict:
     """Форматирует ответ с данными поездки"""
-    driver = trip.driver
-    return {
-        "id": trip.id,
-        "driver": {
-            "id": driver.id,
-            "name": f"{driver.first_name} {driver.last_name or ''}".strip(),
-            "rating": driver.driver_rating,
-            "phone": driver.phone
-        },
-        "route": {
-            "from": trip.start_address,
-            "to": trip.finish_address,
-            "from_city": trip.start_city,
-            "to_city": trip.finish_city
-        },
-        "departure": {
-            "date": trip.departure_date.strftime("%Y-%m-%d"),
-            "time": trip.departure_time,
-            "datetime": trip.departure_date.strftime("%d.%m.%Y %H:%M")
-        },
-        "seats": {
-            "available": trip.available_seats,
-            "price_per_seat": trip.price_per_seat
-        },
-        "details": {
-            "comment": trip.comment
-        },
-        "car_info": {
-            "model": driver.car_model,
-            "color": driver.car_color,
-            "plate": driver.car_plate,
-            "type": driver.car_type.value if driver.car_type else None
-        } if driver.has_car else None,
-        "status": trip.status.value,
-        "estimated_arrival": trip.estimated_arrival.isoformat() if hasattr(trip, 'estimated_arrival') and trip.estimated_arrival else None
-    }
+    return encode_trip(trip)
+
+def get_user_record(db: Session, telegram_id: int) -> CachedUser:
+    """Найти пользователя по telegram_id (сначала в кэше, потом в БД) или вернуть 404"""
+    record = user_cache.get(telegram_id)
+    if record is not None:
+        return record
+    
+    user = db.execute(queries.USER_BY_TELEGRAM_ID, {"telegram_id": telegram_id}).scalars().first()
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    
+    return remember_user(user)
+
+async def get_user_record_async(db: AsyncSession, telegram_id: int) -> CachedUser:
+    """Асинхронный вариант get_user_record"""
+    record = user_cache.get(telegram_id)
+    if record is not None:
+        return record
+    
+    result = await db.execute(queries.USER_BY_TELEGRAM_ID, {"telegram_id": telegram_id})
+    user = result.scalars().first()
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    
+    return remember_user(user)
+
+def trip_etag(db: Session, trip_id: int) -> Optional[str]:
+    """ETag деталей поездки по версиям поездки и водителя (без загрузки объектов)"""
+    row = db.execute(queries.TRIP_ETAG_ROW, {"trip_id": trip_id}).first()
+    
+    if row is None:
+        return None
+    return make_etag("trip", trip_id, *row)
+
+async def profile_etag(db: AsyncSession, user_id: int):
+    """
+    ETag полного профиля: одна агрегирующая выборка по всем связанным таблицам.
+    Возвращает (etag, строка пользователя) - поля пользователя для ответа берутся
+    из той же выборки, что и ETag, а не из кэша процесса. (None, None), если пользователя нет.
+    """
+    DriverTrip, Booking, User = database.DriverTrip, database.Booking, database.User
+    
+    profile = select(*queries.PROFILE_USER_COLUMNS).where(User.id == user_id).subquery()
+    
+    cars = select(
+        func.count(UserCar.id), func.max(UserCar.updated_at)
+    ).where(UserCar.user_id == user_id).subquery()
+    
+    trips = select(
+        func.count(DriverTrip.id), func.max(DriverTrip.updated_at)
+    ).where(DriverTrip.driver_id == user_id).subquery()
+    
+    bookings = select(
+        func.count(Booking.id),
+        func.max(Booking.booked_at),
+        func.max(Booking.cancelled_at),
+        func.max(Booking.confirmed_at),
+        func.max(Booking.completed_at),
+        func.max(DriverTrip.updated_at),
+        func.max(User.updated_at)
+    ).join(
+        DriverTrip, DriverTrip.id == Booking.driver_trip_id
+    ).join(
+        User, User.id == DriverTrip.driver_id
+    ).where(Booking.passenger_id == user_id).subquery()
+    
+    # Каждый подзапрос возвращает ровно одну строку - соединяем их явно по true()
+    result = await db.execute(select(
+        profile, cars, trips, bookings
+    ).select_from(profile.join(cars, true()).join(trips, true()).join(bookings, true())))
+    row = result.first()
+    if row is None:
+        return None, None
+    
+    return make_etag("profile", user_id, *row), row
 
 def update_trip_statuses(db: Session):
     """Автоматическое завершение поездок по истечении времени"""
@@ -107,7 +180,7 @@ def update_trip_statuses(db: Session):
         
         if arrival_time < now:
             trip.status = database.TripStatus.COMPLETED
-            print(f"Поездка {trip.id} автоматически завершена")
+            logger.info(f"Поездка {trip.id} автоматически завершена")
             
     db.commit()
 
@@ -224,6 +297,26 @@ class DriverTripUpdate(BaseModel):
     start_address: Optional[str] = None
     finish_address: Optional[str] = None
 
+# 8. Сообщения
+class MessageCreate(BaseModel):
+    receiver_id: int
+    booking_id: Optional[int] = None
+    content: str = Field(..., min_length=1, max_length=4000)
+
+class MessagesRead(BaseModel):
+    peer_id: int
+    up_to_id: int
+
+# 9. Отзывы
+class ReviewCreate(BaseModel):
+    booking_id: int
+    rating: int = Field(..., ge=1, le=5)
+    punctuality: Optional[int] = Field(None, ge=1, le=5)
+    comfort: Optional[int] = Field(None, ge=1, le=5)
+    communication: Optional[int] = Field(None, ge=1, le=5)
+    comment: Optional[str] = Field(None, max_length=2000)
+    is_anonymous: bool = False
+
 # =============== FASTAPI APP ===============
 app = FastAPI(
     title="Travel Companion API",
@@ -244,8 +337,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Клиент возвращает отметку о записи в заголовке (db_router.py)
+    expose_headers=[db_router.LAST_WRITE_HEADER],
 )
 
+# Сжатие больших ответов (поиск, мои поездки, выгрузки) для мобильных клиентов.
+# Порог и уровни: COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+app.add_middleware(CompressionMiddleware)
+
 # Middleware для обработки Telegram данных
 @app.middleware("http")
 async def add_telegram_user(request: Request, call_next):
@@ -262,22 +361,71 @@ async def add_telegram_user(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# Отметка о записи для чтения своих изменений на любом воркере (db_router.py)
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    holder = db_router.start_request()
+    response = await call_next(request)
+    db_router.finish_request(response, holder)
+    return response
+
+# Счетчик SQL-запросов на каждый HTTP-запрос: заголовок Server-Timing + метрики по эндпоинтам
+@app.middleware("http")
+async def sql_instrumentation(request: Request, call_next):
+    stats = sql_metrics.start_request(f"{request.method} {request.url.path}")
+    response = await call_next(request)
+    if stats.streaming:
+        # Заголовки потокового ответа уходят до чтения данных: Server-Timing и метрики
+        # эндпоинта показали бы почти ноль запросов
+        return response
+    
+    route = request.scope.get("route")
+    endpoint = f"{request.method} {route.path if route else request.url.path}"
+    suspects = sql_metrics.finish_request(endpoint, stats)
+    
+    response.headers["Server-Timing"] = stats.server_timing()
+    if suspects:
+        response.headers["X-SQL-N-Plus-One"] = str(len(suspects))
+    return response
+
+# =============== TELEGRAM WEBHOOK ===============
+# BOT_MODE=webhook + BOT_WEBHOOK_IN_API=true: обновления бота принимает API,
+# отдельный воркер с polling не нужен
+bot_application = None
+if bot_webhook.BOT_MODE == "webhook" and bot_webhook.BOT_WEBHOOK_IN_API:
+    bot_application = build_application(db_available=True)
+    app.add_route(
+        bot_webhook.BOT_WEBHOOK_PATH,
+        bot_webhook.webhook_endpoint(bot_application),
+        methods=["POST"],
+        include_in_schema=False
+    )
+
+# Кэш пользователей в этом воркере сбрасывается и по изменениям, сделанным
+# ботом и другими воркерами API (лента user_changes)
+def invalidate_changed_users(telegram_ids):
+    invalidate_users(telegram_ids)
+    if bot_application is not None:
+        bot_db.invalidate_profiles(telegram_ids)
+
+user_change_feed = UserChangeFeed(invalidate_changed_users)
+
 # =============== STARTUP EVENT ===============
 @app.on_event("startup")
 async def startup_event():
     """Создание таблиц, проверка структуры БД и запуск фоновых задач"""
-    print("=" * 60)
-    print("🚀 ЗАПУСК TRAVEL COMPANION API (Версия с картами)")
-    print("=" * 60)
+    logger.info("=" * 60)
+    logger.info("🚀 ЗАПУСК TRAVEL COMPANION API (Версия с картами)")
+    logger.info("=" * 60)
     
     try:
         # 1. Создаем таблицы в базе данных
-        print("🗄️  Создание/проверка таблиц базы данных...")
+        logger.info("🗄️  Создание/проверка таблиц базы данных...")
         database.Base.metadata.create_all(bind=database.engine)
-        print("✅ Таблицы базы данных созданы/проверены")
+        logger.info("✅ Таблицы базы данных созданы/проверены")
         
         # 2. Проверяем подключение к базе данных
-        print("🔌 Проверка подключения к базе данных...")
+        logger.info("🔌 Проверка подключения к базе данных...")
         from sqlalchemy import text
         
         session = database.SessionLocal()
@@ -286,20 +434,18 @@ async def startup_event():
             session.commit()
             
             if result.scalar() == 1:
-                print("✅ Подключение к базе данных успешно")
+                logger.info("✅ Подключение к базе данных успешно")
             else:
-                print("⚠️  Неожиданный результат проверки БД")
+                logger.warning("⚠️  Неожиданный результат проверки БД")
                 
         except Exception as e:
-            print(f"❌ Ошибка подключения к базе: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"❌ Ошибка подключения к базе: {e}")
             raise
         finally:
             session.close()
         
         # 3. ПРОВЕРЯЕМ И ДОБАВЛЯЕМ ОТСУТСТВУЮЩИЕ ПОЛЯ ДЛЯ КАРТ
-        print("🔄 Проверяем и добавляем поля для карт...")
+        logger.info("🔄 Проверяем и добавляем поля для карт...")
         session = database.SessionLocal()
         try:
             # Список полей для проверки/добавления
@@ -339,7 +485,7 @@ async def startup_event():
                     """))
                     
                     if not result.fetchone():
-                        print(f"   ➕ Добавляем поле: {field['name']} ({field['description']})")
+                        logger.info(f"   ➕ Добавляем поле: {field['name']} ({field['description']})")
                         
                         # Добавляем поле в таблицу
                         if 'postgresql' in os.getenv('DATABASE_URL', ''):
@@ -357,21 +503,21 @@ async def startup_event():
                         
                         session.commit()
                         added_fields.append(field['name'])
-                        print(f"   ✅ Поле {field['name']} успешно добавлено")
+                        logger.info(f"   ✅ Поле {field['name']} успешно добавлено")
                     else:
-                        print(f"   ✓ Поле {field['name']} уже существует")
+                        logger.info(f"   ✓ Поле {field['name']} уже существует")
                         
                 except Exception as field_error:
-                    print(f"   ⚠️  Ошибка при работе с полем {field['name']}: {str(field_error)[:100]}")
+                    logger.warning(f"   ⚠️  Ошибка при работе с полем {field['name']}: {str(field_error)[:100]}")
                     session.rollback()
             
             if added_fields:
-                print(f"✅ Добавлены новые поля: {', '.join(added_fields)}")
+                logger.info(f"✅ Добавлены новые поля: {', '.join(added_fields)}")
             else:
-                print("✅ Все необходимые поля уже существуют")
+                logger.info("✅ Все необходимые поля уже существуют")
             
             # Проверяем общую структуру таблицы driver_trips
-            print("\n📊 Структура таблицы driver_trips:")
+            logger.info("📊 Структура таблицы driver_trips:")
             result = session.execute(text("""
                 SELECT column_name, data_type 
                 FROM information_schema.columns 
@@ -380,22 +526,48 @@ async def startup_event():
             """))
             
             columns = result.fetchall()
-            print(f"   Всего столбцов: {len(columns)}")
+            logger.info(f"   Всего столбцов: {len(columns)}")
             
             # Отображаем только поля связанные с картами
             map_columns = [col for col in columns if any(field in col[0] for field in 
                           ['coordinates', 'polyline', 'estimated', 'route_'])]
             
             for col in map_columns:
-                print(f"   • {col[0]}: {col[1]}")
+                logger.info(f"   • {col[0]}: {col[1]}")
             
         except Exception as e:
-            print(f"⚠️  Ошибка проверки структуры БД: {e}")
+            logger.warning(f"⚠️  Ошибка проверки структуры БД: {e}")
         finally:
             session.close()
         
-        # 4. ЗАПУСКАЕМ ФОНОВУЮ ЗАДАЧУ ДЛЯ ОБНОВЛЕНИЯ СТАТУСОВ
-        print("\n🔄 Запуск фоновой задачи для обновления статусов...")
+        # 4. ЗАПУСКАЕМ ОТЛОЖЕННУЮ ЗАПИСЬ АКТИВНОСТИ ПОЛЬЗОВАТЕЛЕЙ
+        activity_buffer.start()
+        logger.info(f"✅ Буфер last_active запущен (сброс каждые {activity_buffer.flush_interval} сек "
+                    f"или по {activity_buffer.batch_size} записей)")
+        
+        # Сверка счетчиков непрочитанных сообщений с messages
+        unread_reconciler.start()
+        
+        # Отправка уведомлений из outbox
+        if notifications.NOTIFY_DISPATCHER and TELEGRAM_BOT_TOKEN:
+            await notification_dispatcher.start()
+            logger.info(f"✅ Диспетчер уведомлений запущен ({notifications.NOTIFY_GLOBAL_RATE:g} сообщ./сек, "
+                        f"{notifications.NOTIFY_CHAT_RATE:g} в чат)")
+            # Незавершенные рассылки продолжаются с сохраненного курсора
+            await broadcaster.start()
+        else:
+            logger.info("ℹ️  Диспетчер уведомлений не запущен в этом процессе (NOTIFY_DISPATCHER=true - в одном из них)")
+        
+        # Прием обновлений бота через webhook
+        if bot_application is not None:
+            await bot_webhook.start_webhook(bot_application)
+            logger.info(f"✅ Webhook бота: {bot_webhook.webhook_url() or bot_webhook.BOT_WEBHOOK_PATH}")
+        
+        # Изменения пользователей из других процессов сбрасывают кэши этого воркера
+        user_change_feed.start()
+        
+        # 5. ЗАПУСКАЕМ ФОНОВУЮ ЗАДАЧУ ДЛЯ ОБНОВЛЕНИЯ СТАТУСОВ
+        logger.info("🔄 Запуск фоновой задачи для обновления статусов...")
         try:
             # Функция для фоновой задачи
             def update_trip_statuses_task():
@@ -403,7 +575,7 @@ async def startup_event():
                 import time
                 from datetime import datetime, timedelta
                 
-                print("   📡 Фоновая задача запущена")
+                logger.info("   📡 Фоновая задача запущена")
                 
                 # Счетчик циклов для логирования
                 cycle_count = 0
@@ -417,19 +589,19 @@ async def startup_event():
                     try:
                         db_session = database.SessionLocal()
                         
-                        # 4.1. Обновляем поездки, которые должны начаться (ACTIVE → IN_PROGRESS)
+                        # 5.1. Обновляем поездки, которые должны начаться (ACTIVE → IN_PROGRESS)
                         active_trips = db_session.query(database.DriverTrip).filter(
                             database.DriverTrip.status == database.TripStatus.ACTIVE,
                             database.DriverTrip.departure_date <= current_time
                         ).all()
                         
                         if active_trips:
-                            print(f"   🚗 {len(active_trips)} поездок начинаются...")
+                            logger.info(f"   🚗 {len(active_trips)} поездок начинаются...")
                             for trip in active_trips:
                                 trip.status = database.TripStatus.IN_PROGRESS
                                 trip.updated_at = current_time
                         
-                        # 4.2. Обновляем поездки, которые должны завершиться (IN_PROGRESS → COMPLETED)
+                        # 5.2. Обновляем поездки, которые должны завершиться (IN_PROGRESS → COMPLETED)
                         in_progress_trips = db_session.query(database.DriverTrip).filter(
                             database.DriverTrip.status == database.TripStatus.IN_PROGRESS
                         ).all()
@@ -462,12 +634,12 @@ async def startup_event():
                                 completed_count += 1
                         
                         if completed_count > 0:
-                            print(f"   ✅ {completed_count} поездок завершены")
+                            logger.info(f"   ✅ {completed_count} поездок завершены")
                         
                         # Коммитим изменения
                         db_session.commit()
                         
-                        # 4.3. Логируем статистику каждые 10 циклов (≈10 минут)
+                        # 5.3. Логируем статистику каждые 10 циклов (≈10 минут)
                         if cycle_count % 10 == 0:
                             try:
                                 stats = {
@@ -485,23 +657,23 @@ async def startup_event():
                                     ).count(),
                                 }
                                 
-                                print(f"   📊 Статистика: "
-                                      f"ACTIVE={stats['active']}, "
-                                      f"IN_PROGRESS={stats['in_progress']}, "
-                                      f"COMPLETED={stats['completed']}, "
-                                      f"CANCELLED={stats['cancelled']} "
-                                      f"({datetime.now().strftime('%H:%M:%S')})")
+                                logger.info(f"   📊 Статистика: "
+                                            f"ACTIVE={stats['active']}, "
+                                            f"IN_PROGRESS={stats['in_progress']}, "
+                                            f"COMPLETED={stats['completed']}, "
+                                            f"CANCELLED={stats['cancelled']} "
+                                            f"({datetime.now().strftime('%H:%M:%S')})")
                             except Exception as stats_error:
-                                print(f"   ⚠️  Ошибка статистики: {stats_error}")
+                                logger.warning(f"   ⚠️  Ошибка статистики: {stats_error}")
                         
-                        # 4.4. Закрываем сессию
+                        # 5.4. Закрываем сессию
                         db_session.close()
                         
-                        # 4.5. Ждем 60 секунд перед следующей проверкой
+                        # 5.5. Ждем 60 секунд перед следующей проверкой
                         time.sleep(60)
                         
                     except Exception as task_error:
-                        print(f"   ❌ Ошибка в фоновой задаче (цикл {cycle_count}): {task_error}")
+                        logger.error(f"   ❌ Ошибка в фоновой задаче (цикл {cycle_count}): {task_error}")
                         
                         # Закрываем сессию если она открыта
                         if db_session:
@@ -523,79 +695,103 @@ async def startup_event():
             )
             background_thread.start()
             
-            print("✅ Фоновая задача для обновления статусов запущена")
-            print(f"   Поток: {background_thread.name} (ID: {background_thread.ident})")
-            print(f"   Интервал проверки: 60 секунд")
+            logger.info("✅ Фоновая задача для обновления статусов запущена")
+            logger.info(f"   Поток: {background_thread.name} (ID: {background_thread.ident})")
+            logger.info(f"   Интервал проверки: 60 секунд")
             
         except Exception as e:
-            print(f"❌ Ошибка запуска фоновой задачи: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"❌ Ошибка запуска фоновой задачи: {e}")
         
-        # 5. ВЫВОДИМ ИНФОРМАЦИЮ О КОНФИГУРАЦИИ
-        print("\n⚙️  Конфигурация системы:")
+        # 6. ВЫВОДИМ ИНФОРМАЦИЮ О КОНФИГУРАЦИИ
+        logger.info("⚙️  Конфигурация системы:")
         
         # Информация о БД
         db_url = os.getenv("DATABASE_URL", "")
         if "postgresql" in db_url:
-            print(f"   База данных: PostgreSQL")
+            logger.info(f"   База данных: PostgreSQL")
             # Маскируем пароль в URL для безопасности
             if "@" in db_url:
                 parts = db_url.split("@")
                 if ":" in parts[0]:
                     user_part = parts[0].split(":")[0]
                     masked_url = f"{user_part}:****@{parts[1]}"
-                    print(f"   URL: {masked_url}")
+                    logger.info(f"   URL: {masked_url}")
+        else:
+            logger.info(f"   База данных: SQLite")
+        if database.async_engine is not None:
+            logger.info(f"   Асинхронный драйвер: ✅ {database.async_engine.dialect.driver}")
         else:
-            print(f"   База данных: SQLite")
+            logger.warning(f"   Асинхронный драйвер: ❌ не установлен (asyncpg / aiosqlite)")
+        if database.replica_engine is not None:
+            logger.info(f"   Реплика для чтения: ✅ {database.replica_engine.url.render_as_string(hide_password=True)}")
+        else:
+            logger.info(f"   Реплика для чтения: ❌ не задана (DATABASE_REPLICA_URL)")
         
         # Другие настройки
-        print(f"   Хост: 0.0.0.0")
-        print(f"   Порт: {os.getenv('PORT', 8000)}")
-        print(f"   Токен Telegram бота: {'✅ Установлен' if os.getenv('TELEGRAM_BOT_TOKEN') else '❌ Отсутствует'}")
+        logger.info(f"   Хост: 0.0.0.0")
+        logger.info(f"   Порт: {os.getenv('PORT', 8000)}")
+        logger.info(f"   Токен Telegram бота: {'✅ Установлен' if os.getenv('TELEGRAM_BOT_TOKEN') else '❌ Отсутствует'}")
         
         # Проверяем ключ Яндекс.Карт
         yandex_key = os.getenv("YANDEX_MAPS_API_KEY")
         if yandex_key:
             # Показываем только часть ключа для безопасности
             key_preview = yandex_key[:8] + "..." + yandex_key[-4:] if len(yandex_key) > 12 else yandex_key
-            print(f"   Ключ Яндекс.Карт: ✅ ({key_preview})")
+            logger.info(f"   Ключ Яндекс.Карт: ✅ ({key_preview})")
         else:
-            print(f"   Ключ Яндекс.Карт: ⚠️  Не установлен")
-            print(f"      Установите переменную окружения YANDEX_MAPS_API_KEY")
+            logger.warning(f"   Ключ Яндекс.Карт: ⚠️  Не установлен")
+            logger.info(f"      Установите переменную окружения YANDEX_MAPS_API_KEY")
         
-        print("=" * 60)
-        print("✅ Сервер успешно запущен и готов к работе!")
-        print("=" * 60)
+        logger.info("=" * 60)
+        logger.info("✅ Сервер успешно запущен и готов к работе!")
+        logger.info("=" * 60)
         
     except Exception as e:
-        print(f"❌ Критическая ошибка при запуске: {e}")
-        import traceback
-        traceback.print_exc()
-        print("=" * 60)
+        logger.exception(f"❌ Критическая ошибка при запуске: {e}")
+        logger.info("=" * 60)
         raise
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Действия при остановке сервера"""
-    print("\n" + "=" * 60)
-    print("🛑 ОСТАНОВКА TRAVEL COMPANION API")
-    print("=" * 60)
+    logger.info("=" * 60)
+    logger.info("🛑 ОСТАНОВКА TRAVEL COMPANION API")
+    logger.info("=" * 60)
     
     try:
         # Закрываем все соединения с базой данных
-        print("🔌 Закрытие соединений с базой данных...")
+        logger.info("🔌 Закрытие соединений с базой данных...")
+        
+        # Дожидаемся текущей пачки уведомлений
+        await broadcaster.stop()
+        await notification_dispatcher.stop()
         
-        # Можно добавить логику для graceful shutdown
-        # Например, ожидание завершения фоновых задач
+        # Дообрабатываем принятые обновления бота
+        if bot_application is not None:
+            await bot_webhook.stop_webhook(bot_application)
+            logger.info("✅ Обработка обновлений бота остановлена")
         
-        print("✅ Соединения закрыты")
+        unread_reconciler.stop()
+        user_change_feed.stop()
+        
+        # Сбрасываем накопленные обновления last_active
+        flushed = activity_buffer.stop()
+        logger.info(f"✅ Буфер last_active сброшен ({flushed} записей)")
+        
+        database.engine.dispose()
+        if database.async_engine is not None:
+            await database.async_engine.dispose()
+        if database.replica_engine is not None:
+            database.replica_engine.dispose()
+        if database.async_replica_engine is not None:
+            await database.async_replica_engine.dispose()
+        logger.info("✅ Соединения закрыты")
         
     except Exception as e:
-        print(f"⚠️  Ошибка при остановке: {e}")
+        logger.warning(f"⚠️  Ошибка при остановке: {e}")
     
-    print("👋 Сервер остановлен")
-    print("=" * 60)
+    logger.info("👋 Сервер остановлен")
+    logger.info("=" * 60)
 # =============== РОУТЫ ===============
 
 @app.get("/")
@@ -613,50 +809,53 @@ def home():
 
 # =============== TELEGRAM АВТОРИЗАЦИЯ ===============
 @app.post("/api/auth/telegram")
-async def telegram_auth(login_data: Dict[str, Any] = None, db: Session = Depends(database.get_db)):
+async def telegram_auth(login_data: Dict[str, Any] = None, db: AsyncSession = Depends(database.get_async_db)):
     """Авторизация через Telegram WebApp"""
     try:
-        print(f"🔐 Auth request received")
+        logger.debug(f"🔐 Auth request received")
         
         user_data = None
         
         # Разные форматы данных
         if login_data and 'user' in login_data:
             user_data = login_data['user']
-            print(f"✅ Using 'user' key format")
+            logger.debug(f"✅ Using 'user' key format")
         elif login_data and 'id' in login_data and 'first_name' in login_data:
             user_data = login_data
-            print(f"✅ Using direct user object format")
+            logger.debug(f"✅ Using direct user object format")
         elif login_data and 'initData' in login_data and 'user' in login_data:
             user_data = login_data['user']
-            print(f"✅ Using LoginRequest format")
+            logger.debug(f"✅ Using LoginRequest format")
         
         if not user_data:
-            print(f"❌ No user data found")
+            logger.warning(f"❌ No user data found")
             raise HTTPException(status_code=400, detail="Необходимы данные пользователя")
         
-        # Используем улучшенную функцию из minimal_bot.py
-        auth_result = handle_telegram_auth(user_data)
+        # Используем улучшенную функцию из minimal_bot.py (асинхронная сессия)
+        auth_result = await handle_telegram_auth(user_data, db)
         
         if auth_result.get("success"):
-            print(f"✅ Auth successful for Telegram ID: {user_data.get('id')}")
+            logger.debug(f"✅ Auth successful for Telegram ID: {user_data.get('id')}")
+            # Новый пользователь должен сразу увидеть свой профиль, даже если реплика отстает
+            mark_write(auth_result["user"]["telegram_id"])
             return auth_result
         else:
-            print(f"❌ Auth failed: {auth_result.get('error')}")
+            logger.warning(f"❌ Auth failed: {auth_result.get('error')}")
             raise HTTPException(status_code=401, detail=auth_result.get('error', 'Auth failed'))
             
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Auth error: {str(e)}")
+        logger.error(f"❌ Auth error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка авторизации: {str(e)}")
     
 @app.post("/api/auth/simple")
 async def simple_auth(user_data: dict):
     """Упрощенная авторизация для тестирования"""
     try:
-        print(f"🔄 Simple auth request: {user_data.get('telegram_id')}")
-        result = handle_simple_auth(user_data)
+        logger.debug(f"🔄 Simple auth request: {user_data.get('telegram_id')}")
+        # Синхронный обработчик уводим в пул потоков, чтобы не блокировать event loop
+        result = await run_in_threadpool(handle_simple_auth, user_data)
         
         if not result.get("success"):
             raise HTTPException(status_code=400, detail=result.get('error', 'Auth failed'))
@@ -664,7 +863,7 @@ async def simple_auth(user_data: dict):
         return result
         
     except Exception as e:
-        print(f"❌ Simple auth error: {e}")
+        logger.error(f"❌ Simple auth error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/debug/check-auth")
@@ -673,20 +872,19 @@ async def debug_check_auth(telegram_id: Optional[int] = Query(None)):
     return handle_debug_check_auth(telegram_id)
 
 @app.get("/api/auth/me")
-def get_current_user(
+async def get_current_user(
     telegram_id: int = Query(..., description="Telegram ID пользователя"),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Получить данные текущего пользователя"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    result = await db.execute(queries.USER_BY_TELEGRAM_ID, {"telegram_id": telegram_id})
+    user = result.scalars().first()
     
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    user.last_active = datetime.utcnow()
-    db.commit()
+    # last_active пишется отложенно пакетом, без отдельной транзакции на каждый запрос
+    activity_buffer.touch(user.id)
     
     return {
         "success": True,
@@ -725,8 +923,11 @@ def update_user_profile(
             elif user.role == database.UserRole.BOTH:
                 user.role = database.UserRole.PASSENGER
     
-    user.last_active = datetime.utcnow()
+    record_user_change(db, telegram_id)
     db.commit()
+    invalidate_user(telegram_id)
+    mark_write(telegram_id)
+    activity_buffer.touch(user.id)
     
     return {
         "success": True,
@@ -743,9 +944,9 @@ def update_user_profile(
 
 # =============== ПОЕЗДКИ ===============
 @app.post("/api/trips/search")
-def search_trips(
+async def search_trips(
     search_query: SearchQuery,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """Поиск доступных поездок"""
     try:
@@ -762,143 +963,104 @@ def search_trips(
     else:
         lower_bound = date_obj
 
-    # Базовый запрос
-    query = db.query(database.DriverTrip).filter(
-        database.DriverTrip.status == database.TripStatus.ACTIVE,
-        database.DriverTrip.available_seats >= search_query.passengers,
-        # Фильтр 1: Поездка должна быть не раньше нижнего порога (текущего часа или начала дня)
-        database.DriverTrip.departure_date >= lower_bound,
-        # Фильтр 2: Поездка должна быть в пределах выбранного дня (до полуночи)
-        database.DriverTrip.departure_date < date_obj + timedelta(days=1)
+    # Готовый запрос под набор фильтров: только нужные колонки поездки и водителя одним JOIN.
+    # Поездка должна быть не раньше нижнего порога и в пределах выбранного дня (до полуночи)
+    statement, params = queries.search_trips_params(
+        from_city=search_query.from_city,
+        to_city=search_query.to_city,
+        max_price=search_query.max_price,
+        passengers=search_query.passengers,
+        lower_bound=lower_bound,
+        upper_bound=date_obj + timedelta(days=1)
     )
+    result = await db.execute(statement, params)
     
-    # Добавляем фильтры по городам
-    if search_query.from_city:
-        query = query.filter(or_(
-            database.DriverTrip.start_city.ilike(f"%{search_query.from_city}%"),
-            database.DriverTrip.start_address.ilike(f"%{search_query.from_city}%")
-        ))
-    
-    if search_query.to_city:
-        query = query.filter(or_(
-            database.DriverTrip.finish_city.ilike(f"%{search_query.to_city}%"),
-            database.DriverTrip.finish_address.ilike(f"%{search_query.to_city}%")
-        ))
-    
-    # Фильтр по цене
-    if search_query.max_price:
-        query = query.filter(database.DriverTrip.price_per_seat <= search_query.max_price)
-    
-    # Сортировка: сначала самые ближайшие
-    trips = query.order_by(
-        database.DriverTrip.departure_date.asc(), 
-        database.DriverTrip.price_per_seat.asc()
-    ).all()
-    
-    # Формируем ответ
-    result = []
-    for trip in trips:
-        driver = trip.driver
-        result.append({
-            "id": trip.id,
-            "driver": {
-                "id": driver.id,
-                "name": f"{driver.first_name} {driver.last_name or ''}".strip(),
-                "rating": driver.driver_rating,
-                "avatar_initials": f"{driver.first_name[0]}{driver.last_name[0] if driver.last_name else ''}"
-            },
-            "route": {
-                "from": trip.start_address,
-                "to": trip.finish_address,
-                "from_city": trip.start_city,
-                "to_city": trip.finish_city
-            },
-            "departure": {
-                "date": trip.departure_date.strftime("%Y-%m-%d"),
-                "time": trip.departure_time,
-                "datetime": trip.departure_date.strftime("%d.%m.%Y %H:%M")
-            },
-            "seats": {
-                "available": trip.available_seats,
-                "price_per_seat": trip.price_per_seat
-            },
-            "car_info": {
-                "model": driver.car_model,
-                "color": driver.car_color
-            } if driver.has_car else None,
-            "details": {
-                "comment": trip.comment
-            },
-            "status": trip.status.value,
-            "estimated_arrival": trip.estimated_arrival.isoformat() if hasattr(trip, 'estimated_arrival') and trip.estimated_arrival else None
-        })
+    # Формируем ответ (ответ сериализуется напрямую, минуя jsonable_encoder)
+    result = [encode_trip_search_row(row) for row in result]
     
-    return {
+    return FastJSONResponse({
         "success": True,
         "count": len(result),
         "trips": result
-    }
+    })
 
 @app.get("/api/trips/my")
 def get_my_trips(
     telegram_id: int = Query(..., description="Telegram ID пользователя"),
+    tab: str = Query("all", pattern="^(upcoming|past|all)$", description="upcoming - предстоящие, past - прошедшие"),
+    role: Optional[str] = Query(None, pattern="^(driver|passenger)$", description="Только одна из лент"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    driver_cursor: Optional[str] = Query(None, description="next_cursor ленты as_driver"),
+    passenger_cursor: Optional[str] = Query(None, description="next_cursor ленты as_passenger"),
     db: Session = Depends(database.get_db)
 ):
-    """Получить мои поездки"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
-    driver_trips = db.query(database.DriverTrip).filter(
-        database.DriverTrip.driver_id == user.id
-    ).order_by(desc(database.DriverTrip.departure_date)).all()
-    
-    passenger_bookings = db.query(database.Booking).filter(
-        database.Booking.passenger_id == user.id
-    ).order_by(desc(database.Booking.booked_at)).all()
+    """Получить мои поездки (постранично, keyset-курсоры для каждой ленты)"""
+    user = get_user_record(db, telegram_id)
+    now = datetime.now()
     
     result = {
         "as_driver": [],
         "as_passenger": []
     }
+    pagination = {"tab": tab, "limit": limit}
+    
+    def fetch(statement_factory, cursor):
+        params = {"user_id": user.id, "now": now, "limit": limit + 1}
+        if cursor:
+            try:
+                params["cursor_value"], params["cursor_id"] = decode_cursor(cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        return db.execute(statement_factory(tab, bool(cursor)), params).all()
+    
+    if role != "passenger":
+        trips, next_cursor = page_of(
+            fetch(queries.my_driver_trips_statement, driver_cursor), limit,
+            key=lambda row: (row.departure_date, row.id)
+        )
+        pagination["as_driver"] = {"next_cursor": next_cursor, "has_more": next_cursor is not None}
+        
+        for trip in trips:
+            result["as_driver"].append({
+                "id": trip.id,
+                "route": {
+                    "from": trip.start_address,
+                    "to": trip.finish_address
+                },
+                "date": format_departure(trip.departure_date)[1],
+                "available_seats": trip.available_seats,
+                "price_per_seat": trip.price_per_seat,
+                "status": trip.status.value,
+                "bookings_count": trip.bookings_count
+            })
     
-    for trip in driver_trips:
-        result["as_driver"].append({
-            "id": trip.id,
-            "route": {
-                "from": trip.start_address,
-                "to": trip.finish_address
-            },
-            "date": trip.departure_date.strftime("%d.%m.%Y %H:%M"),
-            "available_seats": trip.available_seats,
-            "price_per_seat": trip.price_per_seat,
-            "status": trip.status.value,
-            "bookings_count": len(trip.bookings)
-        })
-    
-    for booking in passenger_bookings:
-        trip = booking.driver_trip
-        result["as_passenger"].append({
-            "id": booking.id,
-            "trip_id": trip.id,
-            "driver_name": f"{trip.driver.first_name} {trip.driver.last_name or ''}".strip(),
-            "route": {
-                "from": trip.start_address,
-                "to": trip.finish_address
-            },
-            "date": trip.departure_date.strftime("%d.%m.%Y %H:%M"),
-            "seats": booking.booked_seats,
-            "price": booking.price_agreed or trip.price_per_seat,
-            "status": booking.status.value
-        })
+    if role != "driver":
+        bookings, next_cursor = page_of(
+            fetch(queries.my_bookings_statement, passenger_cursor), limit,
+            key=lambda row: (row.booked_at, row.id)
+        )
+        pagination["as_passenger"] = {"next_cursor": next_cursor, "has_more": next_cursor is not None}
+        
+        for booking in bookings:
+            result["as_passenger"].append({
+                "id": booking.id,
+                "trip_id": booking.trip_id,
+                "driver_name": f"{booking.driver_first_name} {booking.driver_last_name or ''}".strip(),
+                "route": {
+                    "from": booking.start_address,
+                    "to": booking.finish_address
+                },
+                "date": format_departure(booking.departure_date)[1],
+                "seats": booking.booked_seats,
+                "price": booking.price_agreed or booking.price_per_seat,
+                "status": booking.status.value
+            })
     
     return {
         "success": True,
         "user_id": user.id,
-        "trips": result
+        "trips": result,
+        "pagination": pagination
     }
 
 @app.post("/api/trips/create")
@@ -923,7 +1085,7 @@ def create_trip(trip_data: TripCreate, db: Session = Depends(database.get_db), u
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"❌ Ошибка даты: {e}")
+        logger.error(f"❌ Ошибка даты: {e}")
         departure_dt = datetime.now()
 
     new_trip_data = {
@@ -961,77 +1123,43 @@ def create_trip(trip_data: TripCreate, db: Session = Depends(database.get_db), u
 @app.get("/api/trips/{trip_id}")
 def get_trip_details(
     trip_id: int,
-    db: Session = Depends(database.get_db)
+    request: Request,
+    db: Session = Depends(get_read_db)
 ):
     """Получить детали поездки"""
-    trip = db.query(database.DriverTrip).filter(
-        database.DriverTrip.id == trip_id
-    ).first()
+    # Условный GET: если поездка не менялась, отвечаем 304 без сборки ответа
+    etag = trip_etag(db, trip_id)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Поездка не найдена")
+    
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    trip = db.execute(queries.TRIP_BY_ID, {"trip_id": trip_id}).scalars().first()
     
     if not trip:
         raise HTTPException(status_code=404, detail="Поездка не найдена")
     
-    driver = trip.driver
-    
-    return {
+    return with_etag(FastJSONResponse({
         "success": True,
-        "trip": {
-            "id": trip.id,
-            "driver": {
-                "id": driver.id,
-                "name": f"{driver.first_name} {driver.last_name or ''}".strip(),
-                "rating": driver.driver_rating,
-                "phone": driver.phone
-            },
-            "route": {
-                "from": trip.start_address,
-                "to": trip.finish_address,
-                "from_city": trip.start_city,
-                "to_city": trip.finish_city
-            },
-            "departure": {
-                "date": trip.departure_date.strftime("%Y-%m-%d"),
-                "time": trip.departure_time,
-                "datetime": trip.departure_date.strftime("%d.%m.%Y %H:%M")
-            },
-            "seats": {
-                "available": trip.available_seats,
-                "price_per_seat": trip.price_per_seat
-            },
-            "details": {
-                "comment": trip.comment
-            },
-            "car_info": {
-                "model": driver.car_model,
-                "color": driver.car_color,
-                "plate": driver.car_plate,
-                "type": driver.car_type.value if driver.car_type else None
-            } if driver.has_car else None,
-            "status": trip.status.value
-        }
-    }
+        "trip": encode_trip_details(trip)
+    }), etag)
 
 # =============== БРОНИРОВАНИЯ ===============
 @app.post("/api/bookings/create")
-def create_booking(
+async def create_booking(
     telegram_id: int = Query(..., description="Telegram ID пользователя"),
     booking_data: BookingCreate = None,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Создать бронирование"""
     # 1. Ищем пользователя
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    user = await get_user_record_async(db, telegram_id)
     
     # 2. Ищем поездку (только активную)
-    trip = db.query(database.DriverTrip).filter(
-        database.DriverTrip.id == booking_data.driver_trip_id,
-        database.DriverTrip.status == database.TripStatus.ACTIVE
-    ).first()
+    result = await db.execute(queries.ACTIVE_TRIP_BY_ID, {"trip_id": booking_data.driver_trip_id})
+    trip = result.scalars().first()
     
     if not trip:
         raise HTTPException(status_code=404, detail="Поездка не найдена или уже завершена")
@@ -1041,13 +1169,12 @@ def create_booking(
         raise HTTPException(status_code=400, detail=f"Недостаточно мест. Доступно: {trip.available_seats}")
     
     # 4. Проверяем, не забронировал ли этот пользователь уже эту поездку
-    existing_booking = db.query(database.Booking).filter(
-        database.Booking.driver_trip_id == booking_data.driver_trip_id,
-        database.Booking.passenger_id == user.id,
-        database.Booking.status == database.TripStatus.ACTIVE
-    ).first()
+    result = await db.execute(queries.ACTIVE_BOOKING_EXISTS, {
+        "trip_id": booking_data.driver_trip_id,
+        "passenger_id": user.id
+    })
     
-    if existing_booking:
+    if result.first():
         raise HTTPException(status_code=400, detail="Вы уже забронировали место в этой поездке")
 
     try:
@@ -1065,15 +1192,45 @@ def create_booking(
         # 6. Уменьшаем количество мест у водителя
         # Мы НЕ меняем статус на COMPLETED, даже если мест 0. 
         # Поездка остается ACTIVE, просто в поиске она не выдастся из-за фильтра мест.
-        trip.available_seats -= booking_data.booked_seats
+        # Условие на available_seats делает списание атомарным при параллельных бронированиях.
+        seats_update = await db.execute(
+            update(database.DriverTrip).where(
+                database.DriverTrip.id == trip.id,
+                database.DriverTrip.available_seats >= booking_data.booked_seats
+            ).values(
+                available_seats=database.DriverTrip.available_seats - booking_data.booked_seats
+            )
+        )
         
-        # 7. Обновляем статистику пассажира
-        user.total_passenger_trips += 1
+        if seats_update.rowcount != 1:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Недостаточно мест: их только что забронировали")
+        
+        # 7. Обновляем статистику пассажира (атомарный инкремент без загрузки пользователя)
+        await db.execute(
+            update(database.User).where(database.User.id == user.id).values(
+                total_passenger_trips=func.coalesce(database.User.total_passenger_trips, 0) + 1
+            ),
+            execution_options={"synchronize_session": False}
+        )
+        
+        # 8. Уведомление водителю - в той же транзакции, отправит диспетчер
+        result = await db.execute(
+            select(database.User.telegram_id).where(database.User.id == trip.driver_id)
+        )
+        db.add(notifications.booking_created(
+            result.scalar_one(), user.first_name, booking_data.booked_seats, trip
+        ))
+        
+        # Счетчик поездок пассажира изменился - сбросить кэш профиля в боте
+        record_user_change(db, telegram_id)
         
         # Фиксируем все изменения одной транзакцией
-        db.commit()
-        db.refresh(booking)
-        db.refresh(trip)
+        await db.commit()
+        invalidate_user(telegram_id)
+        # Пока реплика догоняет, пассажир читает свои данные из основной базы
+        mark_write(telegram_id)
+        await db.refresh(trip)
 
         return {
             "success": True,
@@ -1082,9 +1239,11 @@ def create_booking(
             "remaining_seats": trip.available_seats
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
-        print(f"❌ Ошибка при создании бронирования: {e}")
+        await db.rollback()
+        logger.error(f"❌ Ошибка при создании бронирования: {e}")
         raise HTTPException(status_code=500, detail="Ошибка базы данных при бронировании")
 
 # =============== ОТМЕНА ПОЕЗДКИ ВОДИТЕЛЯ ===============
@@ -1102,12 +1261,7 @@ def cancel_driver_trip(
     if not trip:
         raise HTTPException(status_code=404, detail="Поездка не найдена")
     
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    user = get_user_record(db, telegram_id)
     
     if trip.driver_id != user.id:
         raise HTTPException(status_code=403, detail="Вы не можете отменить чужую поездку")
@@ -1115,6 +1269,16 @@ def cancel_driver_trip(
     if trip.status != database.TripStatus.ACTIVE:
         raise HTTPException(status_code=400, detail="Поездка уже не активна")
     
+    # Кого уведомить: пассажиры активных бронирований (одним запросом)
+    passenger_chat_ids = db.execute(
+        select(database.User.telegram_id).join(
+            database.Booking, database.Booking.passenger_id == database.User.id
+        ).where(
+            database.Booking.driver_trip_id == trip.id,
+            database.Booking.status == database.TripStatus.ACTIVE
+        )
+    ).scalars().all()
+    
     # Отменяем все бронирования этой поездки
     cancelled_bookings = 0
     for booking in trip.bookings:
@@ -1125,7 +1289,9 @@ def cancel_driver_trip(
     
     # Меняем статус поездки
     trip.status = database.TripStatus.CANCELLED
+    db.add_all(notifications.trip_cancelled(passenger_chat_ids, trip))
     db.commit()
+    mark_write(telegram_id)
     
     return {
         "success": True,
@@ -1135,7 +1301,7 @@ def cancel_driver_trip(
 
 # =============== СТАТИСТИКА ===============
 @app.get("/stats")
-def stats(db: Session = Depends(database.get_db)):
+def stats(db: Session = Depends(get_read_db)):
     """Статистика системы"""
     try:
         stats_data = {
@@ -1169,12 +1335,7 @@ def get_user_cars(
     db: Session = Depends(database.get_db)
 ):
     """Получить автомобили пользователя"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    user = get_user_record(db, telegram_id)
     
     cars = db.query(UserCar).filter(
         UserCar.user_id == user.id,
@@ -1245,7 +1406,10 @@ def create_user_car(
         user.car_plate = car_data.license_plate
         user.car_seats = car_data.seats
     
+    record_user_change(db, telegram_id)
     db.commit()
+    invalidate_user(telegram_id)
+    mark_write(telegram_id)
     
     return {
         "success": True,
@@ -1255,33 +1419,34 @@ def create_user_car(
 
 # =============== ПРОФИЛЬ ===============
 @app.get("/api/users/profile-full")
-def get_full_user_profile(
+async def get_full_user_profile(
+    request: Request,
     telegram_id: int = Query(..., description="Telegram ID пользователя"),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """Получить полный профиль пользователя"""
-    user = db.query(database.User).filter(
-        database.User.telegram_id == telegram_id
-    ).first()
+    user = await get_user_record_async(db, telegram_id)
     
-    if not user:
+    # ETag и поля пользователя - из БД одной выборкой: запись в кэше процесса
+    # может отставать от записей бота и других воркеров
+    etag, user = await profile_etag(db, user.id)
+    if user is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    # Только колонки, которые попадают в ответ (см. проекции в queries.py)
+    params = {"user_id": user.id}
     
     # Автомобили
-    cars = db.query(UserCar).filter(
-        UserCar.user_id == user.id,
-        UserCar.is_active == True
-    ).order_by(UserCar.is_default.desc()).all()
+    cars = (await db.execute(queries.PROFILE_CARS, params)).all()
     
-    # Поездки как водитель
-    driver_trips = db.query(database.DriverTrip).filter(
-        database.DriverTrip.driver_id == user.id
-    ).order_by(database.DriverTrip.departure_date.desc()).limit(10).all()
+    # Поездки как водитель (число бронирований считает подзапрос)
+    driver_trips = (await db.execute(queries.PROFILE_DRIVER_TRIPS, params)).all()
     
-    # Бронирования как пассажир
-    passenger_bookings = db.query(database.Booking).filter(
-        database.Booking.passenger_id == user.id
-    ).order_by(database.Booking.booked_at.desc()).limit(10).all()
+    # Бронирования как пассажир (вместе с поездкой и именем водителя)
+    passenger_bookings = (await db.execute(queries.PROFILE_PASSENGER_BOOKINGS, params)).all()
     
     cars_result = []
     for car in cars:
@@ -1301,30 +1466,29 @@ def get_full_user_profile(
             "id": trip.id,
             "from": trip.start_address,
             "to": trip.finish_address,
-            "date": trip.departure_date.strftime("%d.%m.%Y %H:%M"),
+            "date": format_departure(trip.departure_date)[1],
             "seats": trip.available_seats,
             "price": trip.price_per_seat,
             "status": trip.status.value if trip.status else "active",
-            "passengers_count": len(trip.bookings)
+            "passengers_count": trip.passengers_count
         })
     
     passenger_trips_result = []
     for booking in passenger_bookings:
-        trip = booking.driver_trip
-        if trip and trip.driver:
-            passenger_trips_result.append({
-                "id": booking.id,
-                "trip_id": trip.id,
-                "driver_name": f"{trip.driver.first_name} {trip.driver.last_name or ''}".strip(),
-                "from": trip.start_address,
-                "to": trip.finish_address,
-                "date": trip.departure_date.strftime("%d.%m.%Y %H:%M") if trip.departure_date else "",
-                "seats": booking.booked_seats,
-                "price": booking.price_agreed or (trip.price_per_seat if trip else 0),
-                "status": booking.status.value if booking.status else "active"
-            })
+        # JOIN уже отбросил бронирования без поездки или водителя
+        passenger_trips_result.append({
+            "id": booking.id,
+            "trip_id": booking.trip_id,
+            "driver_name": f"{booking.driver_first_name} {booking.driver_last_name or ''}".strip(),
+            "from": booking.start_address,
+            "to": booking.finish_address,
+            "date": format_departure(booking.departure_date)[1] if booking.departure_date else "",
+            "seats": booking.booked_seats,
+            "price": booking.price_agreed or booking.price_per_seat or 0,
+            "status": booking.status.value if booking.status else "active"
+        })
     
-    return {
+    return with_etag(FastJSONResponse({
         "success": True,
         "user": {
             "id": user.id,
@@ -1346,8 +1510,276 @@ def get_full_user_profile(
         "cars": cars_result,
         "driver_trips": driver_trips_result,
         "passenger_trips": passenger_trips_result
+    }), etag)
+
+# =============== СООБЩЕНИЯ ===============
+@app.post("/api/messages/send")
+async def send_message(
+    telegram_id: int = Query(..., description="Telegram ID отправителя"),
+    message_data: MessageCreate = None,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Отправить сообщение пользователю (в рамках бронирования, если указан booking_id)"""
+    user = await get_user_record_async(db, telegram_id)
+    
+    if message_data.receiver_id == user.id:
+        raise HTTPException(status_code=400, detail="Нельзя отправить сообщение самому себе")
+    
+    if message_data.booking_id is not None:
+        result = await db.execute(queries.BOOKING_PARTICIPANTS, {"booking_id": message_data.booking_id})
+        participants = result.first()
+        if participants is None:
+            raise HTTPException(status_code=404, detail="Бронирование не найдено")
+        if {user.id, message_data.receiver_id} != set(participants):
+            raise HTTPException(status_code=403, detail="Переписка доступна только участникам бронирования")
+        await db.execute(queries.BOOKING_UNREAD_ADD, {
+            "booking_id": message_data.booking_id, "user_id": message_data.receiver_id, "delta": 1
+        })
+    else:
+        result = await db.execute(queries.USER_EXISTS, {"user_id": message_data.receiver_id})
+        if result.first() is None:
+            raise HTTPException(status_code=404, detail="Получатель не найден")
+    
+    message = database.Message(
+        booking_id=message_data.booking_id,
+        sender_id=user.id,
+        receiver_id=message_data.receiver_id,
+        content=message_data.content,
+        is_read=False,
+        sent_at=datetime.utcnow()
+    )
+    db.add(message)
+    # Счетчик получателя меняется в той же транзакции, что и сообщение
+    await db.execute(queries.USER_UNREAD_ADD, {"user_id": message_data.receiver_id, "delta": 1})
+    await db.commit()
+    mark_write(telegram_id)
+    
+    # Только после commit: проснувшийся получатель не должен увидеть неподтвержденное сообщение
+    payload = encode_message(message)
+    message_hub.publish(message.receiver_id, payload)
+    
+    return {"success": True, "message": payload}
+
+@app.get("/api/messages/conversation")
+async def get_conversation(
+    telegram_id: int = Query(..., description="Telegram ID пользователя"),
+    peer_id: int = Query(..., description="ID собеседника"),
+    booking_id: Optional[int] = Query(None, description="Только сообщения по бронированию"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Переписка с пользователем, новые сообщения первыми (keyset-пагинация)"""
+    user = await get_user_record_async(db, telegram_id)
+    
+    params = {"user_id": user.id, "peer_id": peer_id, "limit": limit + 1}
+    if booking_id is not None:
+        params["booking_id"] = booking_id
+    if cursor:
+        try:
+            params["cursor_value"], params["cursor_id"] = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    result = await db.execute(
+        queries.conversation_statement(booking_id is not None, bool(cursor)), params
+    )
+    messages, next_cursor = page_of(result.all(), limit, key=lambda row: (row.sent_at, row.id))
+    
+    return FastJSONResponse({
+        "success": True,
+        "messages": [encode_message(row) for row in messages],
+        "pagination": {"limit": limit, "next_cursor": next_cursor, "has_more": next_cursor is not None}
+    })
+
+async def fetch_unread_after(user_id: int, after_id: int, limit: int) -> list:
+    """Непрочитанные входящие новее after_id (короткая сессия, без удержания соединения)"""
+    async with database.AsyncSessionLocal() as db:
+        result = await db.execute(queries.UNREAD_AFTER, {"user_id": user_id, "after_id": after_id, "limit": limit})
+        return [encode_message(row) for row in result.all()]
+
+@app.get("/api/messages/wait")
+async def wait_messages(
+    telegram_id: int = Query(..., description="Telegram ID пользователя"),
+    after_id: int = Query(0, ge=0, description="id последнего полученного сообщения"),
+    timeout: float = Query(MESSAGES_WAIT_TIMEOUT, ge=0, le=MESSAGES_WAIT_MAX_TIMEOUT),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    """
+    Long-poll: новые непрочитанные входящие сообщения. Если их нет, запрос ждет
+    до timeout секунд без обращений к БД и возвращается, как только придет сообщение.
+    """
+    async with database.AsyncSessionLocal() as db:
+        user = await get_user_record_async(db, telegram_id)
+    
+    try:
+        with message_hub.subscribe(user.id) as inbox:
+            # Подписка раньше проверки БД: сообщение, отправленное между ними, не потеряется
+            messages = await fetch_unread_after(user.id, after_id, limit)
+            if not messages and timeout > 0:
+                try:
+                    messages.append(await asyncio.wait_for(inbox.get(), timeout))
+                    # Сообщения, пришедшие почти одновременно, отдаем одним ответом
+                    while not inbox.empty() and len(messages) < limit:
+                        messages.append(inbox.get_nowait())
+                except asyncio.TimeoutError:
+                    # Сообщение могло уйти через другой воркер API - одна проверка БД за ожидание
+                    messages = await fetch_unread_after(user.id, after_id, limit)
+    except HubFull:
+        raise HTTPException(status_code=503, detail="Слишком много ожидающих запросов", headers={"Retry-After": "5"})
+    
+    messages = [message for message in messages if message["id"] > after_id]
+    return FastJSONResponse({
+        "success": True,
+        "messages": messages,
+        "last_id": max((message["id"] for message in messages), default=after_id)
+    })
+
+@app.post("/api/messages/read")
+async def mark_messages_read(
+    telegram_id: int = Query(..., description="Telegram ID пользователя"),
+    read_data: MessagesRead = None,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Отметить прочитанными входящие от собеседника до up_to_id включительно"""
+    user = await get_user_record_async(db, telegram_id)
+    
+    result = await db.execute(queries.MARK_READ, {
+        "user_id": user.id,
+        "peer_id": read_data.peer_id,
+        "up_to_id": read_data.up_to_id
+    })
+    booking_ids = result.scalars().all()
+    
+    # Счетчики уменьшаются ровно на число прочитанных сейчас сообщений, в той же транзакции
+    if booking_ids:
+        await db.execute(queries.USER_UNREAD_ADD, {"user_id": user.id, "delta": -len(booking_ids)})
+        for booking_id, count in Counter(booking_ids).items():
+            if booking_id is not None:
+                await db.execute(queries.BOOKING_UNREAD_ADD, {
+                    "booking_id": booking_id, "user_id": user.id, "delta": -count
+                })
+    await db.commit()
+    mark_write(telegram_id)
+    
+    return {"success": True, "updated": len(booking_ids)}
+
+@app.get("/api/messages/unread")
+async def get_unread_count(
+    telegram_id: int = Query(..., description="Telegram ID пользователя"),
+    booking_id: Optional[int] = Query(None, description="Также счетчик по бронированию"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Число непрочитанных сообщений для бейджей (денормализованные счетчики, без COUNT)"""
+    user = await get_user_record_async(db, telegram_id)
+    
+    result = await db.execute(queries.USER_UNREAD, {"user_id": user.id})
+    response = {"success": True, "unread": max(result.scalar() or 0, 0)}
+    
+    if booking_id is not None:
+        result = await db.execute(queries.BOOKING_UNREAD, {"booking_id": booking_id})
+        booking = result.first()
+        if booking is None:
+            raise HTTPException(status_code=404, detail="Бронирование не найдено")
+        if user.id == booking.passenger_id:
+            unread = booking.passenger_unread
+        elif user.id == booking.driver_id:
+            unread = booking.driver_unread
+        else:
+            raise HTTPException(status_code=403, detail="Бронирование недоступно")
+        response["booking"] = {"id": booking_id, "unread": max(unread, 0)}
+    
+    return response
+
+# =============== ОТЗЫВЫ И РЕЙТИНГИ ===============
+@app.post("/api/reviews/create")
+async def create_review(
+    telegram_id: int = Query(..., description="Telegram ID автора отзыва"),
+    review_data: ReviewCreate = None,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Отзыв о попутчике по завершенной поездке; рейтинг обновляется той же транзакцией"""
+    user = await get_user_record_async(db, telegram_id)
+    
+    result = await db.execute(queries.REVIEW_BOOKING, {"booking_id": review_data.booking_id})
+    booking = result.first()
+    if booking is None:
+        raise HTTPException(status_code=404, detail="Бронирование не найдено")
+    if user.id not in (booking.passenger_id, booking.driver_id):
+        raise HTTPException(status_code=403, detail="Отзыв могут оставить только участники поездки")
+    if booking.status == database.TripStatus.CANCELLED or booking.trip_status != database.TripStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Отзыв можно оставить только после завершения поездки")
+    
+    # Пассажир оценивает водителя, водитель - пассажира
+    about_driver = user.id == booking.passenger_id
+    reviewed_id = booking.driver_id if about_driver else booking.passenger_id
+    
+    review = database.Review(
+        booking_id=review_data.booking_id,
+        reviewer_user_id=user.id,
+        reviewed_user_id=reviewed_id,
+        rating=review_data.rating,
+        punctuality=review_data.punctuality,
+        comfort=review_data.comfort,
+        communication=review_data.communication,
+        comment=review_data.comment,
+        is_anonymous=review_data.is_anonymous
+    )
+    db.add(review)
+    try:
+        # Один отзыв от участника на бронирование (booking_id, reviewer_user_id) - до обновления рейтинга
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Вы уже оставили отзыв по этому бронированию")
+    
+    # Суммы и средний рейтинг - одним UPDATE в той же транзакции, что и отзыв
+    result = await db.execute(queries.apply_review_statement(about_driver), {
+        "user_id": reviewed_id,
+        "rating": review_data.rating,
+        "punctuality": review_data.punctuality,
+        "comfort": review_data.comfort,
+        "communication": review_data.communication
+    })
+    reviewed_telegram_id, rating = result.one()
+    
+    # Рейтинг в профиле изменился - сбросить кэш профиля в боте
+    record_user_change(db, reviewed_telegram_id)
+    await db.commit()
+    invalidate_user(reviewed_telegram_id)
+    mark_write(telegram_id)
+    
+    return {
+        "success": True,
+        "review_id": review.id,
+        "reviewed_user_id": reviewed_id,
+        "rating": round(rating, 2)
     }
 
+@app.get("/api/users/{user_id}/ratings")
+async def get_user_ratings(
+    user_id: int = Path(..., description="ID пользователя"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Рейтинги водителя и пассажира и средние подоценки (хранимые суммы, без пересчета отзывов)"""
+    result = await db.execute(queries.USER_RATINGS, {"user_id": user_id})
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return FastJSONResponse({"success": True, "user_id": user_id, "ratings": rating_summary(row)})
+
+# =============== ДОСТУП АДМИНИСТРАТОРА ===============
+# Выгрузка и отладочная статистика (пулы, SQL, медленные запросы, уведомления)
+# требуют заголовок X-Export-Token; без EXPORT_TOKEN эти эндпоинты выключены
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
+
+def require_admin_token(x_export_token: Optional[str] = Header(None)):
+    """Доступ только с токеном: в ответах телефоны, номера автомобилей и параметры запросов"""
+    if not EXPORT_TOKEN:
+        raise HTTPException(status_code=503, detail="Эндпоинт отключен: не задан EXPORT_TOKEN")
+    if not hmac.compare_digest(x_export_token or "", EXPORT_TOKEN):
+        raise HTTPException(status_code=403, detail="Неверный токен")
+
 # =============== HEALTH CHECK ===============
 @app.get("/health")
 def health_check(db: Session = Depends(database.get_db)):
@@ -1367,28 +1799,103 @@ def health_check(db: Session = Depends(database.get_db)):
         "version": "3.0"
     }
 
-@app.get("/api/debug/users")
-def debug_users(db: Session = Depends(database.get_db)):
-    """Показать всех пользователей (для отладки)"""
-    users = db.query(database.User).all()
-    
-    result = []
-    for user in users:
-        result.append({
-            "id": user.id,
-            "telegram_id": user.telegram_id,
-            "first_name": user.first_name,
-            "username": user.username,
-            "has_car": user.has_car,
-            "registration_date": user.registration_date.isoformat() if user.registration_date else None
-        })
-    
+@app.get("/api/debug/pool", dependencies=[Depends(require_admin_token)])
+def debug_pool():
+    """Состояние пулов соединений: занято, overflow, гистограмма ожидания"""
     return {
         "success": True,
-        "count": len(result),
-        "users": result
+        "timestamp": datetime.utcnow().isoformat(),
+        "pools": pool_stats(),
+        "replica": router_status()
+    }
+
+@app.get("/api/debug/sql-metrics", dependencies=[Depends(require_admin_token)])
+def debug_sql_metrics():
+    """SQL по эндпоинтам: число запросов, время в БД, самый медленный запрос, N+1"""
+    return {
+        "success": True,
+        "timestamp": datetime.utcnow().isoformat(),
+        "sql_debug": sql_metrics.SQL_DEBUG,
+        "n_plus_one_threshold": sql_metrics.SQL_N_PLUS_ONE_THRESHOLD,
+        "endpoints": sql_metrics.endpoint_metrics()
+    }
+
+@app.post("/api/debug/sql-metrics/reset", dependencies=[Depends(require_admin_token)])
+def reset_sql_metrics():
+    """Сбросить накопленные SQL-метрики эндпоинтов"""
+    sql_metrics.reset_metrics()
+    return {"success": True}
+
+@app.get("/api/debug/notifications", dependencies=[Depends(require_admin_token)])
+def debug_notifications():
+    """Состояние диспетчера уведомлений и очереди outbox"""
+    return {
+        "success": True,
+        "timestamp": datetime.utcnow().isoformat(),
+        "dispatcher": notification_dispatcher.status(),
+        "broadcaster": broadcaster.status(),
+        "outbox": notifications.outbox_counts()
     }
 
+@app.get("/api/debug/slow-queries", dependencies=[Depends(require_admin_token)])
+def debug_slow_queries(
+    limit: int = Query(20, ge=1, le=500),
+    table: Optional[str] = Query(None, description="Только запросы к таблице, например driver_trips"),
+    order_by: str = Query("p95_ms", pattern="^(p50_ms|p95_ms|p99_ms|max_ms|avg_ms|count|slow_count)$")
+):
+    """Отпечатки запросов с p50/p95/p99 и последние медленные запросы"""
+    return {
+        "success": True,
+        "timestamp": datetime.utcnow().isoformat(),
+        **slow_query_log.report(limit=limit, table=table, order_by=order_by)
+    }
+
+@app.post("/api/debug/slow-queries/reset", dependencies=[Depends(require_admin_token)])
+def reset_slow_queries():
+    """Сбросить накопленную статистику запросов"""
+    slow_query_log.reset()
+    return {"success": True}
+
+@app.get("/api/debug/users")
+def debug_users():
+    """Показать всех пользователей (для отладки) - ответ собирается потоком, без загрузки всей таблицы"""
+    sql_metrics.mark_streaming()
+    columns = (
+        database.User.id,
+        database.User.telegram_id,
+        database.User.first_name,
+        database.User.username,
+        database.User.has_car,
+        database.User.registration_date
+    )
+    return StreamingResponse(
+        exports.iter_json_document("users", "users", columns=columns),
+        media_type="application/json"
+    )
+
+# =============== ВЫГРУЗКА ДАННЫХ ===============
+@app.get("/api/admin/export/{entity}", dependencies=[Depends(require_admin_token)])
+def admin_export(
+    entity: str = Path(..., pattern="^(users|trips|bookings)$"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    date_from: Optional[str] = Query(None, description="С даты включительно: YYYY-MM-DD или YYYY-MM-DDTHH:MM (регистрация / отправление / бронирование)"),
+    date_to: Optional[str] = Query(None, description="До даты, не включая")
+):
+    """Потоковая выгрузка пользователей, поездок или бронирований в NDJSON / CSV"""
+    try:
+        date_from = datetime.fromisoformat(date_from) if date_from else None
+        date_to = datetime.fromisoformat(date_to) if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты. Используйте YYYY-MM-DD или YYYY-MM-DDTHH:MM")
+    
+    filename = f"{entity}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{format}"
+    sql_metrics.mark_streaming()
+    return StreamingResponse(
+        exports.FORMATS[format](entity, date_from=date_from, date_to=date_to),
+        media_type=exports.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.post("/api/trips/update-statuses")
 def manual_update_statuses(db: Session = Depends(database.get_db)):
     """Ручное обновление статусов поездок (для отладки)"""
@@ -0,0 +1,82 @@
+# message_hub.py - ОЖИДАНИЕ НОВЫХ СООБЩЕНИЙ БЕЗ ОПРОСА БД
+#
+# /api/messages/wait подписывается на сообщения пользователя и "паркуется" в
+# asyncio.Queue до прихода сообщения или таймаута; соединение с БД на время
+# ожидания не держится. /api/messages/send после commit публикует сообщение
+# получателю - ждущие запросы просыпаются сразу. Хаб живет в памяти процесса:
+# если сообщение отправлено через другой воркер API, ожидающий получит его
+# проверкой БД по таймауту, то есть с задержкой не больше таймаута ожидания.
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Set, Tuple
+
+# Сколько секунд ждет /api/messages/wait (меньше таймаутов прокси перед API)
+MESSAGES_WAIT_TIMEOUT = float(os.getenv("MESSAGES_WAIT_TIMEOUT", "25"))
+MESSAGES_WAIT_MAX_TIMEOUT = float(os.getenv("MESSAGES_WAIT_MAX_TIMEOUT", "55"))
+# Ограничения на число припаркованных запросов (каждый - открытое HTTP-соединение)
+MESSAGES_MAX_WAITERS = int(os.getenv("MESSAGES_MAX_WAITERS", "10000"))
+MESSAGES_MAX_WAITERS_PER_USER = int(os.getenv("MESSAGES_MAX_WAITERS_PER_USER", "5"))
+
+
+class HubFull(Exception):
+    """Превышен лимит ожидающих запросов"""
+
+
+class MessageHub:
+    """Pub/sub в пределах процесса: user_id -> очереди ожидающих запросов"""
+
+    def __init__(self, max_waiters: int = MESSAGES_MAX_WAITERS,
+                 max_waiters_per_user: int = MESSAGES_MAX_WAITERS_PER_USER):
+        self.max_waiters = max_waiters
+        self.max_waiters_per_user = max_waiters_per_user
+        self._waiters: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    @contextmanager
+    def subscribe(self, user_id: int):
+        """Очередь, в которую попадут сообщения пользователя, пока открыт контекст"""
+        waiter = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            waiters = self._waiters[user_id]
+            if self._count >= self.max_waiters or len(waiters) >= self.max_waiters_per_user:
+                if not waiters:
+                    del self._waiters[user_id]
+                raise HubFull()
+            waiters.add(waiter)
+            self._count += 1
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters.discard(waiter)
+                self._count -= 1
+                if not waiters:
+                    self._waiters.pop(user_id, None)
+
+    def publish(self, user_id: int, payload: dict) -> int:
+        """Разбудить ожидающие запросы пользователя (можно вызывать из любого потока)"""
+        with self._lock:
+            waiters = list(self._waiters.get(user_id, ()))
+            self.published += 1
+            self.delivered += len(waiters)
+        for loop, queue in waiters:
+            loop.call_soon_threadsafe(queue.put_nowait, payload)
+        return len(waiters)
+
+    def stats(self) -> dict:
+        return {
+            "waiters": self._count,
+            "users": len(self._waiters),
+            "published": self.published,
+            "delivered": self.delivered,
+            "max_waiters": self.max_waiters
+        }
+
+
+message_hub = MessageHub()
@@ -4,10 +4,11 @@ import os
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
+from telegram.error import BadRequest
 from datetime import datetime
 import sys
 import traceback
-from sqlalchemy import text
+from sqlalchemy import text, select
 import time
 from typing import Optional
 import json
@@ -158,12 +159,55 @@ else:
         database = DatabaseStub()
         logging.info("✅ Используется заглушка для базы данных из-за ошибки импорта")
 
+# Буфер отложенной записи last_active (нужна настоящая БД)
+try:
+    from activity_buffer import activity_buffer
+except Exception as e:
+    logging.warning(f"⚠️  Буфер активности недоступен: {e}")
+    activity_buffer = None
+
+# Запросы бота к БД выполняются в пуле потоков (нужна настоящая БД)
+try:
+    import bot_db
+    from bot_db import run_db
+except Exception as e:
+    logging.warning(f"⚠️  Пул запросов к БД недоступен: {e}")
+    bot_db = None
+    run_db = None
+
+# Лента изменений пользователей для кэша бота (нужна настоящая БД)
+try:
+    import change_feed
+except Exception as e:
+    logging.warning(f"⚠️  Лента изменений пользователей недоступна: {e}")
+    change_feed = None
+
+from user_cache import invalidate_user
+from logging_config import setup_logging
+
 load_dotenv()
 
 # =============== НАСТРОЙКИ ===============
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 MINI_APP_URL = os.getenv("MINI_APP_URL", "https://zhyvvu.github.io/travel-companion-app/")
 DATABASE_URL = os.getenv("DATABASE_URL", "")
+# Адрес Bot API (для локального сервера Bot API или тестовой заглушки Telegram)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+# Поездок на одной странице /my_trips
+MY_TRIPS_PAGE_SIZE = int(os.getenv("BOT_MY_TRIPS_PAGE_SIZE", "5"))
+# Сколько обновлений обрабатывать одновременно (1 - строго по очереди).
+# Запросы к БД все равно ограничены пулом bot_db (BOT_DB_WORKERS)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+
+# Режим получения обновлений: BOT_MODE=polling | webhook (см. bot_webhook.py)
+import bot_webhook
+
+# Рассылки администратора (ADMIN_TELEGRAM_IDS читается после load_dotenv)
+try:
+    import broadcasts
+except Exception as e:
+    logging.warning(f"⚠️  Рассылки недоступны: {e}")
+    broadcasts = None
 
 # Проверка обязательных переменных
 if not BOT_TOKEN:
@@ -176,14 +220,9 @@ if not DATABASE_URL:
     logging.warning("⚠️  DATABASE_URL не установлен. Бот будет работать в упрощенном режиме")
 
 # =============== ЛОГИРОВАНИЕ ===============
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log', encoding='utf-8')
-    ]
-)
+# Запись в bot.log через очередь и отдельный поток, с ротацией (см. logging_config.py).
+# Если модуль импортирован из API, логирование уже настроено и вызов ничего не меняет
+setup_logging("bot", log_file="bot.log")
 logger = logging.getLogger(__name__)
 
 # =============== УТИЛИТЫ ===============
@@ -227,9 +266,9 @@ def create_user_response(user):
 # =============== WEB HANDLERS ДЛЯ FASTAPI (добавим в main.py) ===============
 # Эти функции будут вызываться из main.py
 
-def handle_telegram_auth(user_data: dict):
+async def handle_telegram_auth(user_data: dict, db=None):
     """
-    Обработка авторизации через Telegram WebApp
+    Обработка авторизации через Telegram WebApp (асинхронная сессия БД)
     """
     try:
         logger.info(f"📱 Запрос авторизации: {user_data}")
@@ -248,8 +287,12 @@ def handle_telegram_auth(user_data: dict):
             logger.error("❌ Telegram ID is required")
             return {"success": False, "error": "Telegram ID is required"}
         
-        # Получаем сессию базы данных
-        db = get_db_session()
+        # Получаем сессию базы данных (если ее не передали из FastAPI)
+        own_session = db is None
+        if own_session:
+            session_factory = getattr(database, 'AsyncSessionLocal', None)
+            db = session_factory() if session_factory else None
+        
         if not db:
             logger.error("❌ Database connection failed")
             # Возвращаем тестового пользователя
@@ -271,9 +314,10 @@ def handle_telegram_auth(user_data: dict):
         
         try:
             # Ищем существующего пользователя
-            user = db.query(database.User).filter(
-                database.User.telegram_id == telegram_id
-            ).first()
+            result = await db.execute(
+                select(database.User).where(database.User.telegram_id == telegram_id)
+            )
+            user = result.scalars().first()
             
             if not user:
                 # Создаем нового пользователя
@@ -303,8 +347,8 @@ def handle_telegram_auth(user_data: dict):
                 # Создаем пользователя
                 user = database.User(**user_data_dict)
                 db.add(user)
-                db.commit()
-                db.refresh(user)
+                await db.commit()
+                await db.refresh(user)
                 logger.info(f"✅ Пользователь создан: {user.id}")
                 
             else:
@@ -314,12 +358,18 @@ def handle_telegram_auth(user_data: dict):
                 user.last_name = telegram_user.get("last_name", user.last_name)
                 user.username = telegram_user.get("username", user.username)
                 user.language_code = telegram_user.get("language_code", user.language_code)
-                user.last_active = datetime.utcnow()
                 
                 if hasattr(user, 'is_premium'):
                     user.is_premium = telegram_user.get("is_premium", getattr(user, 'is_premium', False))
                 
-                db.commit()
+                # UPDATE уйдет только если профиль реально изменился,
+                # last_active записывается отложенно пакетом
+                if change_feed and db.is_modified(user):
+                    change_feed.record_user_change(db, telegram_id)
+                await db.commit()
+                invalidate_user(telegram_id)
+                if activity_buffer:
+                    activity_buffer.touch(user.id)
                 logger.info(f"✅ Пользователь обновлен: {user.id}")
             
             # Создаем ответ
@@ -330,10 +380,12 @@ def handle_telegram_auth(user_data: dict):
             
         except Exception as db_error:
             logger.error(f"❌ Ошибка работы с БД: {db_error}")
+            await db.rollback()
             return {"success": False, "error": f"Database error: {str(db_error)}"}
             
         finally:
-            db.close()
+            if own_session:
+                await db.close()
             
     except Exception as e:
         logger.error(f"❌ Ошибка авторизации: {e}")
@@ -484,7 +536,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Пользователь {user.id} ({user.username}) запустил бота")
         
         welcome_msg = ""
-        db = None
         
         # Проверяем доступность базы данных из контекста бота
         db_available = False
@@ -496,39 +547,26 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if db_available:
             try:
-                db = get_db_session()
-                if db is None:
-                    raise Exception("Сессия БД не создана")
-                
-                # Проверяем, есть ли пользователь в базе
-                existing_user = db.query(database.User).filter(
-                    database.User.telegram_id == user.id
-                ).first()
-                
-                if not existing_user:
-                    # Создаем нового пользователя
-                    new_user = database.User(
-                        telegram_id=user.id,
-                        username=user.username,
-                        first_name=user.first_name or "",
-                        last_name=user.last_name or "",
-                        language_code=user.language_code or "ru",
-                        is_bot=user.is_bot or False,
-                        registration_date=datetime.utcnow(),
-                        last_active=datetime.utcnow(),
-                        role=getattr(database, 'UserRole', type('obj', (), {'PASSENGER': 'passenger'})()).PASSENGER
+                # Профиль из кэша совпадает с данными Telegram - писать в БД нечего
+                cached = bot_db.cached_profile(user.id)
+                if cached is not None and bot_db.profile_is_current(
+                    cached, user.username, user.first_name, user.last_name
+                ):
+                    user_id, created = cached.id, False
+                else:
+                    # Запрос выполняется в пуле потоков, event loop не блокируется
+                    user_id, created = await run_db(
+                        bot_db.register_user,
+                        user.id, user.username, user.first_name, user.last_name,
+                        user.language_code, user.is_bot
                     )
-                    db.add(new_user)
-                    db.commit()
+                if created:
                     welcome_msg = "🎉 Добро пожаловать! Вы зарегистрированы в системе!"
                     logger.info(f"Создан новый пользователь: {user.id}")
                 else:
-                    # Обновляем время последней активности
-                    existing_user.last_active = datetime.utcnow()
-                    existing_user.first_name = user.first_name or existing_user.first_name
-                    existing_user.last_name = user.last_name or existing_user.last_name
-                    existing_user.username = user.username or existing_user.username
-                    db.commit()
+                    # Время последней активности пишется отложенно пакетом
+                    if activity_buffer:
+                        activity_buffer.touch(user_id)
                     welcome_msg = "👋 С возвращением!"
                     logger.info(f"Пользователь обновлен: {user.id}")
                     
@@ -536,12 +574,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Ошибка работы с БД в start: {db_error}")
                 welcome_msg = "👋 Добро пожаловать! (ограниченный режим - БД недоступна)"
                 db_available = False
-            finally:
-                if db:
-                    try:
-                        db.close()
-                    except:
-                        pass
         else:
             welcome_msg = "👋 Добро пожаловать! (режим без базы данных)"
             logger.info(f"Пользователь {user.id} - режим без БД")
@@ -756,26 +788,8 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    db = get_db_session()
-    
     try:
-        stats = {
-            "users": db.query(database.User).count(),
-            "drivers": db.query(database.User).filter(database.User.has_car == True).count(),
-            "passengers": db.query(database.User).filter(database.User.has_car == False).count(),
-            "trips": db.query(database.DriverTrip).count(),
-            "active_trips": db.query(database.DriverTrip).filter(
-                database.DriverTrip.status == database.TripStatus.ACTIVE
-            ).count(),
-            "bookings": db.query(database.Booking).count(),
-            "active_bookings": db.query(database.Booking).filter(
-                database.Booking.status == database.TripStatus.ACTIVE
-            ).count()
-        }
-        
-        recent_users = db.query(database.User).order_by(
-            database.User.registration_date.desc()
-        ).limit(5).all()
+        stats, recent_users = await run_db(bot_db.fetch_stats)
         
         recent_users_text = ""
         for u in recent_users:
@@ -809,9 +823,6 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error in stats command: {e}")
         await update.message.reply_text("😕 Произошла ошибка при получении статистики.")
-    finally:
-        if db:
-            db.close()
 
 async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /profile - профиль пользователя"""
@@ -843,12 +854,8 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    db = get_db_session()
-    
     try:
-        db_user = db.query(database.User).filter(
-            database.User.telegram_id == user.id
-        ).first()
+        db_user = bot_db.cached_profile(user.id) or await run_db(bot_db.fetch_profile, user.id)
         
         if not db_user:
             await update.message.reply_text(
@@ -910,9 +917,6 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error in profile command: {e}")
         await update.message.reply_text("😕 Произошла ошибка при получении профиля.")
-    finally:
-        if db:
-            db.close()
 
 async def my_trips_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /my_trips - мои поездки"""
@@ -944,29 +948,22 @@ async def my_trips_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    db = get_db_session()
-    
     try:
-        db_user = db.query(database.User).filter(
-            database.User.telegram_id == user.id
-        ).first()
-        
-        if not db_user:
+        # Первая страница: поездки водителя, если их нет - бронирования пассажира
+        state = {"role": "driver", "cursors": [None], "next": None, "user_id": None}
+        page = await load_my_trips_page(user.id, state)
+        if page is None:
             await update.message.reply_text(
                 "❌ Вы не зарегистрированы в системе.\n"
                 "Используйте /start для регистрации."
             )
             return
         
-        driver_trips = db.query(database.DriverTrip).filter(
-            database.DriverTrip.driver_id == db_user.id
-        ).order_by(database.DriverTrip.departure_date.desc()).limit(5).all()
-        
-        passenger_bookings = db.query(database.Booking).filter(
-            database.Booking.passenger_id == db_user.id
-        ).order_by(database.Booking.booked_at.desc()).limit(5).all()
+        if not page:
+            state.update(role="passenger", cursors=[None])
+            page = await load_my_trips_page(user.id, state)
         
-        if not driver_trips and not passenger_bookings:
+        if not page:
             keyboard = [[
                 InlineKeyboardButton(
                     "🚗 Создать первую поездку",
@@ -982,55 +979,113 @@ async def my_trips_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        trips_text = "📍 *Ваши поездки*\n\n"
+        context.user_data["my_trips"] = state
+        text, reply_markup = render_my_trips_page(state, page)
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
         
-        if driver_trips:
-            trips_text += "🚗 *Как водитель:*\n"
-            for trip in driver_trips:
-                trips_text += f"""
+    except Exception as e:
+        logger.error(f"Error in my_trips command: {e}")
+        await update.message.reply_text("😕 Произошла ошибка при получении поездок.")
+
+async def load_my_trips_page(telegram_id: int, state: dict) -> Optional[list]:
+    """Загрузить страницу state['cursors'][-1] раздела state['role']; None - пользователь не найден"""
+    page = await run_db(
+        bot_db.fetch_my_trips_page,
+        telegram_id, state["role"], state["cursors"][-1], MY_TRIPS_PAGE_SIZE, state["user_id"]
+    )
+    if page is None:
+        return None
+    state["user_id"], rows, state["next"] = page
+    return rows
+
+def render_my_trips_page(state: dict, rows: list):
+    """Текст страницы /my_trips и клавиатура навигации"""
+    role = state["role"]
+    page_number = len(state["cursors"])
+    
+    if role == "driver":
+        trips_text = f"📍 *Ваши поездки*\n\n🚗 *Как водитель* (стр. {page_number}):\n"
+        for trip in rows:
+            trips_text += f"""
 • *Маршрут:* {trip.start_address[:20]}... → {trip.finish_address[:20]}...
 • *Дата:* {trip.departure_date.strftime('%d.%m.%Y %H:%M')}
 • *Мест:* {trip.available_seats} | *Цена:* {trip.price_per_seat}₽
 • *Статус:* {trip.status.value}
-• *Пассажиров:* {len(trip.bookings)}
+• *Пассажиров:* {trip.bookings_count}
 """
-        
-        if passenger_bookings:
-            trips_text += "\n👤 *Как пассажир:*\n"
-            for booking in passenger_bookings:
-                trip = booking.driver_trip
-                if trip:
-                    trips_text += f"""
-• *Маршрут:* {trip.start_address[:20]}... → {trip.finish_address[:20]}...
-• *Водитель:* {trip.driver.first_name}
-• *Дата:* {trip.departure_date.strftime('%d.%m.%Y %H:%M')}
-• *Мест:* {booking.booked_seats} | *Цена:* {booking.price_agreed or trip.price_per_seat}₽
+    else:
+        trips_text = f"📍 *Ваши поездки*\n\n👤 *Как пассажир* (стр. {page_number}):\n"
+        for booking in rows:
+            trips_text += f"""
+• *Маршрут:* {booking.start_address[:20]}... → {booking.finish_address[:20]}...
+• *Водитель:* {booking.driver_first_name}
+• *Дата:* {booking.departure_date.strftime('%d.%m.%Y %H:%M')}
+• *Мест:* {booking.booked_seats} | *Цена:* {booking.price_agreed or booking.price_per_seat}₽
 • *Статус:* {booking.status.value}
 """
+    if not rows:
+        trips_text += "\n• Пока пусто\n"
+    
+    trips_text += "\n🌐 *Для управления поездками откройте приложение:*"
+    
+    # В callback_data раздел: после перезапуска бота (user_data пуст) кнопка откроет его первую страницу
+    navigation = []
+    if page_number > 1:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"my_trips:{role}:prev"))
+    if state["next"]:
+        navigation.append(InlineKeyboardButton("Вперед ▶️", callback_data=f"my_trips:{role}:next"))
+    
+    other_role = "passenger" if role == "driver" else "driver"
+    keyboard = [
+        navigation,
+        [InlineKeyboardButton(
+            "👤 Как пассажир" if other_role == "passenger" else "🚗 Как водитель",
+            callback_data=f"my_trips:{other_role}:first"
+        )],
+        [InlineKeyboardButton(
+            "🚗 Управлять поездками",
+            web_app=WebAppInfo(url=MINI_APP_URL)
+        )]
+    ]
+    return trips_text, InlineKeyboardMarkup([row for row in keyboard if row])
+
+async def my_trips_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки навигации /my_trips: my_trips:<driver|passenger>:<first|next|prev>"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not (context.bot_data or {}).get('db_available'):
+        return
+    
+    try:
+        _, role, action = query.data.split(":")
+        if role not in bot_db.MY_TRIPS_SECTIONS:
+            return
         
-        trips_text += "\n🌐 *Для управления поездками откройте приложение:*"
-        
-        keyboard = [[
-            InlineKeyboardButton(
-                "🚗 Управлять поездками",
-                web_app=WebAppInfo(url=MINI_APP_URL)
-            )
-        ]]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        state = context.user_data.get("my_trips")
+        if action == "first" or not state or state["role"] != role:
+            user_id = state["user_id"] if state else None
+            state = {"role": role, "cursors": [None], "next": None, "user_id": user_id}
+        elif action == "next" and state["next"]:
+            state["cursors"].append(state["next"])
+        elif action == "prev" and len(state["cursors"]) > 1:
+            state["cursors"].pop()
+        
+        rows = await load_my_trips_page(update.effective_user.id, state)
+        if rows is None:
+            await query.edit_message_text("❌ Вы не зарегистрированы в системе.\nИспользуйте /start для регистрации.")
+            return
         
-        await update.message.reply_text(
-            trips_text,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+        context.user_data["my_trips"] = state
+        text, reply_markup = render_my_trips_page(state, rows)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
         
+    except BadRequest as e:
+        # Повторное нажатие той же кнопки - текст не изменился
+        if "not modified" not in str(e).lower():
+            logger.error(f"Error in my_trips callback: {e}")
     except Exception as e:
-        logger.error(f"Error in my_trips command: {e}")
-        await update.message.reply_text("😕 Произошла ошибка при получении поездок.")
-    finally:
-        if db:
-            db.close()
+        logger.error(f"Error in my_trips callback: {e}")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений"""
@@ -1077,6 +1132,88 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup
         )
 
+# =============== РАССЫЛКИ (только администраторы) ===============
+BROADCAST_USAGE = (
+    "Использование:\n"
+    "/broadcast <all|drivers|passengers>[:Город] текст\n"
+    "/broadcast_status <id>\n"
+    "/broadcast_cancel <id>"
+)
+
+def broadcast_allowed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    return bool(
+        broadcasts and context.bot_data.get('db_available')
+        and broadcasts.is_admin(update.effective_user.id)
+    )
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /broadcast - рассылка всем активным пользователям или сегменту"""
+    user = update.effective_user
+    if not broadcast_allowed(update, context):
+        logger.warning(f"Пользователь {user.id} попытался запустить рассылку без прав")
+        return
+    
+    # Текст берется из сообщения целиком, чтобы сохранить переносы строк
+    parts = (update.message.text or "").split(maxsplit=2)
+    if len(parts) < 3:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    segment, _, city = parts[1].partition(":")
+    if segment not in broadcasts.SEGMENTS:
+        await update.message.reply_text(f"❌ Неизвестный сегмент: {segment}\n\n{BROADCAST_USAGE}")
+        return
+    
+    broadcast_id, recipients = await run_db(
+        broadcasts.create_broadcast, parts[2], segment, city or None, user.id
+    )
+    logger.info(f"Пользователь {user.id} запустил рассылку {broadcast_id} ({parts[1]}, {recipients} получателей)")
+    await update.message.reply_text(
+        f"📣 Рассылка #{broadcast_id} запущена\n"
+        f"Получателей: {recipients}\n"
+        f"Прогресс: /broadcast_status {broadcast_id}"
+    )
+
+def format_broadcast_progress(progress: dict) -> str:
+    messages = progress["messages"]
+    return (
+        f"📣 Рассылка #{progress['id']} ({progress['segment']}"
+        f"{':' + progress['city'] if progress['city'] else ''}): {progress['status']}\n"
+        f"В очереди: {progress['enqueued']}\n"
+        f"Отправлено: {messages.get('sent', 0)}\n"
+        f"Ожидает: {messages.get('pending', 0)}\n"
+        f"Не доставлено: {messages.get('failed', 0)}"
+    )
+
+async def broadcast_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /broadcast_status <id> - прогресс рассылки"""
+    if not broadcast_allowed(update, context):
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    
+    progress = await run_db(broadcasts.broadcast_progress, int(context.args[0]))
+    if progress is None:
+        await update.message.reply_text("❌ Рассылка не найдена")
+        return
+    await update.message.reply_text(format_broadcast_progress(progress))
+
+async def broadcast_cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /broadcast_cancel <id> - остановить рассылку"""
+    if not broadcast_allowed(update, context):
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    
+    broadcast_id = int(context.args[0])
+    cancelled = await run_db(broadcasts.cancel_broadcast, broadcast_id)
+    logger.info(f"Пользователь {update.effective_user.id} отменил рассылку {broadcast_id}: {cancelled}")
+    await update.message.reply_text(
+        f"🛑 Рассылка #{broadcast_id} остановлена" if cancelled
+        else f"❌ Рассылка #{broadcast_id} не найдена или уже завершена"
+    )
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ошибок"""
     logger.error(f"Ошибка при обработке сообщения: {context.error}")
@@ -1090,6 +1227,37 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
 # =============== ЗАПУСК БОТА ===============
+def build_application(db_available: bool) -> Application:
+    """Application с зарегистрированными обработчиками (общий для polling и webhook)"""
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_BASE}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .build()
+    )
+    
+    application.bot_data['db_available'] = db_available
+    
+    print("🔗 Регистрация обработчиков команд...")
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("about", about_command))
+    application.add_handler(CommandHandler("app", app_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("my_trips", my_trips_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status_command))
+    application.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(CallbackQueryHandler(help_no_db_callback, pattern="^help_no_db$"))
+    application.add_handler(CallbackQueryHandler(my_trips_callback, pattern="^my_trips:"))
+    
+    application.add_error_handler(error_handler)
+    return application
+
 def main():
     """Запуск бота"""
     print("=" * 60)
@@ -1140,6 +1308,10 @@ def main():
             print(f"❌ ОШИБКА создания таблиц: {e}")
             db_available = False
     
+    if db_available and bot_db is None:
+        print("❌ Пул запросов к БД не инициализирован")
+        db_available = False
+    
     if not db_available:
         print("\n⚠️  Бот запускается без базы данных!")
         print("   Функционал будет ограничен:")
@@ -1170,34 +1342,31 @@ def main():
     print("=" * 60)
     
     try:
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        application.bot_data['db_available'] = db_available
-        
-        print("🔗 Регистрация обработчиков команд...")
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("about", about_command))
-        application.add_handler(CommandHandler("app", app_command))
-        application.add_handler(CommandHandler("stats", stats_command))
-        application.add_handler(CommandHandler("profile", profile_command))
-        application.add_handler(CommandHandler("my_trips", my_trips_command))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        application.add_handler(CallbackQueryHandler(help_no_db_callback, pattern="^help_no_db$"))
-        
-        application.add_error_handler(error_handler)
+        application = build_application(db_available)
         
         print("✅ Бот запущен успешно!")
-        print("🔄 Ожидание сообщений...")
+        if bot_webhook.BOT_MODE == "webhook":
+            print(f"🔗 Режим webhook: {bot_webhook.webhook_url() or '❌ BOT_WEBHOOK_URL не задан'}")
+            print(f"   Прием на {bot_webhook.BOT_WEBHOOK_HOST}:{bot_webhook.BOT_WEBHOOK_PORT}{bot_webhook.BOT_WEBHOOK_PATH}")
+        else:
+            print("🔄 Ожидание сообщений (polling)...")
         print("⚠️  Для остановки нажмите Ctrl+C")
         print("=" * 60)
         
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
-            poll_interval=0.5,
-            timeout=30
-        )
+        if db_available and activity_buffer:
+            activity_buffer.start()
+        if db_available:
+            bot_db.user_change_feed.start()
+        
+        if bot_webhook.BOT_MODE == "webhook":
+            bot_webhook.run_standalone(application)
+        else:
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+                poll_interval=0.5,
+                timeout=30
+            )
         
     except KeyboardInterrupt:
         print("\n\n⚠️  Бот остановлен пользователем")
@@ -1206,6 +1375,14 @@ def main():
     except Exception as e:
         logger.critical(f"Критическая ошибка при запуске бота: {e}")
         print(f"❌ Критическая ошибка: {e}")
+    
+    finally:
+        # Сбрасываем накопленные обновления last_active перед выходом
+        if db_available and activity_buffer:
+            activity_buffer.stop()
+        if bot_db:
+            bot_db.user_change_feed.stop()
+            bot_db.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,384 @@
+# notifications.py - УВЕДОМЛЕНИЯ В TELEGRAM ЧЕРЕЗ OUTBOX
+#
+# Эндпоинты не ходят в Telegram: они добавляют строку в notification_outbox в
+# той же транзакции, что и само изменение (новая бронь, отмена поездки).
+# Фоновый диспетчер забирает пачки готовых к отправке строк и шлет их через
+# Bot API с учетом лимитов Telegram (~30 сообщений/сек на бота): не больше
+# NOTIFY_GLOBAL_RATE (29/сек) всего и 1 сообщения/сек в один чат (20 в минуту для групп). Временные ошибки и 429 повторяются с
+# экспоненциальной задержкой (для 429 - не раньше retry_after), постоянные
+# (бот заблокирован, чат не найден) помечаются failed.
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import httpx
+from sqlalchemy import delete, func, select, update
+
+import database
+from database import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+
+# Запускать диспетчер в этом процессе. Лимиты скорости считаются в памяти процесса,
+# а на SQLite SKIP LOCKED не работает - включайте ровно в одном процессе
+NOTIFY_DISPATCHER = os.getenv("NOTIFY_DISPATCHER", "false").lower() in ("1", "true", "yes")
+# Telegram пропускает ~30 сообщений/сек; запас в одно сообщение покрывает разброс
+# сетевой задержки (иначе 31-е за скользящую секунду может прийти раньше срока)
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "29"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+NOTIFY_GROUP_RATE = float(os.getenv("NOTIFY_GROUP_RATE", str(20 / 60)))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "100"))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "1"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", "2"))
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", "600"))
+# На сколько строка "арендуется" отправителем: если процесс упал, ее заберут снова
+NOTIFY_LEASE_SECONDS = int(os.getenv("NOTIFY_LEASE_SECONDS", "60"))
+NOTIFY_RETENTION_DAYS = int(os.getenv("NOTIFY_RETENTION_DAYS", "7"))
+NOTIFY_SAVE_INTERVAL = float(os.getenv("NOTIFY_SAVE_INTERVAL", "1"))
+NOTIFY_MAX_TRACKED_CHATS = int(os.getenv("NOTIFY_MAX_TRACKED_CHATS", "10000"))
+
+PENDING, SENT, FAILED = "pending", "sent", "failed"
+
+
+# =============== ПОСТАНОВКА В ОЧЕРЕДЬ ===============
+def _route(trip) -> str:
+    return f"{trip.start_address} → {trip.finish_address}\n🗓 {trip.departure_date.strftime('%d.%m.%Y %H:%M')}"
+
+
+def booking_created(driver_chat_id: int, passenger_name: str, seats: int, trip) -> NotificationOutbox:
+    """Водителю: новое бронирование его поездки"""
+    return NotificationOutbox(
+        chat_id=driver_chat_id,
+        kind="booking_created",
+        text=f"🎫 Новое бронирование: {passenger_name}, мест: {seats}\n📍 {_route(trip)}"
+    )
+
+
+def trip_cancelled(passenger_chat_ids: Iterable[int], trip) -> List[NotificationOutbox]:
+    """Пассажирам: водитель отменил поездку"""
+    text = f"❌ Водитель отменил поездку\n📍 {_route(trip)}\nВаше бронирование отменено."
+    return [
+        NotificationOutbox(chat_id=chat_id, kind="trip_cancelled", text=text)
+        for chat_id in set(passenger_chat_ids)
+    ]
+
+
+# =============== ЛИМИТЫ ===============
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд.
+    capacity=1 - без всплесков: в любом окне в 1 сек не больше rate+1 сообщений"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до следующего токена (0 - можно брать сейчас)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Не выдавать токены seconds секунд (ответ 429 с retry_after)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class RateLimiter:
+    """Общий лимит бота и отдельные лимиты на каждый чат"""
+
+    def __init__(self, global_rate: float = NOTIFY_GLOBAL_RATE, chat_rate: float = NOTIFY_CHAT_RATE,
+                 group_rate: float = NOTIFY_GROUP_RATE):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный chat_id - группа или канал
+            bucket = self._chats[chat_id] = TokenBucket(self.group_rate if chat_id < 0 else self.chat_rate)
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        chat = self._chat(chat_id)
+        while True:
+            now = time.monotonic()
+            # Считаем оба ожидания до await: между проверкой и take() никто не вклинится
+            wait = max(self.global_bucket.delay(now), chat.delay(now))
+            if wait <= 0:
+                self.global_bucket.take()
+                chat.take()
+                return
+            await asyncio.sleep(wait)
+
+    def block_chat(self, chat_id: int, seconds: float):
+        self._chat(chat_id).block(seconds)
+
+    def prune(self):
+        """Убрать ведра чатов, которые полностью восстановились"""
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items()
+                        if bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity]:
+            del self._chats[chat_id]
+
+
+# =============== РАБОТА С OUTBOX (синхронно, в потоке) ===============
+class OutboxItem(NamedTuple):
+    id: int
+    chat_id: int
+    text: str
+    attempts: int
+
+
+def claim_batch(limit: int) -> List[OutboxItem]:
+    """Забрать готовые к отправке строки и продлить им next_attempt_at на время аренды"""
+    now = datetime.utcnow()
+    with database.SessionLocal() as db:
+        rows = db.execute(
+            select(
+                NotificationOutbox.id, NotificationOutbox.chat_id,
+                NotificationOutbox.text, NotificationOutbox.attempts
+            ).where(
+                NotificationOutbox.status == PENDING,
+                NotificationOutbox.next_attempt_at <= now
+            ).order_by(
+                # Уведомления о бронях и отменах - раньше сообщений рассылки
+                NotificationOutbox.broadcast_id.isnot(None), NotificationOutbox.id
+            ).limit(limit).with_for_update(skip_locked=True)
+        ).all()
+        if rows:
+            db.execute(
+                update(NotificationOutbox).where(
+                    NotificationOutbox.id.in_([row.id for row in rows])
+                ).values(next_attempt_at=now + timedelta(seconds=NOTIFY_LEASE_SECONDS)),
+                execution_options={"synchronize_session": False}
+            )
+        db.commit()
+    return [OutboxItem(*row) for row in rows]
+
+
+def save_results(results: List[dict]):
+    """Записать итоги пачки: отправленные одним UPDATE, остальные - по первичному ключу"""
+    sent_ids = [result["id"] for result in results if result["status"] == SENT]
+    others = [result for result in results if result["status"] != SENT]
+    now = datetime.utcnow()
+    with database.SessionLocal() as db:
+        if sent_ids:
+            db.execute(
+                update(NotificationOutbox).where(NotificationOutbox.id.in_(sent_ids)).values(
+                    status=SENT, sent_at=now, attempts=NotificationOutbox.attempts + 1, last_error=None
+                ),
+                execution_options={"synchronize_session": False}
+            )
+        if others:
+            db.execute(update(NotificationOutbox), others)
+        db.commit()
+
+
+def purge_outbox(days: int = NOTIFY_RETENTION_DAYS) -> int:
+    """Удалить отправленные и окончательно неудачные уведомления старше days дней"""
+    with database.SessionLocal() as db:
+        result = db.execute(
+            delete(NotificationOutbox).where(
+                NotificationOutbox.status.in_((SENT, FAILED)),
+                NotificationOutbox.created_at < datetime.utcnow() - timedelta(days=days)
+            ),
+            execution_options={"synchronize_session": False}
+        )
+        db.commit()
+        return result.rowcount
+
+
+def outbox_counts() -> Dict[str, int]:
+    with database.SessionLocal() as db:
+        rows = db.execute(
+            select(NotificationOutbox.status, func.count(NotificationOutbox.id)).group_by(NotificationOutbox.status)
+        ).all()
+    return {status: count for status, count in rows}
+
+
+def backoff_delay(attempts: int) -> float:
+    """Экспоненциальная задержка с разбросом ±20%, чтобы повторы не шли залпом"""
+    return min(NOTIFY_BACKOFF_MAX, NOTIFY_BACKOFF_BASE * 2 ** attempts) * random.uniform(0.8, 1.2)
+
+
+# =============== ДИСПЕТЧЕР ===============
+class NotificationDispatcher:
+    """Фоновая задача: outbox -> Bot API sendMessage"""
+
+    def __init__(self, token: str = TELEGRAM_BOT_TOKEN, api_base: str = TELEGRAM_API_BASE,
+                 limiter: Optional[RateLimiter] = None, batch_size: int = NOTIFY_BATCH_SIZE,
+                 poll_interval: float = NOTIFY_POLL_INTERVAL):
+        self.url = f"{api_base}/bot{token}/sendMessage"
+        self.limiter = limiter or RateLimiter()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.counters = defaultdict(int)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._last_purge = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._stopping = asyncio.Event()
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=5.0))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дождаться текущей пачки и остановиться"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self._client.aclose()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = await self.dispatch_once()
+                if time.monotonic() - self._last_purge > 3600:
+                    self._last_purge = time.monotonic()
+                    purged = await asyncio.to_thread(purge_outbox)
+                    if purged:
+                        logger.info(f"🧹 Удалено старых уведомлений: {purged}")
+                    self.limiter.prune()
+                elif len(self.limiter._chats) > NOTIFY_MAX_TRACKED_CHATS:
+                    # Рассылка проходит по тысячам чатов - не копим их ведра до часовой чистки
+                    self.limiter.prune()
+            except Exception as e:
+                logger.error(f"❌ Ошибка диспетчера уведомлений: {e}")
+                processed = 0
+            # Полная пачка - сразу за следующей, иначе ждем новых строк
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def dispatch_once(self) -> int:
+        """Отправить одну пачку; вернуть число взятых строк"""
+        batch = await asyncio.to_thread(claim_batch, self.batch_size)
+        if not batch:
+            return 0
+
+        # Сообщения одного чата уходят по порядку, разные чаты - параллельно
+        by_chat: Dict[int, List[OutboxItem]] = defaultdict(list)
+        for item in batch:
+            by_chat[item.chat_id].append(item)
+
+        results: List[dict] = []
+        sending = asyncio.ensure_future(
+            asyncio.gather(*(self._send_chat(items, results) for items in by_chat.values()))
+        )
+        # Итоги сохраняются по ходу отправки: при падении процесса повторно
+        # (после аренды) уйдет не вся пачка, а только последние NOTIFY_SAVE_INTERVAL секунд
+        try:
+            while True:
+                await asyncio.wait({sending}, timeout=NOTIFY_SAVE_INTERVAL)
+                # Проверяем до сохранения: итоги, пришедшие во время записи, заберет следующий круг
+                finished = sending.done()
+                done = results[:]
+                del results[:len(done)]
+                if done:
+                    await asyncio.to_thread(save_results, done)
+                if finished:
+                    break
+        finally:
+            if not sending.done():
+                # Задачу диспетчера отменили - отменяем и отправку
+                sending.cancel()
+                await asyncio.gather(sending, return_exceptions=True)
+        await sending
+        return len(batch)
+
+    async def _send_chat(self, items: List[OutboxItem], results: List[dict]):
+        retry_after = None
+        for item in items:
+            if retry_after is not None:
+                # Чат получил 429 - остальные его сообщения ждут вместе с ним
+                results.append(self._retry(item, "Отложено после 429", retry_after))
+                continue
+            await self.limiter.acquire(item.chat_id)
+            result, retry_after = await self._send(item)
+            results.append(result)
+
+    def _retry(self, item: OutboxItem, error: str, delay: Optional[float] = None) -> dict:
+        attempts = item.attempts + 1
+        if attempts >= NOTIFY_MAX_ATTEMPTS:
+            self.counters["failed"] += 1
+            return {"id": item.id, "status": FAILED, "attempts": attempts, "last_error": error}
+        self.counters["retried"] += 1
+        delay = max(delay or 0.0, backoff_delay(item.attempts))
+        return {
+            "id": item.id, "status": PENDING, "attempts": attempts, "last_error": error,
+            "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)
+        }
+
+    async def _send(self, item: OutboxItem):
+        """Один sendMessage; вернуть (итог для save_results, retry_after при 429)"""
+        try:
+            response = await self._client.post(self.url, json={
+                "chat_id": item.chat_id,
+                "text": item.text,
+                "disable_web_page_preview": True
+            })
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            return self._retry(item, f"{type(e).__name__}: {e}"), None
+
+        if response.status_code == 200 and data.get("ok"):
+            self.counters["sent"] += 1
+            return {"id": item.id, "status": SENT}, None
+
+        error = f"{response.status_code}: {data.get('description', '')}"
+        if response.status_code == 429:
+            retry_after = float((data.get("parameters") or {}).get("retry_after", 1))
+            self.counters["rate_limited"] += 1
+            self.limiter.block_chat(item.chat_id, retry_after)
+            return self._retry(item, error, retry_after), retry_after
+        if response.status_code in (400, 403):
+            # Чат не найден, бот заблокирован пользователем - повтор не поможет
+            self.counters["failed"] += 1
+            logger.warning(f"⚠️  Уведомление {item.id} не доставлено: {error}")
+            return {"id": item.id, "status": FAILED, "attempts": item.attempts + 1, "last_error": error}, None
+        return self._retry(item, error), None
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "counters": dict(self.counters),
+            "tracked_chats": len(self.limiter._chats)
+        }
+
+
+notification_dispatcher = NotificationDispatcher()
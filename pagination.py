@@ -0,0 +1,38 @@
+# pagination.py - КУРСОРЫ ДЛЯ KEYSET-ПАГИНАЦИИ
+#
+# Курсор - это (значение колонки сортировки, id) последней отданной строки,
+# упакованные в непрозрачную строку. Следующая страница начинается строго
+# после этой пары, поэтому глубина страницы не влияет на стоимость запроса
+# (в отличие от OFFSET) и вставки не сдвигают выдачу.
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(value: datetime, row_id: int) -> str:
+    raw = f"{value.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Разобрать курсор; ValueError, если он поврежден"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(value), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+def page_of(rows: list, limit: int, key) -> Tuple[list, Optional[str]]:
+    """
+    Обрезать выборку из limit + 1 строк до страницы и вернуть курсор следующей
+    страницы (None, если это последняя). key(row) -> (значение сортировки, id)
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
@@ -0,0 +1,162 @@
+# pool_metrics.py - НАСТРОЙКА ПУЛА СОЕДИНЕНИЙ И ЕГО МЕТРИКИ
+import bisect
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Настройки пула (общие для синхронного и асинхронного движков)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))      # секунды ожидания свободного соединения
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))       # секунды жизни соединения
+# Проверка соединения при выдаче из пула:
+#   always - SELECT 1 при каждой выдаче (лишний round trip на каждый запрос)
+#   idle   - только если соединение простаивало дольше DB_PRE_PING_IDLE_SECONDS
+#   never  - без проверки
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "idle").lower()
+DB_PRE_PING_IDLE_SECONDS = float(os.getenv("DB_PRE_PING_IDLE_SECONDS", "30"))
+
+# Границы корзин гистограммы ожидания соединения (миллисекунды)
+WAIT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+class PoolMetrics:
+    """Счетчики выдачи соединений и гистограмма времени ожидания"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.pool = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.pings = 0
+        self.ping_failures = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record_wait(self, wait_ms: float):
+        index = bisect.bisect_left(WAIT_BUCKETS_MS, wait_ms)
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            self.wait_buckets[index] += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_ping(self, ok: bool):
+        with self._lock:
+            self.pings += 1
+            if not ok:
+                self.ping_failures += 1
+
+    def snapshot(self) -> dict:
+        pool = self.pool
+        with self._lock:
+            labels = [f"<={bound}ms" for bound in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            data = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "pre_ping": {
+                    "strategy": DB_POOL_PRE_PING,
+                    "pings": self.pings,
+                    "failures": self.ping_failures
+                },
+                "wait_ms": {
+                    "avg": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                    "max": round(self.wait_max_ms, 3),
+                    "histogram": dict(zip(labels, self.wait_buckets))
+                }
+            }
+        if pool is not None:
+            data.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "max_overflow": pool._max_overflow,
+                "timeout": pool.timeout()
+            })
+        return data
+
+
+# Метрики всех движков процесса: {"primary": PoolMetrics, ...}
+POOL_METRICS: Dict[str, PoolMetrics] = {}
+
+
+class _TimedPoolMixin:
+    """Замеряет время ожидания свободного соединения в пуле"""
+    metrics: PoolMetrics = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # После engine.dispose() пул пересоздается - метрики показывают на актуальный
+        self.metrics.pool = self
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record_wait((time.perf_counter() - started) * 1000)
+        return connection
+
+
+def pool_options(name: str, is_async: bool = False) -> dict:
+    """Параметры create_engine / create_async_engine для пула с метриками"""
+    metrics = POOL_METRICS.setdefault(name, PoolMetrics(name))
+    base = AsyncAdaptedQueuePool if is_async else QueuePool
+    poolclass = type(f"Timed{base.__name__}", (_TimedPoolMixin, base), {"metrics": metrics})
+
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING == "always",
+    }
+
+
+def attach_pool_events(engine, name: str):
+    """Подключить проверку простаивавших соединений (стратегия idle)"""
+    if DB_POOL_PRE_PING != "idle":
+        return
+
+    metrics = POOL_METRICS[name]
+    dialect = engine.dialect
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get("checked_in_at")
+        if checked_in_at is None or time.monotonic() - checked_in_at < DB_PRE_PING_IDLE_SECONDS:
+            return
+        try:
+            dialect.do_ping(dbapi_connection)
+            metrics.record_ping(True)
+        except Exception as e:
+            metrics.record_ping(False)
+            logger.warning(f"⚠️  Соединение пула '{name}' разорвано, переподключаемся: {e}")
+            # Пул выбросит это соединение и выдаст новое
+            raise exc.DisconnectionError() from e
+
+
+def pool_stats() -> dict:
+    """Текущее состояние всех пулов процесса"""
+    return {name: metrics.snapshot() for name, metrics in POOL_METRICS.items()}
@@ -0,0 +1,446 @@
+# queries.py - ЗАРАНЕЕ ПОСТРОЕННЫЕ ЗАПРОСЫ ДЛЯ ГОРЯЧИХ ПУТЕЙ
+#
+# Запросы собираются один раз при импорте (значения передаются через bindparam),
+# поэтому на каждый HTTP-запрос не строится заново цепочка ORM-выражений, а
+# SQLAlchemy берет скомпилированный SQL из своего кэша. Для PostgreSQL через
+# asyncpg один и тот же текст запроса дополнительно переиспользует
+# серверный prepared statement (см. DB_PREPARED_STATEMENT_CACHE_SIZE в database.py).
+from functools import lru_cache
+
+from sqlalchemy import Float, Integer, and_, bindparam, case, cast, func, or_, select, update
+
+from database import Booking, DriverTrip, Message, TripStatus, User, UserCar
+
+# --- Пользователь ---
+USER_BY_TELEGRAM_ID = select(User).where(
+    User.telegram_id == bindparam("telegram_id")
+).limit(1)
+
+# --- Поездка ---
+TRIP_BY_ID = select(DriverTrip).where(
+    DriverTrip.id == bindparam("trip_id")
+)
+
+ACTIVE_TRIP_BY_ID = select(DriverTrip).where(
+    DriverTrip.id == bindparam("trip_id"),
+    DriverTrip.status == TripStatus.ACTIVE
+)
+
+# Версионные поля для ETag деталей поездки
+TRIP_ETAG_ROW = select(
+    DriverTrip.updated_at,
+    DriverTrip.status,
+    DriverTrip.available_seats,
+    User.updated_at
+).join(
+    User, User.id == DriverTrip.driver_id
+).where(
+    DriverTrip.id == bindparam("trip_id")
+)
+
+# Есть ли у пассажира активная бронь этой поездки
+ACTIVE_BOOKING_EXISTS = select(Booking.id).where(
+    Booking.driver_trip_id == bindparam("trip_id"),
+    Booking.passenger_id == bindparam("passenger_id"),
+    Booking.status == TripStatus.ACTIVE
+).limit(1)
+
+
+# --- Проекции для чтения ---
+# Только колонки, которые попадают в ответ: без route_points (JSON), polyline и
+# прочих тяжелых полей, без ORM-объектов и identity map. Строки результата -
+# компактные Row с доступом по имени (row.start_address, row.driver_first_name)
+SEARCH_TRIP_COLUMNS = (
+    DriverTrip.id,
+    DriverTrip.start_address,
+    DriverTrip.finish_address,
+    DriverTrip.start_city,
+    DriverTrip.finish_city,
+    DriverTrip.departure_date,
+    DriverTrip.departure_time,
+    DriverTrip.estimated_arrival,
+    DriverTrip.available_seats,
+    DriverTrip.price_per_seat,
+    DriverTrip.comment,
+    DriverTrip.status,
+    User.id.label("driver_id"),
+    User.first_name.label("driver_first_name"),
+    User.last_name.label("driver_last_name"),
+    User.driver_rating.label("driver_rating"),
+    User.has_car.label("driver_has_car"),
+    User.car_model.label("driver_car_model"),
+    User.car_color.label("driver_car_color"),
+)
+
+# Поля пользователя в /api/users/profile-full (выбираются вместе с ETag)
+PROFILE_USER_COLUMNS = (
+    User.updated_at,
+    User.id,
+    User.telegram_id,
+    User.first_name,
+    User.last_name,
+    User.username,
+    User.phone,
+    User.role,
+    User.driver_rating,
+    User.passenger_rating,
+    User.total_driver_trips,
+    User.total_passenger_trips
+)
+
+PROFILE_CARS = select(
+    UserCar.id,
+    UserCar.model,
+    UserCar.color,
+    UserCar.license_plate,
+    UserCar.car_type,
+    UserCar.seats,
+    UserCar.is_default
+).where(
+    UserCar.user_id == bindparam("user_id"),
+    UserCar.is_active == True
+).order_by(UserCar.is_default.desc())
+
+# Поездки водителя с числом бронирований (подзапрос вместо загрузки списка bookings)
+PROFILE_DRIVER_TRIPS = select(
+    DriverTrip.id,
+    DriverTrip.start_address,
+    DriverTrip.finish_address,
+    DriverTrip.departure_date,
+    DriverTrip.available_seats,
+    DriverTrip.price_per_seat,
+    DriverTrip.status,
+    select(func.count(Booking.id)).where(
+        Booking.driver_trip_id == DriverTrip.id
+    ).correlate(DriverTrip).scalar_subquery().label("passengers_count")
+).where(
+    DriverTrip.driver_id == bindparam("user_id")
+).order_by(DriverTrip.departure_date.desc()).limit(10)
+
+# Бронирования пассажира вместе с поездкой и именем водителя
+PROFILE_PASSENGER_BOOKINGS = select(
+    Booking.id,
+    Booking.booked_seats,
+    Booking.price_agreed,
+    Booking.status,
+    DriverTrip.id.label("trip_id"),
+    DriverTrip.start_address,
+    DriverTrip.finish_address,
+    DriverTrip.departure_date,
+    DriverTrip.price_per_seat,
+    User.first_name.label("driver_first_name"),
+    User.last_name.label("driver_last_name")
+).join(
+    DriverTrip, DriverTrip.id == Booking.driver_trip_id
+).join(
+    User, User.id == DriverTrip.driver_id
+).where(
+    Booking.passenger_id == bindparam("user_id")
+).order_by(Booking.booked_at.desc()).limit(10)
+
+
+# --- Поиск ---
+@lru_cache(maxsize=None)
+def search_trips_statement(by_from_city: bool, by_to_city: bool, by_max_price: bool):
+    """
+    Запрос поиска (проекция SEARCH_TRIP_COLUMNS) для набора заполненных фильтров (8 вариантов).
+    Параметры: passengers, lower_bound, upper_bound и, при наличии фильтров,
+    from_pattern, to_pattern, max_price.
+    """
+    query = select(*SEARCH_TRIP_COLUMNS).join(User, User.id == DriverTrip.driver_id).where(
+        DriverTrip.status == TripStatus.ACTIVE,
+        DriverTrip.available_seats >= bindparam("passengers"),
+        DriverTrip.departure_date >= bindparam("lower_bound"),
+        DriverTrip.departure_date < bindparam("upper_bound")
+    )
+
+    if by_from_city:
+        from_pattern = bindparam("from_pattern")
+        query = query.where(or_(
+            DriverTrip.start_city.ilike(from_pattern),
+            DriverTrip.start_address.ilike(from_pattern)
+        ))
+
+    if by_to_city:
+        to_pattern = bindparam("to_pattern")
+        query = query.where(or_(
+            DriverTrip.finish_city.ilike(to_pattern),
+            DriverTrip.finish_address.ilike(to_pattern)
+        ))
+
+    if by_max_price:
+        query = query.where(DriverTrip.price_per_seat <= bindparam("max_price"))
+
+    # Сначала самые ближайшие
+    return query.order_by(DriverTrip.departure_date.asc(), DriverTrip.price_per_seat.asc())
+
+
+def search_trips_params(from_city, to_city, max_price, passengers, lower_bound, upper_bound):
+    """Выбрать вариант запроса поиска и собрать параметры для него"""
+    params = {
+        "passengers": passengers,
+        "lower_bound": lower_bound,
+        "upper_bound": upper_bound
+    }
+    if from_city:
+        params["from_pattern"] = f"%{from_city}%"
+    if to_city:
+        params["to_pattern"] = f"%{to_city}%"
+    if max_price:
+        params["max_price"] = max_price
+
+    statement = search_trips_statement(bool(from_city), bool(to_city), bool(max_price))
+    return statement, params
+
+
+# --- Мои поездки (keyset-пагинация) ---
+# Вкладки: upcoming - предстоящие (ближайшие первыми), past - прошедшие,
+# all - все (новые первыми, как раньше)
+MY_TRIPS_TABS = ("upcoming", "past", "all")
+
+
+def _after(column, id_column, ascending: bool):
+    """Условие "строго после курсора" для сортировки (column, id)"""
+    value, row_id = bindparam("cursor_value"), bindparam("cursor_id")
+    if ascending:
+        return or_(column > value, and_(column == value, id_column > row_id))
+    return or_(column < value, and_(column == value, id_column < row_id))
+
+
+@lru_cache(maxsize=None)
+def my_driver_trips_statement(tab: str, with_cursor: bool):
+    """
+    Поездки водителя с числом бронирований. Индекс (driver_id, departure_date).
+    Параметры: user_id, now (кроме all), limit и при наличии курсора cursor_value, cursor_id.
+    """
+    # Один GROUP BY по бронированиям поездок водителя вместо len(trip.bookings) на каждую
+    counts = select(
+        Booking.driver_trip_id,
+        func.count(Booking.id).label("bookings_count")
+    ).join(
+        DriverTrip, DriverTrip.id == Booking.driver_trip_id
+    ).where(
+        DriverTrip.driver_id == bindparam("user_id")
+    ).group_by(Booking.driver_trip_id).subquery()
+
+    query = select(
+        DriverTrip.id,
+        DriverTrip.start_address,
+        DriverTrip.finish_address,
+        DriverTrip.departure_date,
+        DriverTrip.available_seats,
+        DriverTrip.price_per_seat,
+        DriverTrip.status,
+        func.coalesce(counts.c.bookings_count, 0).label("bookings_count")
+    ).outerjoin(
+        counts, counts.c.driver_trip_id == DriverTrip.id
+    ).where(
+        DriverTrip.driver_id == bindparam("user_id")
+    )
+
+    if tab == "upcoming":
+        query = query.where(DriverTrip.departure_date >= bindparam("now"))
+    elif tab == "past":
+        query = query.where(DriverTrip.departure_date < bindparam("now"))
+
+    ascending = tab == "upcoming"
+    if with_cursor:
+        query = query.where(_after(DriverTrip.departure_date, DriverTrip.id, ascending))
+
+    if ascending:
+        query = query.order_by(DriverTrip.departure_date.asc(), DriverTrip.id.asc())
+    else:
+        query = query.order_by(DriverTrip.departure_date.desc(), DriverTrip.id.desc())
+    return query.limit(bindparam("limit"))
+
+
+@lru_cache(maxsize=None)
+def my_bookings_statement(tab: str, with_cursor: bool):
+    """
+    Бронирования пассажира (новые первыми) с поездкой и именем водителя.
+    Индекс (passenger_id, booked_at); вкладка фильтрует по дате поездки.
+    Параметры те же, что у my_driver_trips_statement.
+    """
+    query = select(
+        Booking.id,
+        Booking.booked_seats,
+        Booking.price_agreed,
+        Booking.status,
+        Booking.booked_at,
+        DriverTrip.id.label("trip_id"),
+        DriverTrip.start_address,
+        DriverTrip.finish_address,
+        DriverTrip.departure_date,
+        DriverTrip.price_per_seat,
+        User.first_name.label("driver_first_name"),
+        User.last_name.label("driver_last_name")
+    ).join(
+        DriverTrip, DriverTrip.id == Booking.driver_trip_id
+    ).join(
+        User, User.id == DriverTrip.driver_id
+    ).where(
+        Booking.passenger_id == bindparam("user_id")
+    )
+
+    if tab == "upcoming":
+        query = query.where(DriverTrip.departure_date >= bindparam("now"))
+    elif tab == "past":
+        query = query.where(DriverTrip.departure_date < bindparam("now"))
+
+    if with_cursor:
+        query = query.where(_after(Booking.booked_at, Booking.id, ascending=False))
+
+    return query.order_by(Booking.booked_at.desc(), Booking.id.desc()).limit(bindparam("limit"))
+
+
+# --- Сообщения ---
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.booking_id,
+    Message.sender_id,
+    Message.receiver_id,
+    Message.content,
+    Message.is_read,
+    Message.sent_at
+)
+
+# Участники бронирования: пассажир и водитель поездки
+BOOKING_PARTICIPANTS = select(
+    Booking.passenger_id,
+    DriverTrip.driver_id
+).join(
+    DriverTrip, DriverTrip.id == Booking.driver_trip_id
+).where(
+    Booking.id == bindparam("booking_id")
+)
+
+USER_EXISTS = select(User.id).where(User.id == bindparam("user_id"))
+
+
+@lru_cache(maxsize=None)
+def conversation_statement(by_booking: bool, with_cursor: bool):
+    """
+    Переписка user_id с peer_id в обе стороны, новые первыми. Индекс (sender_id, receiver_id, sent_at).
+    Параметры: user_id, peer_id, limit, при by_booking - booking_id, при курсоре - cursor_value, cursor_id.
+    """
+    me, peer = bindparam("user_id"), bindparam("peer_id")
+    query = select(*MESSAGE_COLUMNS).where(or_(
+        and_(Message.sender_id == me, Message.receiver_id == peer),
+        and_(Message.sender_id == peer, Message.receiver_id == me)
+    ))
+    if by_booking:
+        query = query.where(Message.booking_id == bindparam("booking_id"))
+    if with_cursor:
+        query = query.where(_after(Message.sent_at, Message.id, ascending=False))
+    return query.order_by(Message.sent_at.desc(), Message.id.desc()).limit(bindparam("limit"))
+
+
+# Непрочитанные входящие новее after_id. Индекс (receiver_id, is_read, sent_at)
+UNREAD_AFTER = select(*MESSAGE_COLUMNS).where(
+    Message.receiver_id == bindparam("user_id"),
+    Message.is_read == False,
+    Message.id > bindparam("after_id")
+).order_by(Message.id).limit(bindparam("limit"))
+
+# Отметить прочитанными входящие от peer_id до up_to_id включительно.
+# RETURNING booking_id - только реально измененные строки, по ним уменьшаются счетчики
+MARK_READ = update(Message).where(
+    Message.receiver_id == bindparam("user_id"),
+    Message.sender_id == bindparam("peer_id"),
+    Message.is_read == False,
+    Message.id <= bindparam("up_to_id")
+).values(is_read=True).returning(Message.booking_id).execution_options(synchronize_session=False)
+
+
+# --- Счетчики непрочитанных (см. unread_counters.py) ---
+# Изменить счетчик получателя user_id на delta (updated_at не трогаем: профиль и его ETag не меняются)
+USER_UNREAD_ADD = update(User).where(
+    User.id == bindparam("user_id")
+).values(
+    unread_messages=User.unread_messages + bindparam("delta"),
+    updated_at=User.updated_at
+).execution_options(synchronize_session=False)
+
+# Счетчик бронирования: колонка пассажира, если получатель user_id - пассажир, иначе водителя
+_receiver_is_passenger = Booking.passenger_id == bindparam("user_id")
+BOOKING_UNREAD_ADD = update(Booking).where(
+    Booking.id == bindparam("booking_id")
+).values(
+    passenger_unread=case(
+        (_receiver_is_passenger, Booking.passenger_unread + bindparam("delta")),
+        else_=Booking.passenger_unread
+    ),
+    driver_unread=case(
+        (_receiver_is_passenger, Booking.driver_unread),
+        else_=Booking.driver_unread + bindparam("delta")
+    )
+).execution_options(synchronize_session=False)
+
+# Бейджи: одна строка по первичному ключу вместо COUNT(*) по messages
+USER_UNREAD = select(User.unread_messages).where(User.id == bindparam("user_id"))
+
+BOOKING_UNREAD = select(
+    Booking.passenger_id,
+    DriverTrip.driver_id,
+    Booking.passenger_unread,
+    Booking.driver_unread
+).join(
+    DriverTrip, DriverTrip.id == Booking.driver_trip_id
+).where(
+    Booking.id == bindparam("booking_id")
+)
+
+
+# --- Отзывы и рейтинги (см. ratings.py) ---
+# Бронирование для отзыва: участники и статусы
+REVIEW_BOOKING = select(
+    Booking.passenger_id,
+    Booking.status,
+    DriverTrip.driver_id,
+    DriverTrip.status.label("trip_status")
+).join(
+    DriverTrip, DriverTrip.id == Booking.driver_trip_id
+).where(
+    Booking.id == bindparam("booking_id")
+)
+
+SUB_SCORES = ("punctuality", "comfort", "communication")
+
+
+@lru_cache(maxsize=None)
+def apply_review_statement(as_driver: bool):
+    """
+    Добавить оценки отзыва к суммам пользователя user_id в роли водителя или пассажира
+    (подоценки тоже по роли) и тем же UPDATE пересчитать средний рейтинг. Параметры: user_id, rating и подоценки
+    punctuality, comfort, communication (None - не оценено). RETURNING telegram_id и рейтинг.
+    """
+    role = "driver" if as_driver else "passenger"
+    rating_sum, rating_count = getattr(User, f"{role}_rating_sum"), getattr(User, f"{role}_rating_count")
+    average = getattr(User, f"{role}_rating")
+    rating = bindparam("rating", type_=Integer)
+    values = {
+        rating_sum.key: rating_sum + rating,
+        rating_count.key: rating_count + 1,
+        # Справа в SET - значения до обновления
+        average.key: cast(rating_sum + rating, Float) / (rating_count + 1)
+    }
+    for name in SUB_SCORES:
+        score = bindparam(name, type_=Integer)
+        score_sum, score_count = getattr(User, f"{role}_{name}_sum"), getattr(User, f"{role}_{name}_count")
+        values[score_sum.key] = score_sum + func.coalesce(score, 0)
+        values[score_count.key] = score_count + case((score.is_(None), 0), else_=1)
+    return update(User).where(
+        User.id == bindparam("user_id")
+    ).values(**values).returning(
+        User.telegram_id, average
+    ).execution_options(synchronize_session=False)
+
+
+# Рейтинги пользователя: одна строка по первичному ключу
+USER_RATINGS = select(
+    User.id,
+    *(getattr(User, f"{role}_rating{suffix}")
+      for role in ("driver", "passenger") for suffix in ("", "_count")),
+    *(getattr(User, f"{role}_{name}_{part}")
+      for role in ("driver", "passenger") for name in SUB_SCORES for part in ("sum", "count"))
+).where(User.id == bindparam("user_id"))
@@ -0,0 +1,146 @@
+# ratings.py - РЕЙТИНГИ ПОЛЬЗОВАТЕЛЕЙ ИЗ ОТЗЫВОВ
+#
+# /api/reviews/create добавляет оценки отзыва к суммам и количествам в users той
+# же транзакцией, что и сам отзыв (queries.apply_review_statement), и тем же
+# UPDATE пересчитывает driver_rating / passenger_rating - средние никогда не
+# считаются по всем отзывам. rebuild_ratings() заново заполняет суммы из reviews
+# пачками пользователей: после миграции или ручных правок отзывов.
+# Ручной пересчет: python ratings.py
+import logging
+import os
+
+from sqlalchemy import bindparam, func, select, update
+
+import database
+from change_feed import record_user_change
+from database import Booking, DriverTrip, Review, User
+from queries import SUB_SCORES
+from user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+RATINGS_REBUILD_BATCH = int(os.getenv("RATINGS_REBUILD_BATCH", "1000"))
+# Рейтинг пользователя без отзывов (как default колонок в database.py)
+DEFAULT_RATING = 5.0
+
+ROLES = ("driver", "passenger")
+AGGREGATES = tuple(
+    f"{role}_{name}_{part}"
+    for role in ROLES for name in ("rating",) + SUB_SCORES for part in ("sum", "count")
+)
+
+
+def _average(total: int, count: int):
+    return round(total / count, 2) if count else None
+
+
+def rating_summary(row) -> dict:
+    """Рейтинги и средние подоценки по ролям из строки queries.USER_RATINGS"""
+    summary = {}
+    for role in ROLES:
+        summary[role] = {
+            "rating": getattr(row, f"{role}_rating"),
+            "reviews": getattr(row, f"{role}_rating_count")
+        }
+        for name in SUB_SCORES:
+            count = getattr(row, f"{role}_{name}_count")
+            summary[role][name] = {"average": _average(getattr(row, f"{role}_{name}_sum"), count), "count": count}
+    return summary
+
+
+def _aggregate(db, first_id: int, last_id: int) -> dict:
+    """Суммы и количества оценок пользователей first_id..last_id по отзывам"""
+    # Роль оцененного определяет бронирование: водитель поездки или пассажир.
+    # Отзывы без бронирования в рейтинг не входят (через API их не создать)
+    as_driver = (DriverTrip.driver_id == Review.reviewed_user_id).label("as_driver")
+    scores = [Review.rating] + [getattr(Review, name) for name in SUB_SCORES]
+    rows = db.execute(
+        select(
+            Review.reviewed_user_id, as_driver,
+            *(aggregate(score) for score in scores for aggregate in (func.sum, func.count))
+        ).join(
+            Booking, Booking.id == Review.booking_id
+        ).join(
+            DriverTrip, DriverTrip.id == Booking.driver_trip_id
+        ).where(
+            Review.reviewed_user_id.between(first_id, last_id)
+        ).group_by(Review.reviewed_user_id, as_driver)
+    ).all()
+
+    totals = {}
+    for user_id, is_driver, *values in rows:
+        user_totals = totals.setdefault(user_id, dict.fromkeys(AGGREGATES, 0))
+        role = "driver" if is_driver else "passenger"
+        names = [f"{role}_{name}" for name in ("rating",) + SUB_SCORES]
+        for index, name in enumerate(names):
+            user_totals[f"{name}_sum"] += values[2 * index] or 0
+            user_totals[f"{name}_count"] += values[2 * index + 1]
+    return totals
+
+
+def _differs(row, expected: dict) -> bool:
+    for name, value in expected.items():
+        current = getattr(row, name)
+        if name.endswith("_rating"):
+            # Средние сравниваем с допуском: SQL и Python могут округлить по-разному
+            if current is None or abs(current - value) > 1e-9:
+                return True
+        elif current != value:
+            return True
+    return False
+
+
+def rebuild_ratings(session_factory=None, batch_size: int = RATINGS_REBUILD_BATCH) -> int:
+    """Пересчитать суммы и рейтинги всех пользователей из reviews; вернуть число исправленных"""
+    session_factory = session_factory or database.SessionLocal
+    users = User.__table__
+    stmt = update(users).where(users.c.id == bindparam("b_user_id")).values(
+        driver_rating=bindparam("b_driver_rating"),
+        passenger_rating=bindparam("b_passenger_rating"),
+        **{name: bindparam(f"b_{name}") for name in AGGREGATES}
+    )
+    columns = [users.c.id, users.c.telegram_id, users.c.driver_rating, users.c.passenger_rating]
+    columns += [users.c[name] for name in AGGREGATES]
+
+    fixed = 0
+    last_id = 0
+    while True:
+        with session_factory() as db:
+            # Строки пачки блокируются до записи: отзыв, добавленный во время
+            # пересчета, либо попадет в агрегат, либо прибавится после него
+            current = db.execute(
+                select(*columns).where(users.c.id > last_id).order_by(users.c.id)
+                .limit(batch_size).with_for_update()
+            ).all()
+            if not current:
+                return fixed
+            totals = _aggregate(db, current[0].id, current[-1].id)
+
+            params, changed = [], []
+            for row in current:
+                expected = totals.get(row.id) or dict.fromkeys(AGGREGATES, 0)
+                for role in ROLES:
+                    count = expected[f"{role}_rating_count"]
+                    expected[f"{role}_rating"] = (
+                        expected[f"{role}_rating_sum"] / count if count else DEFAULT_RATING
+                    )
+                if not _differs(row, expected):
+                    continue
+                params.append({"b_user_id": row.id, **{f"b_{name}": value for name, value in expected.items()}})
+                changed.append(row.telegram_id)
+                # Рейтинг в профиле изменился - сбросить кэш профиля в боте
+                record_user_change(db, row.telegram_id)
+
+            if params:
+                db.execute(stmt, params)
+            db.commit()
+
+        for telegram_id in changed:
+            invalidate_user(telegram_id)
+        fixed += len(params)
+        last_id = current[-1].id
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"✅ Рейтинги пересчитаны, исправлено пользователей: {rebuild_ratings()}")
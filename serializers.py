@@ -0,0 +1,161 @@
+# serializers.py - БЫСТРАЯ СЕРИАЛИЗАЦИЯ ПОЕЗДОК В JSON
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    # Без orjson работаем через стандартный json
+    orjson = None
+    FastJSONResponse = JSONResponse
+
+
+def format_departure(dt: datetime) -> Tuple[str, str]:
+    """Обе строки даты за один проход: ("YYYY-MM-DD", "DD.MM.YYYY HH:MM") без двух strftime"""
+    day = f"{dt.day:02d}"
+    month = f"{dt.month:02d}"
+    year = f"{dt.year:04d}"
+    return (
+        f"{year}-{month}-{day}",
+        f"{day}.{month}.{year} {dt.hour:02d}:{dt.minute:02d}"
+    )
+
+
+def _driver_name(driver) -> str:
+    return f"{driver.first_name} {driver.last_name or ''}".strip()
+
+
+def _enum_value(value) -> Optional[str]:
+    return value.value if value is not None else None
+
+
+def _departure_block(trip) -> Dict[str, Any]:
+    date_str, datetime_str = format_departure(trip.departure_date)
+    return {
+        "date": date_str,
+        "time": trip.departure_time,
+        "datetime": datetime_str
+    }
+
+
+def _route_block(trip) -> Dict[str, Any]:
+    return {
+        "from": trip.start_address,
+        "to": trip.finish_address,
+        "from_city": trip.start_city,
+        "to_city": trip.finish_city
+    }
+
+
+def _estimated_arrival(trip) -> Optional[str]:
+    arrival = trip.estimated_arrival
+    return arrival.isoformat() if arrival else None
+
+
+# --- Кодировщики под конкретную форму ответа ---
+
+def encode_trip(trip, driver=None) -> Dict[str, Any]:
+    """Полная карточка поездки (формат format_trip_response)"""
+    driver = driver if driver is not None else trip.driver
+    return {
+        "id": trip.id,
+        "driver": {
+            "id": driver.id,
+            "name": _driver_name(driver),
+            "rating": driver.driver_rating,
+            "phone": driver.phone
+        },
+        "route": _route_block(trip),
+        "departure": _departure_block(trip),
+        "seats": {
+            "available": trip.available_seats,
+            "price_per_seat": trip.price_per_seat
+        },
+        "details": {
+            "comment": trip.comment
+        },
+        "car_info": {
+            "model": driver.car_model,
+            "color": driver.car_color,
+            "plate": driver.car_plate,
+            "type": _enum_value(driver.car_type)
+        } if driver.has_car else None,
+        "status": trip.status.value,
+        "estimated_arrival": _estimated_arrival(trip)
+    }
+
+
+def encode_trip_search_row(row) -> Dict[str, Any]:
+    """Строка результатов поиска из проекции queries.SEARCH_TRIP_COLUMNS"""
+    first_name = row.driver_first_name
+    last_name = row.driver_last_name
+    return {
+        "id": row.id,
+        "driver": {
+            "id": row.driver_id,
+            "name": f"{first_name} {last_name or ''}".strip(),
+            "rating": row.driver_rating,
+            "avatar_initials": f"{first_name[0]}{last_name[0] if last_name else ''}"
+        },
+        "route": _route_block(row),
+        "departure": _departure_block(row),
+        "seats": {
+            "available": row.available_seats,
+            "price_per_seat": row.price_per_seat
+        },
+        "car_info": {
+            "model": row.driver_car_model,
+            "color": row.driver_car_color
+        } if row.driver_has_car else None,
+        "details": {
+            "comment": row.comment
+        },
+        "status": row.status.value,
+        "estimated_arrival": _estimated_arrival(row)
+    }
+
+
+def encode_trip_details(trip, driver=None) -> Dict[str, Any]:
+    """Детали поездки (GET /api/trips/{trip_id})"""
+    driver = driver if driver is not None else trip.driver
+    return {
+        "id": trip.id,
+        "driver": {
+            "id": driver.id,
+            "name": _driver_name(driver),
+            "rating": driver.driver_rating,
+            "phone": driver.phone
+        },
+        "route": _route_block(trip),
+        "departure": _departure_block(trip),
+        "seats": {
+            "available": trip.available_seats,
+            "price_per_seat": trip.price_per_seat
+        },
+        "details": {
+            "comment": trip.comment
+        },
+        "car_info": {
+            "model": driver.car_model,
+            "color": driver.car_color,
+            "plate": driver.car_plate,
+            "type": _enum_value(driver.car_type)
+        } if driver.has_car else None,
+        "status": trip.status.value
+    }
+
+
+def encode_message(message) -> Dict[str, Any]:
+    """Сообщение чата (ORM-объект или Row с теми же полями)"""
+    return {
+        "id": message.id,
+        "booking_id": message.booking_id,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "content": message.content,
+        "is_read": bool(message.is_read),
+        "sent_at": message.sent_at.isoformat()
+    }
@@ -0,0 +1,198 @@
+# slow_queries.py - ЖУРНАЛ МЕДЛЕННЫХ ЗАПРОСОВ И СТАТИСТИКА ПО ОТПЕЧАТКАМ
+#
+# Каждый выполненный запрос приводится к отпечатку (литералы и параметры -> ?,
+# списки IN (...) -> (?+)), по отпечатку копятся число вызовов и p50/p95/p99.
+# Запросы дольше SLOW_QUERY_MS пишутся в лог с параметрами и эндпоинтом.
+# Отпечатки кэшируются по тексту запроса, поэтому в проде накладные расходы -
+# один словарь и одна запись в кольцевой буфер на запрос. Регулярные выражения
+# отпечатка и сортировка замеров для отчета выполняются вне общей блокировки:
+# ее держат все потоки, выполняющие SQL.
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Параметры содержат персональные данные (тексты сообщений, телефоны) - по умолчанию не пишем
+SLOW_QUERY_LOG_PARAMS = os.getenv("SLOW_QUERY_LOG_PARAMS", "false").lower() in ("1", "true", "yes")
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "500"))
+# Сколько последних замеров хранить на отпечаток для перцентилей
+SLOW_QUERY_SAMPLES = int(os.getenv("SLOW_QUERY_SAMPLES", "1024"))
+# Последние медленные запросы для /api/debug/slow-queries
+SLOW_QUERY_RECENT = int(os.getenv("SLOW_QUERY_RECENT", "100"))
+
+PARAMS_PREVIEW = 500
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?(?![\w.])")
+_PLACEHOLDER_RE = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+|\?")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_RE = re.compile(r"\bVALUES\s*\(.*?\)(?:\s*,\s*\(.*?\))*", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+\"?(\w+)\"?", re.IGNORECASE)
+
+
+def fingerprint(statement: str) -> str:
+    """Нормализованный текст запроса: без литералов, значений параметров и длины списков"""
+    text = _STRING_RE.sub("?", statement)
+    text = _PLACEHOLDER_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("IN (?+)", text)
+    text = _VALUES_RE.sub("VALUES (?+)", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def statement_tables(fingerprint_text: str) -> List[str]:
+    return sorted(set(name.lower() for name in _TABLE_RE.findall(fingerprint_text)))
+
+
+def _percentile(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(q * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class FingerprintStats:
+    """Счетчики и кольцевой буфер замеров одного отпечатка"""
+
+    __slots__ = ("fingerprint", "tables", "count", "total_ms", "max_ms", "slow_count",
+                 "samples", "_next", "first_seen", "last_seen")
+
+    def __init__(self, fingerprint_text: str):
+        self.fingerprint = fingerprint_text
+        self.tables = statement_tables(fingerprint_text)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow_count = 0
+        self.samples: List[float] = []
+        self._next = 0
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+
+    def add(self, elapsed_ms: float, slow: bool):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.last_seen = time.time()
+        if slow:
+            self.slow_count += 1
+        if len(self.samples) < SLOW_QUERY_SAMPLES:
+            self.samples.append(elapsed_ms)
+        else:
+            self.samples[self._next] = elapsed_ms
+            self._next = (self._next + 1) % SLOW_QUERY_SAMPLES
+
+    def copy(self) -> tuple:
+        """Копия счетчиков и замеров (быстро, под блокировкой журнала)"""
+        return (self.fingerprint, self.tables, self.count, self.total_ms, self.max_ms,
+                self.slow_count, list(self.samples), self.first_seen, self.last_seen)
+
+
+def _snapshot(copy: tuple) -> dict:
+    """Строка отчета из FingerprintStats.copy(): сортировка и перцентили без блокировки"""
+    fingerprint_text, tables, count, total_ms, max_ms, slow_count, samples, first_seen, last_seen = copy
+    samples.sort()
+    return {
+        "fingerprint": fingerprint_text,
+        "tables": tables,
+        "count": count,
+        "slow_count": slow_count,
+        "avg_ms": round(total_ms / count, 3) if count else 0.0,
+        "p50_ms": round(_percentile(samples, 0.50), 3),
+        "p95_ms": round(_percentile(samples, 0.95), 3),
+        "p99_ms": round(_percentile(samples, 0.99), 3),
+        "max_ms": round(max_ms, 3),
+        "first_seen": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(first_seen)),
+        "last_seen": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(last_seen))
+    }
+
+
+class SlowQueryLog:
+    """Статистика по отпечаткам + журнал медленных запросов"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold_ms = threshold_ms
+        self._lock = threading.Lock()
+        self._fingerprints: Dict[str, FingerprintStats] = {}
+        # Кэш "текст запроса -> отпечаток": SQLAlchemy генерирует одни и те же строки
+        self._fingerprint_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._recent: List[dict] = []
+
+    def _fingerprint(self, statement: str) -> str:
+        with self._cache_lock:
+            cached = self._fingerprint_cache.get(statement)
+        if cached is not None:
+            return cached
+        # Регулярные выражения (VALUES большого executemany) - без блокировок;
+        # два потока могут посчитать один отпечаток дважды, результат одинаковый
+        cached = fingerprint(statement)
+        with self._cache_lock:
+            self._fingerprint_cache[statement] = cached
+            if len(self._fingerprint_cache) > SLOW_QUERY_MAX_FINGERPRINTS * 4:
+                self._fingerprint_cache.popitem(last=False)
+        return cached
+
+    def record(self, statement: str, parameters, elapsed_ms: float, endpoint: Optional[str] = None):
+        slow = elapsed_ms >= self.threshold_ms
+        key = self._fingerprint(statement)
+        with self._lock:
+            stats = self._fingerprints.get(key)
+            if stats is None:
+                if len(self._fingerprints) >= SLOW_QUERY_MAX_FINGERPRINTS:
+                    # Защита от неограниченного роста: редкие запросы копим в одном ведре
+                    key = "<other>"
+                    stats = self._fingerprints.get(key)
+                if stats is None:
+                    stats = self._fingerprints[key] = FingerprintStats(key)
+            stats.add(elapsed_ms, slow)
+
+            if not slow:
+                return
+            entry = {
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+                "ms": round(elapsed_ms, 3),
+                "endpoint": endpoint,
+                "fingerprint": key,
+                "params": repr(parameters)[:PARAMS_PREVIEW] if SLOW_QUERY_LOG_PARAMS else None
+            }
+            self._recent.append(entry)
+            if len(self._recent) > SLOW_QUERY_RECENT:
+                del self._recent[0]
+
+        logger.warning(
+            f"🐢 Медленный запрос {elapsed_ms:.1f} мс [{endpoint or 'вне HTTP-запроса'}]: "
+            f"{statement[:PARAMS_PREVIEW]} | params={entry['params']}"
+        )
+
+    def report(self, limit: int = 20, table: Optional[str] = None, order_by: str = "p95_ms") -> dict:
+        with self._lock:
+            copies = [stats.copy() for stats in self._fingerprints.values()]
+            recent = list(self._recent)
+        rows = [_snapshot(copy) for copy in copies]
+        if table:
+            table = table.lower()
+            rows = [row for row in rows if table in row["tables"]]
+            recent = [entry for entry in recent if table in statement_tables(entry["fingerprint"])]
+        rows.sort(key=lambda row: row.get(order_by, 0), reverse=True)
+        return {
+            "threshold_ms": self.threshold_ms,
+            "fingerprints": len(rows),
+            "top": rows[:limit],
+            "recent_slow": recent[-limit:]
+        }
+
+    def reset(self):
+        with self._lock:
+            self._fingerprints.clear()
+            self._recent.clear()
+
+
+slow_query_log = SlowQueryLog()
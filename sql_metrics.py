@@ -0,0 +1,201 @@
+# sql_metrics.py - ИНСТРУМЕНТАЦИЯ SQL-ЗАПРОСОВ ПО HTTP-ЗАПРОСАМ
+#
+# Хуки before/after_cursor_execute считают запросы и время в БД для текущего
+# HTTP-запроса (contextvar), итог уходит в заголовок Server-Timing и в
+# агрегированные метрики по эндпоинтам. В режиме SQL_DEBUG дополнительно
+# ищутся N+1: одинаковые запросы и ленивые загрузки связей, повторяющиеся
+# в одном HTTP-запросе (как trip.driver в цикле по поездкам).
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from slow_queries import slow_query_log
+
+logger = logging.getLogger(__name__)
+
+SQL_DEBUG = os.getenv("SQL_DEBUG", "false").lower() in ("1", "true", "yes")
+# Сколько одинаковых запросов за один HTTP-запрос считать N+1
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+# Сколько символов запроса хранить для самого медленного
+STATEMENT_PREVIEW = 300
+
+
+class RequestSQLStats:
+    """SQL-статистика одного HTTP-запроса"""
+
+    def __init__(self, endpoint: Optional[str] = None):
+        self.endpoint = endpoint
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_statement: Optional[str] = None
+        # Потоковый ответ: запросы выполняются при отправке тела, после middleware
+        self.streaming = False
+        # Только в режиме SQL_DEBUG
+        self.statements: Counter = Counter()
+        self.lazy_loads: Counter = Counter()
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.slowest_ms:
+            self.slowest_ms = elapsed_ms
+            self.slowest_statement = statement
+        if SQL_DEBUG:
+            self.statements[statement] += 1
+
+    def n_plus_one(self) -> list:
+        """Повторяющиеся запросы и ленивые загрузки (только SQL_DEBUG)"""
+        suspects = []
+        for source, count in self.lazy_loads.most_common():
+            if count >= SQL_N_PLUS_ONE_THRESHOLD:
+                suspects.append({"lazy_load": source, "count": count})
+        for statement, count in self.statements.most_common():
+            if count >= SQL_N_PLUS_ONE_THRESHOLD:
+                suspects.append({"statement": statement[:STATEMENT_PREVIEW], "count": count})
+        return suspects
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing"""
+        return (
+            f'db;dur={self.total_ms:.2f};desc="{self.count} queries", '
+            f'db-slowest;dur={self.slowest_ms:.2f}'
+        )
+
+
+_current: ContextVar[Optional[RequestSQLStats]] = ContextVar("sql_request_stats", default=None)
+
+
+def start_request(endpoint: Optional[str] = None) -> RequestSQLStats:
+    stats = RequestSQLStats(endpoint)
+    _current.set(stats)
+    return stats
+
+
+def current_stats() -> Optional[RequestSQLStats]:
+    return _current.get()
+
+
+def mark_streaming():
+    """Эндпоинт отдает StreamingResponse: его SQL-статистика к моменту заголовков неполная"""
+    stats = _current.get()
+    if stats is not None:
+        stats.streaming = True
+
+
+class EndpointMetrics:
+    """Накопленные метрики одного эндпоинта"""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_ms = 0.0
+        self.max_db_ms = 0.0
+        self.n_plus_one = 0
+        self.slowest_ms = 0.0
+        self.slowest_statement: Optional[str] = None
+
+    def add(self, stats: RequestSQLStats, suspects: list):
+        self.requests += 1
+        self.queries += stats.count
+        self.max_queries = max(self.max_queries, stats.count)
+        self.db_ms += stats.total_ms
+        self.max_db_ms = max(self.max_db_ms, stats.total_ms)
+        if suspects:
+            self.n_plus_one += 1
+        if stats.slowest_ms > self.slowest_ms:
+            self.slowest_ms = stats.slowest_ms
+            self.slowest_statement = (stats.slowest_statement or "")[:STATEMENT_PREVIEW]
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "queries": {
+                "total": self.queries,
+                "avg": round(self.queries / self.requests, 2) if self.requests else 0.0,
+                "max": self.max_queries
+            },
+            "db_ms": {
+                "total": round(self.db_ms, 3),
+                "avg": round(self.db_ms / self.requests, 3) if self.requests else 0.0,
+                "max": round(self.max_db_ms, 3)
+            },
+            "n_plus_one_requests": self.n_plus_one,
+            "slowest": {
+                "ms": round(self.slowest_ms, 3),
+                "statement": self.slowest_statement
+            }
+        }
+
+
+_endpoints: Dict[str, EndpointMetrics] = {}
+_endpoints_lock = threading.Lock()
+
+
+def finish_request(endpoint: str, stats: RequestSQLStats) -> list:
+    """Учесть запрос в агрегатах; вернуть найденные подозрения на N+1"""
+    suspects = stats.n_plus_one() if SQL_DEBUG else []
+    if suspects:
+        logger.warning(f"⚠️  Возможный N+1 в {endpoint}: {suspects}")
+    with _endpoints_lock:
+        metrics = _endpoints.get(endpoint)
+        if metrics is None:
+            metrics = _endpoints[endpoint] = EndpointMetrics()
+        metrics.add(stats, suspects)
+    return suspects
+
+
+def endpoint_metrics() -> dict:
+    with _endpoints_lock:
+        return {endpoint: metrics.snapshot() for endpoint, metrics in sorted(_endpoints.items())}
+
+
+def reset_metrics():
+    with _endpoints_lock:
+        _endpoints.clear()
+
+
+def instrument_engine(sync_engine):
+    """Подписать движок на замер запросов (для async - передавать async_engine.sync_engine)"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, elapsed_ms)
+        slow_query_log.record(statement, parameters, elapsed_ms, stats.endpoint if stats is not None else None)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(exception_context):
+        # after_cursor_execute при ошибке не вызывается - снимаем отметку времени здесь
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+if SQL_DEBUG:
+    @event.listens_for(Session, "do_orm_execute")
+    def _on_orm_execute(orm_execute_state):
+        # Ленивая загрузка связи конкретного объекта: в цикле это и есть N+1
+        if not orm_execute_state.is_select:
+            return
+        loaded_from = orm_execute_state.lazy_loaded_from
+        stats = _current.get()
+        if loaded_from is None or stats is None:
+            return
+        target = orm_execute_state.bind_mapper
+        target_name = target.class_.__name__ if target is not None else "?"
+        stats.lazy_loads[f"{loaded_from.class_.__name__} -> {target_name}"] += 1
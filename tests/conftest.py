@@ -0,0 +1,17 @@
+# conftest.py - ОКРУЖЕНИЕ ТЕСТОВ
+#
+# Переменные задаются до импорта модулей проекта: database.py создает движок,
+# а minimal_bot.py читает токен и настраивает логи при импорте. Рабочие
+# travel_companion.db, bot.log и токен из .env тесты не трогают
+# (load_dotenv не перезаписывает уже заданные переменные).
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="travel-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ["TELEGRAM_BOT_TOKEN"] = "123456:TEST"
+os.environ["LOG_FILE"] = ""
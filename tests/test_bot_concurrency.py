@@ -0,0 +1,141 @@
+# test_bot_concurrency.py - КОМАНДЫ БОТА ОБСЛУЖИВАЮТСЯ ПАРАЛЛЕЛЬНО
+#
+# N одновременных /stats из разных чатов проходят через настоящие обработчики
+# build_application(): очередь обновлений Application, stats_command, bot_db.
+# Каждый SQL-запрос к временной SQLite искусственно задерживается
+# (before_cursor_execute), Bot API заменен заглушкой без сети. Если бы запросы
+# выполнялись прямо в event loop или обновления шли по очереди, команды
+# заняли бы N x задержку, а heartbeat-задача просыпалась бы с опозданием.
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import bot_db
+import database
+import minimal_bot
+
+COMMANDS = 8
+QUERY_LATENCY = 0.1  # секунды на каждый SQL-запрос
+QUERIES_PER_STATS = 2  # bot_db.STATS и bot_db.RECENT_USERS
+HEARTBEAT = 0.01
+
+
+class FakeBotAPI(BaseRequest):
+    """Bot API без сети: отвечает на getMe и sendMessage, запоминает отправленное"""
+
+    def __init__(self, expected_messages: int):
+        self.sent = []
+        self.expected_messages = expected_messages
+        self.all_sent = asyncio.Event()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Travel", "username": "travel_test_bot"}
+        elif api_method == "sendMessage":
+            self.sent.append(params)
+            if len(self.sent) >= self.expected_messages:
+                self.all_sent.set()
+            result = {
+                "message_id": len(self.sent), "date": int(time.time()),
+                "chat": {"id": params["chat_id"], "type": "private"}, "text": params["text"]
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+def stats_update(number: int) -> dict:
+    chat_id = 1000 + number
+    return {
+        "update_id": number,
+        "message": {
+            "message_id": number, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"User{number}"},
+            "text": "/stats",
+            "entities": [{"type": "bot_command", "offset": 0, "length": len("/stats")}]
+        }
+    }
+
+
+async def dispatch_stats(application: Application, api: FakeBotAPI):
+    """Отправить COMMANDS обновлений /stats; вернуть (время до последнего ответа, макс. задержку loop)"""
+    lag = 0.0
+    stop = asyncio.Event()
+
+    async def heartbeat():
+        nonlocal lag
+        while not stop.is_set():
+            expected = time.perf_counter() + HEARTBEAT
+            await asyncio.sleep(HEARTBEAT)
+            lag = max(lag, time.perf_counter() - expected)
+
+    await application.initialize()
+    await application.start()
+    beat = asyncio.create_task(heartbeat())
+    try:
+        started = time.perf_counter()
+        for number in range(COMMANDS):
+            update = minimal_bot.Update.de_json(stats_update(number), application.bot)
+            await application.update_queue.put(update)
+        await asyncio.wait_for(api.all_sent.wait(), timeout=COMMANDS * QUERIES_PER_STATS * QUERY_LATENCY * 2)
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        await beat
+        await application.stop()
+        await application.shutdown()
+    return elapsed, lag
+
+
+def test_concurrent_stats_commands_run_in_parallel(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bot.db'}", connect_args={"check_same_thread": False})
+    database.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add_all([
+            database.User(telegram_id=500 + i, first_name=f"User{i}", registration_date=datetime(2026, 10, 1))
+            for i in range(3)
+        ])
+        db.commit()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def slow_network(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(QUERY_LATENCY)
+
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+    api = FakeBotAPI(expected_messages=COMMANDS)
+    builder = Application.builder
+    monkeypatch.setattr(Application, "builder", staticmethod(
+        lambda: builder().request(api).get_updates_request(api)
+    ))
+    application = minimal_bot.build_application(db_available=True)
+
+    try:
+        elapsed, lag = asyncio.run(dispatch_stats(application, api))
+    finally:
+        engine.dispose()
+
+    assert len(api.sent) == COMMANDS
+    assert all("Статистика системы" in message["text"] for message in api.sent)
+    assert {message["chat_id"] for message in api.sent} == {1000 + number for number in range(COMMANDS)}
+
+    sequential = COMMANDS * QUERIES_PER_STATS * QUERY_LATENCY
+    assert elapsed < sequential / 2, f"{COMMANDS} команд заняли {elapsed:.2f} сек (по очереди - {sequential:.2f})"
+    # Запрос в event loop задержал бы heartbeat на QUERY_LATENCY и больше
+    assert lag < QUERY_LATENCY / 2, f"event loop простаивал {lag * 1000:.0f} мс"
@@ -0,0 +1,139 @@
+# unread_counters.py - СЧЕТЧИКИ НЕПРОЧИТАННЫХ СООБЩЕНИЙ
+#
+# users.unread_messages и bookings.passenger_unread/driver_unread меняются в той
+# же транзакции, что и сами сообщения (/api/messages/send и /api/messages/read),
+# поэтому бейдж читается одной строкой по первичному ключу, без COUNT(*) по messages.
+# Счетчики расходятся с данными, только если сообщения меняют в обход API
+# (каскадное удаление бронирования, ручные правки) - UnreadReconciler раз в
+# UNREAD_RECONCILE_INTERVAL пересчитывает их из messages пачками по id.
+# Ручной пересчет: python unread_counters.py
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import func, or_, select, update
+
+import database
+from database import Booking, Message, User
+
+logger = logging.getLogger(__name__)
+
+UNREAD_RECONCILE_INTERVAL = float(os.getenv("UNREAD_RECONCILE_INTERVAL", "3600"))  # секунды, 0 - не запускать
+UNREAD_RECONCILE_BATCH = int(os.getenv("UNREAD_RECONCILE_BATCH", "1000"))
+
+
+def _unread_count(*conditions):
+    return select(func.count(Message.id)).where(Message.is_read == False, *conditions).scalar_subquery()
+
+
+def _reconcile(model, counters: dict, session_factory, batch_size: int) -> int:
+    """Пересчитать колонки counters таблицы model пачками по id; вернуть число исправленных строк"""
+    # onupdate-колонки (users.updated_at) оставляем как есть: счетчики не меняют профиль
+    keep = {column.key: column for column in model.__table__.columns if column.onupdate is not None}
+    fixed = 0
+    last_id = 0
+    while True:
+        with session_factory() as db:
+            # Строки пачки блокируются до пересчета: отправка и прочтение сообщений
+            # этих пользователей ждут, и их изменения счетчика не теряются
+            ids = db.execute(
+                select(model.id).where(model.id > last_id).order_by(model.id).limit(batch_size).with_for_update()
+            ).scalars().all()
+            if not ids:
+                return fixed
+            result = db.execute(
+                update(model).where(
+                    model.id.between(ids[0], ids[-1]),
+                    or_(*(getattr(model, name) != value for name, value in counters.items()))
+                ).values(**counters, **keep),
+                execution_options={"synchronize_session": False}
+            )
+            db.commit()
+        fixed += result.rowcount
+        last_id = ids[-1]
+
+
+def reconcile_users(session_factory=None, batch_size: int = UNREAD_RECONCILE_BATCH) -> int:
+    return _reconcile(User, {
+        "unread_messages": _unread_count(Message.receiver_id == User.id)
+    }, session_factory or database.SessionLocal, batch_size)
+
+
+def reconcile_bookings(session_factory=None, batch_size: int = UNREAD_RECONCILE_BATCH) -> int:
+    return _reconcile(Booking, {
+        "passenger_unread": _unread_count(Message.booking_id == Booking.id,
+                                          Message.receiver_id == Booking.passenger_id),
+        "driver_unread": _unread_count(Message.booking_id == Booking.id,
+                                       Message.receiver_id != Booking.passenger_id)
+    }, session_factory or database.SessionLocal, batch_size)
+
+
+class UnreadReconciler:
+    """Фоновый поток, периодически сверяющий счетчики непрочитанных с messages"""
+
+    def __init__(self, session_factory=None, interval: float = UNREAD_RECONCILE_INTERVAL,
+                 batch_size: int = UNREAD_RECONCILE_BATCH):
+        self._session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.runs = 0
+        self.fixed_users = 0
+        self.fixed_bookings = 0
+        self.last_duration: Optional[float] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> dict:
+        started = time.perf_counter()
+        session_factory = self._session_factory or database.SessionLocal
+        users = reconcile_users(session_factory, self.batch_size)
+        bookings = reconcile_bookings(session_factory, self.batch_size)
+        self.runs += 1
+        self.fixed_users += users
+        self.fixed_bookings += bookings
+        self.last_duration = time.perf_counter() - started
+        if users or bookings:
+            logger.warning(f"⚠️ Счетчики непрочитанных исправлены: пользователей {users}, бронирований {bookings}")
+        return {"users": users, "bookings": bookings}
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка пересчета счетчиков непрочитанных: {e}")
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="UnreadReconciler")
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "interval": self.interval,
+            "runs": self.runs,
+            "fixed_users": self.fixed_users,
+            "fixed_bookings": self.fixed_bookings,
+            "last_duration": self.last_duration
+        }
+
+
+unread_reconciler = UnreadReconciler()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    result = unread_reconciler.run_once()
+    logger.info(f"✅ Пересчет завершен за {unread_reconciler.last_duration:.2f} сек: "
+                f"пользователей {result['users']}, бронирований {result['bookings']}")
@@ -0,0 +1,118 @@
+# user_cache.py - КЭШ ИДЕНТИФИКАЦИИ ПОЛЬЗОВАТЕЛЕЙ ПО telegram_id
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple, Optional
+
+# Настройки кэша (можно переопределить через переменные окружения)
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # секунды
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением размера и временем жизни записей"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class CachedUser(NamedTuple):
+    """Компактная запись пользователя для горячих эндпоинтов"""
+    id: int
+    telegram_id: int
+    first_name: str
+    last_name: Optional[str]
+    username: Optional[str]
+    phone: Optional[str]
+    role: str
+    has_car: bool
+    driver_rating: float
+    passenger_rating: float
+    total_driver_trips: int
+    total_passenger_trips: int
+
+    @classmethod
+    def from_user(cls, user) -> "CachedUser":
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            username=user.username,
+            phone=user.phone,
+            role=user.role.value if user.role else "passenger",
+            has_car=bool(user.has_car),
+            driver_rating=user.driver_rating,
+            passenger_rating=user.passenger_rating,
+            total_driver_trips=user.total_driver_trips,
+            total_passenger_trips=user.total_passenger_trips
+        )
+
+
+user_cache = TTLCache(max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL)
+
+
+def remember_user(user) -> CachedUser:
+    """Положить ORM-пользователя в кэш и вернуть компактную запись"""
+    record = CachedUser.from_user(user)
+    user_cache.set(record.telegram_id, record)
+    return record
+
+
+def invalidate_user(telegram_id: int):
+    """Сбросить запись после изменения профиля, автомобиля или рейтинга"""
+    user_cache.delete(telegram_id)
+
+
+def invalidate_users(telegram_ids):
+    """Сбросить записи пользователей, измененных другими процессами (лента user_changes)"""
+    for telegram_id in telegram_ids:
+        user_cache.delete(telegram_id)